@@ -4,8 +4,10 @@ from collections import defaultdict
 from economicsl import Simulation
 from resilience.markets import AssetMarket
 from resilience.agents import Bank
-from resilience.contracts import Deposit, Other, AssetCollateral
+from resilience.contracts import Deposit, Other
 from resilience.parameters import Parameters as defaultparam
+from resilience.runner import is_quiescent
+from resilience.snapshot import Snapshot
 
 NBANKS = 48
 def get_extent_of_systemic_event(out):
@@ -54,6 +56,10 @@ class Parameters(defaultparam):
     POSTDEFAULT_FIRESALE_CONTAGION = True
     POSTDEFAULT_PULLFUNDING_CONTAGION = True
 
+def load_balance_sheets(path='EBA_2018.csv'):
+    with open(path, 'r') as data:
+        return data.read().strip().split('\n')[1:]
+
 class Model:
     def __init__(self):
         self.simulation = None
@@ -68,22 +74,26 @@ class Model:
         """
         new_price = self.assetMarket.get_price(assetType) * (1.0 - fraction)
         self.assetMarket.set_price(assetType, new_price)
-        for agent in self.allAgents:
-            for asset in agent.get_ledger().get_assets_of_type(AssetCollateral):
-                if asset.get_asset_type() == assetType:
-                    asset.update_price()
+        if Parameters.LAZY_ASSET_VALUATION:
+            # The holders pick up the new price when they next read their
+            # balance sheet
+            return
+        for asset in self.assetMarket.get_holdings(assetType):
+            asset.update_price()
 
     def devalueCommonAsset(self, assetType, priceLost):
-        """ devaluates a common asset for all agents """
-        for agent in self.allAgents:
-            agent.devalue_asset_collateral_of_type(assetType, priceLost)
+        """ devaluates a common asset for all of its holders """
+        self.assetMarket.devalue_common_asset(assetType, priceLost)
 
-    def initialize(self):
+    def initialize(self, bank_balancesheets=None):
         self.simulation = Simulation()
+        # The number of defaults so far, counted by Institution.handle_default
+        self.ndefaults = 0
         self.allAgents = []
         self.assetMarket = AssetMarket(self)
-        with open('EBA_2018.csv', 'r') as data:
-            self.bank_balancesheets = data.read().strip().split('\n')[1:]
+        if bank_balancesheets is None:
+            bank_balancesheets = load_balance_sheets()
+        self.bank_balancesheets = bank_balancesheets
         for bs in self.bank_balancesheets:
             row = bs.split(' ')
             bank_name, CET1E, leverage, debt_sec, gov_bonds = row
@@ -162,12 +172,38 @@ class Model:
             total_sold.append(
                 sum(self.assetMarket.cumulative_quantities_sold.values()) /
                 sum(self.assetMarket.total_quantities.values()))
+            if is_quiescent(self.allAgents, self.assetMarket, defaults[-1]):
+                # The cascade has stopped, the remaining timesteps would not
+                # change anything
+                remaining = Parameters.SIMULATION_TIMESTEPS - self.get_time()
+                defaults += [0] * remaining
+                total_sold += [total_sold[-1]] * remaining
+                break
         return defaults, total_sold
 
-eu = Model()
-eu.initialize()
-defaults, total_sold = eu.run_simulation()
-# defaults and total_sold output are for each simulation timesteps
-print("Result:")
-print("1. Defaults", defaults)
-print("2. Total sold", total_sold)
+def make_baseline(bank_balancesheets=None):
+    """
+    Returns a Snapshot of the initialized model, from which each scenario
+    starts
+    """
+    model = Model()
+    model.initialize(bank_balancesheets)
+    return Snapshot(model)
+
+def run_scenario(baseline, scenario):
+    """
+    Run one (ASSET_TO_SHOCK, INITIAL_SHOCK) scenario on a fork of the
+    baseline. To be used with resilience.runner.run_parallel, with the
+    baseline as the shared calibration.
+    """
+    Parameters.ASSET_TO_SHOCK, Parameters.INITIAL_SHOCK = scenario
+    return baseline.fork().run_simulation()
+
+if __name__ == '__main__':
+    eu = Model()
+    eu.initialize()
+    defaults, total_sold = eu.run_simulation()
+    # defaults and total_sold output are for each simulation timesteps
+    print("Result:")
+    print("1. Defaults", defaults)
+    print("2. Total sold", total_sold)
@@ -10,18 +10,36 @@ class SellAsset(Action):
         super().__init__(me)
         self.asset = asset
 
+    def _get_quantity_to_sell(self):
+        if self.asset.get_price() <= 0:
+            return 0.0
+        quantityToSell = self.get_amount() / self.asset.get_price()
+        if abs(quantityToSell) <= eps:
+            # do not perform is quantity is negligible
+            return 0.0
+        max_qty = self.get_max() / self.asset.get_price()
+        assert max_qty >= quantityToSell - eps, (max_qty, quantityToSell, self.get_amount())
+        assert quantityToSell > 0, quantityToSell  # positive value
+        return quantityToSell
+
     def perform(self):
         super().perform()
-        if self.asset.get_price() > 0:
-            quantityToSell = self.get_amount() / self.asset.get_price()
-            if abs(quantityToSell) <= eps:
-                # do not perform is quantity is negligible
-                return
-            max_qty = self.get_max() / self.asset.get_price()
-            assert max_qty >= quantityToSell - eps, (max_qty, quantityToSell, self.get_amount())
-            assert quantityToSell > 0, quantityToSell  # positive value
+        quantityToSell = self._get_quantity_to_sell()
+        if quantityToSell > 0:
             self.asset.put_for_sale(quantityToSell)
 
+    def perform_batched(self, orders):
+        """
+        perform, except that the market order is added to `orders`, i.e.
+        market -> (assets, quantities), to be put for sale in bulk
+        """
+        super().perform()
+        quantity = self.asset.mark_for_sale(self._get_quantity_to_sell())
+        if quantity != 0:
+            assets, quantities = orders.setdefault(self.asset.assetMarket, ([], []))
+            assets.append(self.asset)
+            quantities.append(quantity)
+
     def get_max(self):
         return self.asset.get_unencumbered_valuation() - self.asset.putForSale_ * self.asset.price
 
@@ -0,0 +1,69 @@
+from collections import defaultdict
+
+
+class ActionIndex(object):
+    """
+    The eligible actions of an institution grouped by the name of their
+    class, as returned by Institution.get_available_actions, but maintained
+    incrementally: only the contracts that were added or changed since the
+    last call of get_available_actions (see notify_parties) have their
+    eligibility checked again. The actions of each class are kept in the
+    order of the ledger.
+    """
+    __slots__ = 'me', 'seq', 'filed', 'actions', 'views', 'stale', 'unsorted'
+
+    def __init__(self, me, contracts):
+        self.me = me
+        # contract -> position in the ledger
+        self.seq = {}
+        # contract -> name of the action class it is filed under, if eligible
+        self.filed = {}
+        # action class name -> {contract: action}
+        self.actions = defaultdict(dict)
+        # action class name -> list of actions
+        self.views = {}
+        # the contracts to be checked again (a dict is used as an ordered set)
+        self.stale = {}
+        self.unsorted = set()
+        for contract in contracts:
+            self.mark_stale(contract)
+
+    def mark_stale(self, contract) -> None:
+        if contract not in self.seq:
+            self.seq[contract] = len(self.seq)
+        self.stale[contract] = None
+
+    def _refile(self, contract) -> None:
+        old_name = self.filed.get(contract)
+        if contract.is_eligible(self.me):
+            action = contract.get_action(self.me)
+            name = type(action).__name__
+            if name != old_name:
+                if old_name is not None:
+                    del self.actions[old_name][contract]
+                    self.views.pop(old_name, None)
+                bucket = self.actions[name]
+                if bucket and self.seq[contract] < self.seq[next(reversed(bucket))]:
+                    self.unsorted.add(name)
+                self.filed[contract] = name
+            bucket = self.actions[name]
+            if bucket.get(contract) is not action:
+                bucket[contract] = action
+                self.views.pop(name, None)
+        elif old_name is not None:
+            del self.actions[old_name][contract]
+            del self.filed[contract]
+            self.views.pop(old_name, None)
+
+    def get_available_actions(self):
+        for contract in self.stale:
+            self._refile(contract)
+        self.stale.clear()
+        for name in self.unsorted:
+            bucket = self.actions[name]
+            self.actions[name] = dict(sorted(bucket.items(), key=lambda item: self.seq[item[0]]))
+        self.unsorted.clear()
+        for name, bucket in self.actions.items():
+            if name not in self.views:
+                self.views[name] = list(bucket.values())
+        return self.views
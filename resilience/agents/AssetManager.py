@@ -2,7 +2,7 @@ import logging
 
 import numpy as np
 
-from ..contracts import Shares
+from ..contracts import Shares, ShareRegistry
 from ..parameters import eps, isequal_float
 from .Institution import Institution
 from .DefaultException import DefaultException
@@ -15,8 +15,13 @@ class AssetManager(Institution):
         self.nShares = 0
         self.NAV_lr_previous = 0  # lr stands for loss relative
         self.nShares_extra_previous = 0
+        # See SHARE_REGISTRY
+        self.share_registry = ShareRegistry(self) if self.params.SHARE_REGISTRY else None
 
     def update_valuation_of_all_shares(self) -> None:
+        if self.share_registry is not None:
+            self.share_registry.update_valuation()
+            return
         for share in self.shares:
             share.update_valuation()
 
@@ -28,9 +33,17 @@ class AssetManager(Institution):
         """
         self.nShares += quantity
         self.update_valuation_of_all_shares()
+        if self.share_registry is not None:
+            return self.share_registry.new_shares(owner, quantity, self.get_net_asset_valuation())
         return Shares(owner, self, quantity, self.get_net_asset_valuation())
 
     def get_net_asset_valuation(self) -> float:
+        # nShares only changes along with the balance sheet (issuance at
+        # initialisation, when nothing is memoized, and redemptions, which
+        # notify), so the NAV can be memoized with it
+        return self.memoize('NAV', self._compute_net_asset_valuation)
+
+    def _compute_net_asset_valuation(self) -> float:
         # This condition is added to avoid divide-by-zero
         if self.nShares > 0:
             return self.get_equity_valuation() / self.nShares
@@ -55,6 +68,14 @@ class AssetManager(Institution):
                 logging.debug("A matured obligation was not fulfilled.\nDEFAULT DUE TO LACK OF LIQUIDITY")
                 raise DefaultException(self, DefaultException.TypeOfDefault.LIQUIDITY)
 
+    def is_below_buffer(self) -> bool:
+        # Pending redemptions, or cash below the firesale threshold of
+        # choose_actions
+        if self.nShares_extra_previous > 0:
+            return True
+        _A = self.get_asset_valuation()
+        return _A != 0 and self.get_cash() / _A < 0.9 * self.cash_fraction_initial
+
     def trigger_default(self) -> None:
         super().trigger_default()
         # perform firesale assets
@@ -74,11 +95,18 @@ class AssetManager(Institution):
         _amount_to_redeem = self.nShares_extra_previous * self.NAV_previous
         if self.get_ue_cash() < _amount_to_redeem:
             raise DefaultException(self, DefaultException.TypeOfDefault.LIQUIDITY)
-        share = self.shares[0]  # There is only 1 share object
         # NOTE: share.redeem() is called directly here instead of using RedeemSharesOblgn.fulfil()
         # because asset manager investor is currently None instead of an agent
         # TODO ideally this should be within the obligation framework as well
-        share.redeem(self.nShares_extra_previous, _amount_to_redeem)
+        if self.share_registry is not None:
+            # The shares of all the holders are redeemed pro rata, at once
+            nShares = self.share_registry.get_column('nShares')
+            total = nShares.sum().item()
+            if self.nShares_extra_previous > 0 and total > 0:
+                self.share_registry.redeem(nShares * (self.nShares_extra_previous / total), self.NAV_previous)
+        else:
+            share = self.shares[0]  # There is only 1 share object
+            share.redeem(self.nShares_extra_previous, _amount_to_redeem)
         self.nShares -= self.nShares_extra_previous
         self.update_valuation_of_all_shares()
 
@@ -105,7 +133,7 @@ class AssetManager(Institution):
         self.NAV_previous = NAV
 
         # 3) Firesell extra assets to get enough cash if it is too low
-        _A = self.get_ledger().get_asset_valuation()
+        _A = self.get_asset_valuation()
         _C = self.get_cash()
         if _C / _A < 0.9 * self.cash_fraction_initial:
             self.sell_assets_proportionally(_A * self.cash_fraction_initial - _C)
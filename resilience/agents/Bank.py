@@ -5,6 +5,7 @@ from ..actions import PullFunding, SellAsset
 from ..contracts import Loan, Repo, Other
 
 from ..behaviours import perform_proportionally, pay_off_liabilities
+from ..pecking_order import plan_pecking_order_on_RWA
 
 from .Institution import Institution
 from .DefaultException import DefaultException
@@ -20,10 +21,13 @@ class LeveragedInst(Institution):
     def get_leverage(self):
         """
         (Book Leverage Ratio) = (current Equity) / (current Asset)
-        In `Bank`, this method will be overriden
+        In `Bank`, _compute_leverage will be overriden
         """
-        A = self.get_ledger().get_asset_valuation()
-        L = self.get_ledger().get_liability_valuation()
+        return self.memoize('leverage', self._compute_leverage)
+
+    def _compute_leverage(self):
+        A = self.get_asset_valuation()
+        L = self.get_liability_valuation()
         if A == 0:  # prevents divide by 0
             return 0
         return (A - L) / A
@@ -52,7 +56,7 @@ class LeveragedInst(Institution):
                 interbank_pfas.append(pfa)
 
         # 1. interbank
-        _amount = perform_proportionally(interbank_pfas, amount)
+        _amount = perform_proportionally(interbank_pfas, amount, self.params.BATCH_PERFORM_PROPORTIONALLY)
         is_enough = (amount <= 0) or isequal_float(_amount, amount)
         if is_enough:
             return amount, is_enough
@@ -62,7 +66,7 @@ class LeveragedInst(Institution):
         amount -= _amount
 
         # 2. secured loan / repo
-        _amount_repo = perform_proportionally(repo_pfas, amount)
+        _amount_repo = perform_proportionally(repo_pfas, amount, self.params.BATCH_PERFORM_PROPORTIONALLY)
         is_enough = (amount <= 0) or isequal_float(_amount_repo, amount)
         return _amount + _amount_repo, is_enough
 
@@ -213,20 +217,12 @@ class LeveragedInst(Institution):
     def _get_decomposed_sellasset_actions(self):
         # This is used only in RWA targeting in raise_liquidity_with_pecking_order_on_RWA
         sa_actions = self.get_all_actions_of_type(SellAsset)
-        cbas = []
-        otas = []
-        eqas = []
-        _corpbonds = self.model.parameters.corpbonds_dict.values()
-        _equities = self.model.parameters.equities_dict.values()
-        _otradables = self.model.parameters.othertradables_dict.values()
+        decomposed = {'corpbonds': [], 'othertradables': [], 'equities': [], 'govbonds': []}
         for saa in sa_actions:
-            if saa.asset.assetType in _corpbonds:
-                cbas.append(saa)
-            elif saa.asset.assetType in _equities:
-                eqas.append(saa)
-            elif saa.asset.assetType in _otradables:
-                otas.append(saa)
-        return cbas, otas, eqas
+            name = self.get_tradable_class(saa.asset.assetType)
+            if name is not None:
+                decomposed[name].append(saa)
+        return decomposed['corpbonds'], decomposed['othertradables'], decomposed['equities']
 
     def raise_liquidity_with_pecking_order_on_RWA(self, CET1E, balance=0):
         """
@@ -240,40 +236,10 @@ class LeveragedInst(Institution):
            2.3 equities
         """
         # Pecking orders
-        _raised = 0
-        interbank_RWA_weight = self.RWA_weights['loan']
-        repo_RWA_weight = self.RWA_weights['repo']
-        corpbond_RWA_weight = self.RWA_weights['corpbonds']
-        eq_RWA_weight = self.RWA_weights['equities']
-        otradable_RWA_weight = self.RWA_weights['othertradables']
         rwa = self.rwa_constraint.get_RWA()
         assert CET1E >= 0, CET1E
         assert rwa >= 0, rwa
 
-        def _perform_on_one_type(_rwa, weight, actions, __raised):
-            assert _rwa > 0, _rwa
-            if weight == 0:
-                return _rwa, __raised, False
-            _x = (_rwa - CET1E / self.RWCR_target) / weight
-            # maybe _rwa is negative
-            if -5 * eps < _x < 0:
-                # negligible amount
-                assert_rwa(_rwa)
-                return _rwa, __raised, True
-            assert _x >= 0, (_x, self.get_RWA_ratio(), self.RWCR_target)
-            if _x > 0:
-                amount = perform_proportionally(actions, _x)
-                is_enough = (_x <= 0) or isequal_float(amount, _x)
-                _rwa -= amount * weight
-                if is_enough:
-                    assert_rwa(_rwa)
-                return _rwa, __raised + amount, is_enough
-
-        def assert_rwa(rwa):
-            # see equation 35 of the foundation paper
-            rwcr = CET1E / rwa
-            assert isequal_float(rwcr, self.RWCR_target), (rwcr, self.RWCR_target)
-
         weight_actions = []
         if self.model.parameters.PREDEFAULT_PULLFUNDING_CONTAGION:
             pf_actions = self.get_all_actions_of_type(PullFunding)
@@ -287,21 +253,41 @@ class LeveragedInst(Institution):
 
             # 1. interbank asset
             # 2. reverse-repo
-            weight_actions += [(interbank_RWA_weight, interbank_pfas), (repo_RWA_weight, repo_pfas)]
+            weight_actions += [(self.RWA_weights['loan'], interbank_pfas), (self.RWA_weights['repo'], repo_pfas)]
 
         # tradable assets
         # 3. corp bond
         # 4. other tradable
         # 5. equities
         cbas, otas, eqas = self._get_decomposed_sellasset_actions()
-        weight_actions += [(corpbond_RWA_weight, cbas), (otradable_RWA_weight, otas), (eq_RWA_weight, eqas)]
+        weight_actions += [(self.RWA_weights['corpbonds'], cbas), (self.RWA_weights['othertradables'], otas),
+                           (self.RWA_weights['equities'], eqas)]
+
+        # Plan how much each group has to raise, then perform the plan
+        target_rwa = CET1E / self.RWCR_target
+        weights = [w for w, _ in weight_actions]
+        capacities = [sum(a.get_max() for a in actions) for _, actions in weight_actions]
+        planned, is_enough = plan_pecking_order_on_RWA(rwa, target_rwa, weights, capacities)
+        planned = planned.tolist()
+        raised = []
+        for g, (_, actions) in enumerate(weight_actions):
+            amount = planned[g]
+            _raised = perform_proportionally(
+                actions, amount, self.params.BATCH_PERFORM_PROPORTIONALLY) if amount > 0 else 0.0
+            raised.append(_raised)
+            if not isequal_float(_raised, amount):
+                # Only part of the plan could be performed: plan the rest of
+                # the pecking order from the RWA actually reached
+                _rwa = rwa - sum(r * w for r, w in zip(raised, weights))
+                rest, is_enough = plan_pecking_order_on_RWA(_rwa, target_rwa, weights[g + 1:], capacities[g + 1:])
+                planned[g + 1:] = rest.tolist()
 
-        for w, a in weight_actions:
-            rwa, _raised, is_enough = _perform_on_one_type(rwa, w, a, _raised)
-            if is_enough:
-                return _raised
-
-        return _raised
+        if is_enough:
+            # see equation 35 of the foundation paper
+            _rwa = rwa - sum(r * w for r, w in zip(raised, weights))
+            if _rwa > 0:
+                assert isequal_float(CET1E / _rwa, self.RWCR_target), (CET1E / _rwa, self.RWCR_target)
+        return sum(raised)
 
     def act_fulfil_contractual_obligations(self):
         if not self.is_alive():
@@ -338,19 +324,13 @@ class Bank(LeveragedInst):
     def init(self, assets, liabilities):
         super().init(assets, liabilities)
 
-    def get_leverage(self, cached_equity=None):
+    def _compute_leverage(self):
         """
         Bank uses T1C (i.e. CET1E + AT1E) as its numerator instead of book equity,
         and leverage exposure instead of total asset
         """
-        A = self.get_ledger().get_asset_valuation()
-        lev_exposure = self.leverage_constraint.get_leverage_denominator(A)
-        if cached_equity is None:
-            L = self.get_ledger().get_liability_valuation()
-            CET1E = self.get_CET1E(A - L)
-        else:
-            CET1E = self.get_CET1E(cached_equity)
-        return (CET1E + self.AT1E) / lev_exposure
+        lev_exposure = self.leverage_constraint.get_leverage_denominator()
+        return (self.get_CET1E() + self.AT1E) / lev_exposure
 
     def get_leverage_distance(self):
         """
@@ -367,12 +347,8 @@ class Bank(LeveragedInst):
         """
         return self.get_leverage() - self.model.parameters.BANK_LEVERAGE_BUFFER
 
-    def get_CET1E(self, cached_equity=None):
-        if cached_equity is None:
-            E = self.get_equity_valuation()
-        else:
-            E = cached_equity
-        return E - (self.AT1E + self.T2C) - self.DeltaE
+    def get_CET1E(self):
+        return self.get_equity_valuation() - (self.AT1E + self.T2C) - self.DeltaE
 
     def get_cash_buffer(self):
         return self.lcr_constraint.get_cash_buffer()
@@ -388,8 +364,8 @@ class Bank(LeveragedInst):
         print("Risk Weighted Asset ratio: %.2f%%" % (self.rwa_constraint.get_RWA_ratio() * 100.0))
         print("LCR is: %.2f%%" % (self.get_LCR() * 100))
 
-    def get_RWA_ratio(self, cached_equity=None):
-        return self.rwa_constraint.get_RWA_ratio(cached_equity)
+    def get_RWA_ratio(self):
+        return self.rwa_constraint.get_RWA_ratio()
 
     def trigger_default(self):
         super().trigger_default()
@@ -407,13 +383,13 @@ class Bank(LeveragedInst):
             self.availableActions = self.get_available_actions()
             pf_actions = self.get_all_actions_of_type(PullFunding)
 
-            amount_tobe_pulled = perform_proportionally(pf_actions)
+            amount_tobe_pulled = perform_proportionally(pf_actions, batched=self.params.BATCH_PERFORM_PROPORTIONALLY)
             cash_raised += amount_tobe_pulled
 
         if self.model.parameters.ENDOGENOUS_LGD_ON:
             # calculating endogenous LGD
             print("Note: make sure N is sufficiently large (previous run requires it to be at least 100)")
-            L = self.get_ledger().get_liability_valuation()
+            L = self.get_liability_valuation()
             self.endogenous_LGD = max(0, 1 - (cash_raised / L))
 
         logging.debug("Liquidate all loans (in the liability side).")
@@ -423,11 +399,16 @@ class Bank(LeveragedInst):
         for c in (loans + repos + others):
             c.liquidate()
 
+    def is_below_buffer(self):
+        params = self.model.parameters
+        return ((params.BANK_RWA_ON and self.rwa_constraint.is_below_buffer()) or
+                (params.BANK_LEVERAGE_ON and self.leverage_constraint.get_amount_to_delever() > 0) or
+                (params.BANK_LCR_ON and self.lcr_constraint.is_below_buffer()))
+
     def is_insolvent(self):
         params = self.model.parameters
-        E = self.get_equity_valuation()
-        is_rwa_insolvent = params.BANK_RWA_ON and self.rwa_constraint.is_insolvent(E)
-        is_lev_insolvent = params.BANK_LEVERAGE_ON and self.leverage_constraint.is_insolvent(E)
+        is_rwa_insolvent = params.BANK_RWA_ON and self.rwa_constraint.is_insolvent()
+        is_lev_insolvent = params.BANK_LEVERAGE_ON and self.leverage_constraint.is_insolvent()
         return is_rwa_insolvent or is_lev_insolvent
 
     def choose_actions(self):
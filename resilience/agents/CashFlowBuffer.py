@@ -0,0 +1,73 @@
+class CashFlowBuffer(object):
+    """
+    A ring buffer of the expected cash flows of an institution (its cash
+    commitments or its cash inflows) indexed by the timestep at which they
+    are due. It is updated when an obligation is delivered or fulfilled,
+    and the buckets of the timesteps that have passed are recycled, so the
+    projection over the horizon does not need to scan the mailbox.
+
+    The obligations whose amount is only known when they are due (e.g.
+    RedeemSharesObgn, which depends on the NAV) are kept aside and valued
+    when the projection is read.
+    """
+    __slots__ = 'amounts', 'counts', 'time', 'variable'
+
+    def __init__(self, horizon, time):
+        self.amounts = [0.0] * horizon
+        # The number of obligations in each bucket, to reset the amount of
+        # an emptied bucket to an exact 0
+        self.counts = [0] * horizon
+        # The buckets due at or before this time have expired
+        self.time = time
+        # obligation -> due time
+        self.variable = {}
+
+    def rotate(self, time) -> None:
+        if time <= self.time:
+            return
+        horizon = len(self.amounts)
+        for t in range(max(self.time + 1, time - horizon + 1), time + 1):
+            self.amounts[t % horizon] = 0.0
+            self.counts[t % horizon] = 0
+        self.time = time
+        for obligation, due in list(self.variable.items()):
+            if due <= time:
+                del self.variable[obligation]
+
+    def add(self, obligation, due) -> None:
+        if due <= self.time:
+            return
+        assert due - self.time <= len(self.amounts), (due, self.time)
+        if not getattr(obligation, 'has_fixed_amount', True):
+            self.variable[obligation] = due
+            return
+        i = due % len(self.amounts)
+        self.amounts[i] += obligation.get_amount()
+        self.counts[i] += 1
+
+    def remove(self, obligation, due) -> None:
+        if due <= self.time:
+            # The bucket has already expired
+            return
+        if not getattr(obligation, 'has_fixed_amount', True):
+            self.variable.pop(obligation, None)
+            return
+        i = due % len(self.amounts)
+        self.counts[i] -= 1
+        if self.counts[i] == 0:
+            self.amounts[i] = 0.0
+        else:
+            self.amounts[i] -= obligation.get_amount()
+
+    def get_flows(self, time):
+        """
+        Return the expected cash flows at the timesteps time + 1, ...,
+        time + horizon, like Institution.get_cash_commitments.
+        """
+        self.rotate(time)
+        horizon = len(self.amounts)
+        flows = [self.amounts[(time + 1 + i) % horizon] for i in range(horizon)]
+        for obligation, due in self.variable.items():
+            if not obligation.is_fulfilled():
+                flows[due - time - 1] += obligation.get_amount()
+        return flows
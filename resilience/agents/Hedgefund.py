@@ -1,5 +1,6 @@
 from ..constraints.HFLeverageConstraint import HFLeverageConstraint
-from ..contracts import FailedMarginCallException, Repo
+from ..contracts import AssetCollateral, FailedMarginCallException, Repo
+from ..contracts.valuation import notify_parties
 
 from .Bank import LeveragedInst
 
@@ -8,12 +9,55 @@ class Hedgefund(LeveragedInst):
     def __init__(self, name, model):
         super().__init__(name, model, False)
         self.leverage_constraint = HFLeverageConstraint(self)
+        # Running haircut-weighted valuation of the AssetCollateral, built on
+        # first use when TRACK_BALANCE_SHEET_TOTALS is on
+        self.haircutted_collateral = None
 
     def get_cash_buffer(self):
-        return self.get_ledger().get_asset_valuation() * self.model.parameters.HF_CASH_BUFFER_AS_FRACTION_OF_ASSETS
+        return self.get_asset_valuation() * self.model.parameters.HF_CASH_BUFFER_AS_FRACTION_OF_ASSETS
 
     def get_HQLA_target(self):
-        return self.get_ledger().get_asset_valuation() * self.model.parameters.HF_CASH_TARGET_AS_FRACTION_OF_ASSETS
+        return self.get_asset_valuation() * self.model.parameters.HF_CASH_TARGET_AS_FRACTION_OF_ASSETS
+
+    def get_haircutted_collateral_valuation(self):
+        """
+        The haircut-weighted valuation of the AssetCollateral, used by the
+        effective minimum leverage. With TRACK_BALANCE_SHEET_TOTALS it is
+        kept as a running sum, which follows the valuation changes of the
+        collateral (see update_totals_by_type) and the haircut changes of the
+        market (see update_haircut), instead of scanning the ledger.
+        """
+        if not self.params.TRACK_BALANCE_SHEET_TOTALS:
+            return self._compute_haircutted_collateral_valuation()
+        if self.haircutted_collateral is None:
+            market = self.model.assetMarket
+            self.haircutted_collateral = sum((1 - market.get_haircut(atype)) * v
+                                             for (ctype, atype), v in self._get_totals('A').items()
+                                             if issubclass(ctype, AssetCollateral))
+        value = self.haircutted_collateral
+        if self.params.CHECK_BALANCE_SHEET_TOTALS:
+            return self._check_total(value, self._compute_haircutted_collateral_valuation())
+        return value
+
+    def update_totals_by_type(self, side, ctype, delta, assetType=None) -> None:
+        super().update_totals_by_type(side, ctype, delta, assetType)
+        if self.haircutted_collateral is not None and side == 'A' and issubclass(ctype, AssetCollateral):
+            self.haircutted_collateral += (1 - self.model.assetMarket.get_haircut(assetType)) * delta
+
+    def update_haircut(self, assetType, oldHaircut, newHaircut) -> None:
+        """
+        Called by the market when the haircut of an asset type held by the
+        hedge fund changes, see AssetMarket.set_haircut
+        """
+        if self.haircutted_collateral is None:
+            return
+        value = sum(v for (ctype, atype), v in self._get_totals('A').items()
+                    if atype == assetType and issubclass(ctype, AssetCollateral))
+        self.haircutted_collateral -= (newHaircut - oldHaircut) * value
+
+    def _compute_haircutted_collateral_valuation(self):
+        _tradable = self.get_ledger().get_assets_of_type(AssetCollateral)
+        return sum((1 - t.get_haircut()) * t.get_valuation('A') for t in _tradable)
 
     def trigger_default(self):
         super().trigger_default()
@@ -45,6 +89,7 @@ class Hedgefund(LeveragedInst):
             _r.pledge_proportionally(pledge_amount)
             isnot_enough = pledge_amount < _r.principal
             if isnot_enough:
+                notify_parties(_r, pledge_amount - _r.principal)
                 _r.principal = pledge_amount
             return principal - pledge_amount, isnot_enough, _r
 
@@ -66,17 +111,24 @@ class Hedgefund(LeveragedInst):
 
         # cash
         cash_pledged = _ot_repo.pledge_cash_collateral(remainder)
+        notify_parties(_ot_repo, cash_pledged)
         _ot_repo.principal += cash_pledged
         if cash_pledged < remainder:
             raise FailedMarginCallException("Failed Margin Call")
 
+    def is_below_buffer(self):
+        if self.leverage_constraint.get_amount_to_delever() > 0:
+            return True
+        A = self.get_asset_valuation()
+        return A != 0 and self.get_ue_cash() / A < 0.9 * self.uec_fraction_initial
+
     def perform_liquidity_management(self):
         """
         Continuation of St. Patrick Day's Algorithm for HF
         """
         super().perform_liquidity_management()
         # 5. HF raise liquidity to reach cash target
-        A = self.get_ledger().get_asset_valuation()
+        A = self.get_asset_valuation()
         if A == 0:  # to make sure there is no divide-by-zero
             return
         uec = self.get_ue_cash()
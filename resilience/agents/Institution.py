@@ -1,4 +1,5 @@
 import logging
+import math
 from collections import defaultdict
 
 import numpy as np  # for annotation purpose
@@ -6,14 +7,20 @@ from economicsl import Agent
 
 from ..contracts import FailedMarginCallException
 from ..contracts import AssetCollateral, Deposit, Other, Repo
+from ..contracts.obligations import PullFundingObgn
+from ..contracts.valuation import notify_parties
 from ..behaviours import sell_assets_proportionally
 
 from ..parameters import eps
+from .ActionIndex import ActionIndex
+from .CashFlowBuffer import CashFlowBuffer
 from .DefaultException import DefaultException
 
+TRADABLE_CLASSES = ('govbonds', 'corpbonds', 'equities', 'othertradables')
+
 
 class Institution(Agent):
-    __slots__ = 'encumberedCash', 'equityAtDefault', 'availableActions', 'marked_as_default', 'asset_collaterals', 'has_tradable_cache', 'params', 'model', 'params'
+    __slots__ = 'encumberedCash', 'equityAtDefault', 'availableActions', 'marked_as_default', 'asset_collaterals', 'tradables', 'tradable_classes', 'params', 'model', 'params', '_valuation_epoch', 'rest_state', 'totals', 'balance_sheet_epoch', 'memo', 'action_index', 'cash_flows', 'pending_cash_flows', 'netting', 'margin_call_failed'
 
     def __init__(self, name, model):
         super().__init__(name, model.simulation)
@@ -23,9 +30,38 @@ class Institution(Agent):
         self.marked_as_default = False
         # PERF This is SWST-specific "view" of asset collaterals for faster access
         self.asset_collaterals = defaultdict(list)
-        self.has_tradable_cache = False
+        # See get_tradable_of_type. Built on first use.
+        self.tradables = None
+        self.tradable_classes = None
         self.model = model
         self.params = model.parameters
+        # The market epoch up to which the valuation of the asset collaterals
+        # has been reconciled, when LAZY_ASSET_VALUATION is on
+        self._valuation_epoch = -1
+        # See get_rest_state. None when the agent has to act.
+        self.rest_state = None
+        # Running totals of the valuation of the contracts, i.e. side ->
+        # {(contract class, asset type): valuation}. None when not tracked
+        # (yet), see TRACK_BALANCE_SHEET_TOTALS.
+        self.totals = None
+        # Bumped by every change of a contract of the balance sheet, see
+        # memoize.
+        self.balance_sheet_epoch = 0
+        self.memo = None
+        # See INDEX_AVAILABLE_ACTIONS. Built on the first call of
+        # get_available_actions.
+        self.action_index = None
+        # See CASH_FLOW_BUFFER. (commitments, inflows), built on first use.
+        self.cash_flows = None
+        # The obligations sent since the last step(), which are not yet in
+        # the mailboxes: obligation -> whether it is an inflow
+        self.pending_cash_flows = {}
+        # See NET_OBLIGATIONS. loan -> amount to settle, while fulfilling
+        # the requests of the mailbox.
+        self.netting = None
+        # (timestep, whether the margin calls failed), when they have
+        # already been run by MarginCallEngine.fulfil
+        self.margin_call_failed = None
 
     def _add_tradables(self, arr, template) -> None:
         if len(arr) > 0:
@@ -70,6 +106,103 @@ class Institution(Agent):
             # TODO remove this from args
             pass
 
+    def add(self, contract) -> None:
+        super().add(contract)
+        if self.tradables is not None and contract.assetParty is self and isinstance(contract, AssetCollateral):
+            self._index_tradable(contract)
+        self.update_totals(contract, contract.get_valuation('A' if contract.assetParty is self else 'L'))
+
+    def update_totals(self, contract, delta) -> None:
+        if self.action_index is not None:
+            self.action_index.mark_stale(contract)
+        side = 'A' if contract.assetParty is self else 'L'
+        self.update_totals_by_type(side, type(contract), delta, getattr(contract, 'assetType', None))
+
+    def update_totals_by_type(self, side, ctype, delta, assetType=None) -> None:
+        """
+        update_totals for a change of the valuation of the contracts of a
+        type on one side, e.g. of all the shares of a ShareRegistry at once
+        """
+        self.balance_sheet_epoch += 1
+        if self.totals is None or delta == 0:
+            return
+        self.totals[side][(ctype, assetType)] += delta
+
+    def _compute_totals(self):
+        ldg = super().get_ledger()
+        totals = {'A': defaultdict(float), 'L': defaultdict(float)}
+        for side, contracts in (('A', ldg.get_all_assets()), ('L', ldg.get_all_liabilities())):
+            for c in contracts:
+                totals[side][(type(c), getattr(c, 'assetType', None))] += c.get_valuation(side)
+        return totals
+
+    def _get_totals(self, side):
+        # Reading the ledger first lets the lazy valuation reconcile prices
+        self.get_ledger()
+        if self.totals is None:
+            self.totals = self._compute_totals()
+        return self.totals[side]
+
+    def get_balance_sheet_state(self):
+        # Cash moves through the ledger without notifying, so it is part of
+        # the state. get_cash is read first as it may reconcile the prices
+        # (and bump the epoch) in the lazy valuation mode.
+        cash = self.get_cash()
+        return self.balance_sheet_epoch, cash, self.encumberedCash
+
+    def memoize(self, key, compute):
+        """
+        Return compute(), reusing the value computed for the same key as long
+        as the balance sheet is unchanged. Values are only memoized during an
+        act() call.
+        """
+        if self.memo is None:
+            return compute()
+        state = self.get_balance_sheet_state()
+        cached = self.memo.get(key)
+        if cached is not None and cached[0] == state:
+            return cached[1]
+        value = compute()
+        self.memo[key] = (state, value)
+        return value
+
+    def _check_total(self, value, expected):
+        if self.params.CHECK_BALANCE_SHEET_TOTALS:
+            assert math.isclose(value, expected, rel_tol=1e-9, abs_tol=eps), (self.get_name(), value, expected)
+        return value
+
+    def get_asset_valuation(self) -> float:
+        return self.memoize('A', self._compute_asset_valuation)
+
+    def _compute_asset_valuation(self) -> float:
+        if not self.params.TRACK_BALANCE_SHEET_TOTALS:
+            return self.get_ledger().get_asset_valuation()
+        value = self.get_cash() + sum(self._get_totals('A').values())
+        return self._check_total(value, self.get_ledger().get_asset_valuation())
+
+    def get_liability_valuation(self) -> float:
+        if not self.params.TRACK_BALANCE_SHEET_TOTALS:
+            return self.get_ledger().get_liability_valuation()
+        value = sum(self._get_totals('L').values())
+        return self._check_total(value, self.get_ledger().get_liability_valuation())
+
+    def get_asset_valuation_of(self, contractType, assetType=None) -> float:
+        if not self.params.TRACK_BALANCE_SHEET_TOTALS:
+            if assetType is None:
+                return self.get_ledger().get_asset_valuation_of(contractType)
+            return self.get_ledger().get_asset_valuation_of(contractType, assetType)
+        value = sum(v for (ctype, atype), v in self._get_totals('A').items()
+                    if issubclass(ctype, contractType) and (assetType is None or atype == assetType))
+        if assetType is None:
+            return self._check_total(value, self.get_ledger().get_asset_valuation_of(contractType))
+        return self._check_total(value, self.get_ledger().get_asset_valuation_of(contractType, assetType))
+
+    def get_liability_valuation_of(self, contractType) -> float:
+        if not self.params.TRACK_BALANCE_SHEET_TOTALS:
+            return self.get_ledger().get_liability_valuation_of(contractType)
+        value = sum(v for (ctype, _), v in self._get_totals('L').items() if issubclass(ctype, contractType))
+        return self._check_total(value, self.get_ledger().get_liability_valuation_of(contractType))
+
     def pay_liability(self, amount, loan) -> None:
         """
         Pre-condition: we have enough liquidity!
@@ -84,10 +217,25 @@ class Institution(Agent):
         assert diff >= -2 * eps, diff
         self.get_ledger().pay_liability(amount, loan)
 
+    def get_ledger(self):
+        if self.params.LAZY_ASSET_VALUATION:
+            epoch = self.model.assetMarket.epoch
+            if epoch != self._valuation_epoch:
+                # Set the epoch first, because the reconciliation itself
+                # reads the ledger
+                self._valuation_epoch = epoch
+                self.reconcile_asset_prices()
+        return super().get_ledger()
+
+    def reconcile_asset_prices(self) -> None:
+        for assets in self.asset_collaterals.values():
+            for asset in assets:
+                asset.reconcile_price()
+
     def update_asset_prices(self) -> None:
         for asset in self.get_ledger().get_all_assets():
             if asset.price_fell():
-                self.get_ledger().devalue_asset(asset, asset.valueLost())
+                self.get_ledger().devalue_asset(asset, asset.value_lost())
                 asset.update_price()
 
     def devalue_asset_collateral_of_type(self, assetType, priceLost) -> None:
@@ -104,6 +252,11 @@ class Institution(Agent):
         :return: A list of Actions that are available to me at this moment
         is_eligible is a check for the contractual constraint
         """
+        if self.params.INDEX_AVAILABLE_ACTIONS:
+            if self.action_index is None:
+                ldg = self.get_ledger()
+                self.action_index = ActionIndex(self, ldg.get_all_assets() + ldg.get_all_liabilities())
+            return self.action_index.get_available_actions()
         eligibleActions = defaultdict(list)
         for contract in (self.get_ledger().get_all_assets() + self.get_ledger().get_all_liabilities()):
             if contract.is_eligible(self):
@@ -113,20 +266,61 @@ class Institution(Agent):
         return eligibleActions
 
     def get_equity_valuation(self) -> float:
-        return self.get_ledger().get_equity_valuation() if self.is_alive() else self.equityAtDefault
+        if not self.is_alive():
+            return self.equityAtDefault
+        return self.memoize('E', self._compute_equity_valuation)
+
+    def _compute_equity_valuation(self) -> float:
+        if self.params.TRACK_BALANCE_SHEET_TOTALS:
+            return self.get_asset_valuation() - self.get_liability_valuation()
+        return self.get_ledger().get_equity_valuation()
+
+    def _build_tradable_index(self) -> None:
+        # Lookup table from the asset type to its tradable class
+        self.tradable_classes = {}
+        for name in TRADABLE_CLASSES:
+            for assetType in getattr(self.params, name + '_dict').values():
+                self.tradable_classes[assetType] = name
+        # tradable class -> {asset: None}, in the order of the ledger
+        self.tradables = {name: {} for name in TRADABLE_CLASSES}
+        for a in self.get_ledger().get_assets_of_type(AssetCollateral):
+            if a.quantity > 0:
+                self._index_tradable(a)
+
+    def _index_tradable(self, asset) -> None:
+        name = self.tradable_classes.get(asset.get_asset_type())
+        if name is not None:
+            self.tradables[name][asset] = None
+
+    def deindex_tradable(self, asset) -> None:
+        """
+        Drop a position that has been emptied (sold, or its ownership
+        moved) from the tradable index, see AssetMarket.deregister_holding
+        """
+        if self.tradables is None:
+            return
+        name = self.tradable_classes.get(asset.get_asset_type())
+        if name is not None:
+            self.tradables[name].pop(asset, None)
+
+    def get_tradable_class(self, assetType):
+        """
+        Return the tradable class ('govbonds', 'corpbonds', 'equities' or
+        'othertradables') of an asset type, or None.
+        """
+        if self.tradables is None:
+            self._build_tradable_index()
+        return self.tradable_classes.get(assetType)
 
     def get_tradable_of_type(self, atype):
-        if not self.has_tradable_cache:
-            def _get(SET):
-                return [a for a in self.get_ledger().get_assets_of_type(AssetCollateral) if a.get_asset_type() in SET]
-            self.tradables = {
-                'govbonds': _get(self.params.govbonds_dict.values()),
-                'corpbonds': _get(self.params.corpbonds_dict.values()),
-                'equities': _get(self.params.equities_dict.values()),
-                'othertradables': _get(self.params.othertradables_dict.values()),
-            }
-            self.has_tradable_cache = True
-        return self.tradables[atype]
+        """
+        Return the tradable assets of a tradable class. The index is
+        maintained by add(), e.g. when a repo collateral changes ownership,
+        and by deindex_tradable when a position is emptied.
+        """
+        if self.tradables is None:
+            self._build_tradable_index()
+        return list(self.tradables[atype])
 
     def print_balance_sheet(self) -> None:
         print("\nBalance Sheet of", self.get_name() + "\n**************************")
@@ -134,6 +328,14 @@ class Institution(Agent):
         print("\nLeverage ratio: %.2f%%" % (100 * self.get_leverage()))
 
     def fulfil_margin_calls_or_default(self) -> None:
+        outcome, self.margin_call_failed = self.margin_call_failed, None
+        if outcome is not None and outcome[0] == self.get_time():
+            # Already run for all the borrowers by MarginCallEngine.fulfil,
+            # in this timestep
+            if outcome[1]:
+                logging.debug("A margin call failed.")
+                raise DefaultException(self, DefaultException.TypeOfDefault.FAILED_MARGIN_CALL)
+            return
         try:
             repos = self.get_ledger().get_liabilities_of_type(Repo)
             for repo in repos:
@@ -176,13 +378,83 @@ class Institution(Agent):
     def get_pending_payments_to_me(self):
         return self.mailbox.get_pending_payments_to_me()
 
+    def _fulfil_with_netting(self, fulfil) -> None:
+        if not self.params.NET_OBLIGATIONS:
+            fulfil()
+            return
+        self.netting = {}
+        try:
+            fulfil()
+        finally:
+            netting, self.netting = self.netting, None
+        # One settlement per loan instead of one per obligation
+        for loan, amount in netting.items():
+            PullFundingObgn.settle(loan, amount)
+
     def fulfil_all_requests(self):
-        self.mailbox.fulfil_all_requests()
+        self._fulfil_with_netting(self.mailbox.fulfil_all_requests)
 
     def fulfil_matured_requests(self):
-        self.mailbox.fulfil_matured_requests()
+        self._fulfil_with_netting(self.mailbox.fulfil_matured_requests)
+
+    def send_obligation(self, recipient, obligation) -> None:
+        super().send_obligation(recipient, obligation)
+        if self.params.CASH_FLOW_BUFFER:
+            self.pending_cash_flows[obligation] = True
+            if hasattr(recipient, 'pending_cash_flows'):
+                recipient.pending_cash_flows[obligation] = False
+
+    def step(self) -> None:
+        super().step()
+        # The obligations sent during the previous subround have been
+        # delivered to the mailboxes
+        if self.cash_flows is not None:
+            for obligation, is_inflow in self.pending_cash_flows.items():
+                self._add_cash_flow(obligation, is_inflow)
+        self.pending_cash_flows.clear()
+
+    def _add_cash_flow(self, obligation, is_inflow) -> None:
+        commitments, inflows = self.cash_flows
+        commitments.rotate(self.get_time())
+        inflows.rotate(self.get_time())
+        if is_inflow:
+            inflows.add(obligation, obligation.get_time_to_receive())
+        else:
+            commitments.add(obligation, obligation.get_time_to_pay())
+
+    def remove_cash_flow(self, obligation, is_inflow) -> None:
+        """
+        Called when an obligation is fulfilled.
+        """
+        if obligation in self.pending_cash_flows:
+            del self.pending_cash_flows[obligation]
+        elif self.cash_flows is not None:
+            commitments, inflows = self.cash_flows
+            if is_inflow:
+                inflows.remove(obligation, obligation.get_time_to_receive())
+            else:
+                commitments.remove(obligation, obligation.get_time_to_pay())
+
+    def _get_cash_flows(self):
+        if self.cash_flows is None:
+            horizon = self.params.TIMESTEPS_TO_PAY * 3
+            self.cash_flows = (CashFlowBuffer(horizon, self.get_time()), CashFlowBuffer(horizon, self.get_time()))
+            # The obligations of the mailbox that are still pending (e.g. sent
+            # in the current subround, hence already in the outbox) are
+            # accounted for here, and must not be added again by step()
+            for obligation in self.get_obligation_inbox():
+                self.pending_cash_flows.pop(obligation, None)
+                if not obligation.is_fulfilled():
+                    self._add_cash_flow(obligation, False)
+            for obligation in self.get_obligation_outbox():
+                self.pending_cash_flows.pop(obligation, None)
+                if not obligation.is_fulfilled():
+                    self._add_cash_flow(obligation, True)
+        return self.cash_flows
 
     def get_cash_commitments(self):
+        if self.params.CASH_FLOW_BUFFER:
+            return self._get_cash_flows()[0].get_flows(self.get_time())
         cashCommitments = [0.0] * self.params.TIMESTEPS_TO_PAY * 3
 
         for obligation in self.get_obligation_inbox():
@@ -200,6 +472,8 @@ class Institution(Agent):
         return sell_assets_proportionally(self, amount)
 
     def get_cash_inflows(self):
+        if self.params.CASH_FLOW_BUFFER:
+            return self._get_cash_flows()[1].get_flows(self.get_time())
         cashInflows = [0.0] * self.params.TIMESTEPS_TO_PAY * 3
 
         for obligation in self.get_obligation_outbox():
@@ -239,14 +513,80 @@ class Institution(Agent):
         self.equityAtDefault = self.get_equity_valuation()
         # self.trigger_default()
         self.alive = False
+        # The eligibility of the actions of the counterparties depends on
+        # whether I'm alive
+        ldg = self.get_ledger()
+        for contract in (ldg.get_all_assets() + ldg.get_all_liabilities()):
+            notify_parties(contract)
+        # Any default may affect the counterparties, see get_rest_state. The
+        # count is kept on the model, so that a Snapshot of the model has it.
+        self.model.ndefaults = getattr(self.model, 'ndefaults', 0) + 1
         if hasattr(self, 'isaBank') and self.isaBank:
             self.simulation.bank_defaults_this_round += 1
 
+    def is_below_buffer(self) -> bool:
+        """
+        Whether act() would still act on the agent's regulatory or liquidity
+        buffers, given its current balance sheet. An institution that does
+        not say otherwise always has to act.
+        """
+        return True
+
+    def has_unfulfilled_obligations(self) -> bool:
+        return (any(not o.is_fulfilled() for o in self.get_obligation_inbox()) or
+                any(not o.is_fulfilled() for o in self.get_obligation_outbox()))
+
+    def get_rest_state(self):
+        """
+        The inputs of act() other than the agent's ratios: its cash, the
+        number of defaults so far (for the counterparty defaults) and the
+        positions, market price epoch and haircut of each asset type it
+        holds. The haircuts can change without a price move (e.g. a haircut
+        contagion), and they drive the margin calls.
+        """
+        market = self.model.assetMarket
+        return (self.get_cash(), self.encumberedCash, getattr(self.model, 'ndefaults', 0),
+                tuple((atype, len(assets), market.get_price_epoch(atype), market.get_haircut(atype))
+                      for atype, assets in self.asset_collaterals.items()))
+
+    def is_unaffected(self) -> bool:
+        """
+        Whether the agent was at rest after its previous act() and nothing
+        relevant has changed since, so that act() would do nothing.
+        """
+        return (self.rest_state is not None and
+                not self.has_unfulfilled_obligations() and
+                self.rest_state == self.get_rest_state())
+
+    def _get_act_fingerprint(self):
+        ldg = self.get_ledger()
+        return (self.is_alive(), self.get_cash(), self.encumberedCash,
+                ldg.get_asset_valuation(), ldg.get_liability_valuation(),
+                sum(a.putForSale_ for assets in self.asset_collaterals.values() for a in assets),
+                len(self.get_obligation_outbox()))
+
     def act(self) -> None:
         if not self.is_alive():
             logging.debug(f"{self.get_name()} cannot act. I'm crucified, dead and buried, and have descended into hell.")
             return
 
+        if self.params.SKIP_UNAFFECTED_AGENTS:
+            if self.is_unaffected():
+                if self.params.CHECK_SKIPPED_AGENTS:
+                    before = self._get_act_fingerprint()
+                    self._act()
+                    after = self._get_act_fingerprint()
+                    assert before == after, (self.get_name(), before, after)
+                logging.debug(f"{self.get_name()} is unaffected, skipping act().")
+                return
+            self._act()
+            at_rest = self.is_alive() and not self.has_unfulfilled_obligations() and not self.is_below_buffer()
+            self.rest_state = self.get_rest_state() if at_rest else None
+            return
+
+        self._act()
+
+    def _act(self) -> None:
         if self.params.PRINT_BALANCE_SHEETS:
             self.print_balance_sheet()
         if self.params.PRINT_MAILBOX:
@@ -254,10 +594,13 @@ class Institution(Agent):
 
         self.availableActions = self.get_available_actions()
 
+        self.memo = {}
         try:
             self.choose_actions()
         except DefaultException:
             self.handle_default()
+        finally:
+            self.memo = None
 
         logging.debug(f"{self.get_name()} done.\n*********")
 
@@ -1,5 +1,7 @@
 import logging
 
+import numpy as np
+
 from .actions import PayLoan, SellAsset
 from .parameters import eps
 
@@ -9,11 +11,19 @@ def do_nothing(bank):
     pass
 
 
+# PERF below this number of actions, the NumPy overhead of
+# perform_proportionally_batched outweighs its gain
+BATCH_MIN_ACTIONS = 16
+
+
 # List of behavioural units
-def perform_proportionally(actions, amount: float = None) -> float:
+def perform_proportionally(actions, amount: float = None, batched: bool = False) -> float:
     # This is a common pattern shared by sell assets and
     # pay loan.
     # See Greenwood 2015 and Cont-Schaanning 2017.
+    # `batched` is BATCH_PERFORM_PROPORTIONALLY
+    if batched and len(actions) >= BATCH_MIN_ACTIONS:
+        return perform_proportionally_batched(actions, amount)
 
     # maximum is the total amount that can be performed
     maximum = sum(a.get_max() for a in actions)
@@ -31,13 +41,44 @@ def perform_proportionally(actions, amount: float = None) -> float:
             action.perform()
     return _amount
 
+def perform_proportionally_batched(actions, amount: float = None) -> float:
+    """
+    Same as perform_proportionally, with the same allocations, but the
+    maxima of the actions are gathered once into an array, the amounts of
+    all the actions are computed at once, and the SellAsset actions are put
+    for sale with one market call.
+    """
+    maxima = np.fromiter((a.get_max() for a in actions), dtype=float, count=len(actions))
+    # The same (sequential) summation as perform_proportionally
+    maximum = sum(maxima.tolist())
+    if amount is None:
+        amount = maximum
+    if (maximum <= 0.0) or (amount <= 0.0):
+        # we cannot perform any actions
+        return 0.0
+
+    _amount = min(maximum, amount)
+    each = maxima * _amount / maximum
+    # market -> (assets, quantities)
+    orders = {}
+    for action, _each_amount in zip(actions, each.tolist()):
+        if _each_amount > eps:
+            action.set_amount(_each_amount)
+            if isinstance(action, SellAsset):
+                action.perform_batched(orders)
+            else:
+                action.perform()
+    for market, (assets, quantities) in orders.items():
+        market.put_for_sale_bulk(assets, quantities)
+    return _amount
+
 def pay_off_liabilities(inst, amount):
     logging.debug(f"Pay off liabilities (delever) proportionally: {amount}")
     payLoanActions = inst.get_all_actions_of_type(PayLoan)
-    return perform_proportionally(payLoanActions, amount)
+    return perform_proportionally(payLoanActions, amount, inst.model.parameters.BATCH_PERFORM_PROPORTIONALLY)
 
 def sell_assets_proportionally(inst, amount=None):
     sellAssetActions = inst.get_all_actions_of_type(SellAsset)
     # TODO when endogenous LGD is calculated, it might be necessary
     # to calibrate the total amount sold by the expected price sold
-    return perform_proportionally(sellAssetActions, amount)
+    return perform_proportionally(sellAssetActions, amount, inst.model.parameters.BATCH_PERFORM_PROPORTIONALLY)
@@ -18,8 +18,8 @@ class BankLeverageConstraint(object):
         return getattr(self.me, 'leverage_buffer',
                        self.me.model.parameters.BANK_LEVERAGE_BUFFER)
 
-    def is_insolvent(self, cached_equity=None) -> bool:
-        lev = self.me.get_leverage(cached_equity)
+    def is_insolvent(self) -> bool:
+        lev = self.me.get_leverage()
         insolvent = lev < (self.me.model.parameters.BANK_LEVERAGE_MIN - eps)
         return insolvent
 
@@ -44,10 +44,8 @@ class BankLeverageConstraint(object):
         target = CET1E / self.get_leverage_target()
         return max(0, current - target)
 
-    def get_leverage_denominator(self, cached_asset=None):
+    def get_leverage_denominator(self):
         """
         DeltaA is calibrated from data.
         """
-        if cached_asset is None:
-            return self.me.get_ledger().get_asset_valuation() - self.me.DeltaA
-        return cached_asset - self.me.DeltaA
+        return self.me.get_asset_valuation() - self.me.DeltaA
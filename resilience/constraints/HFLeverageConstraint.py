@@ -20,23 +20,24 @@ class HFLeverageConstraint(object):
         return self.me.get_leverage() < self.get_effective_min_leverage()
 
     def get_effective_min_leverage(self):
-        ldg = self.me.get_ledger()
+        return self.me.memoize('effective_min_leverage', self._compute_effective_min_leverage)
+
+    def _compute_effective_min_leverage(self):
         cash = self.me.get_cash()  # TODO or unencumbered cash?
-        collateral = cash + ldg.get_asset_valuation_of(AssetCollateral)
+        collateral = cash + self.me.get_asset_valuation_of(AssetCollateral)
         assert collateral >= 0, collateral
 
         if collateral == 0:
             return 0
 
         w_cash = cash / collateral
-        _tradable = ldg.get_assets_of_type(AssetCollateral)
-        repo = ldg.get_liability_valuation_of(Repo)
+        repo = self.me.get_liability_valuation_of(Repo)
         # Sometimes _denominator is 0
-        _denominator = w_cash + sum((1 - t.get_haircut()) * t.get_valuation('A') for t in _tradable) / collateral
+        _denominator = w_cash + self.me.get_haircutted_collateral_valuation() / collateral
         elligible_asset_minimum = repo / _denominator if _denominator > 0 else 0
 
-        other = ldg.get_asset_valuation_of(Other)
-        external = ldg.get_asset_valuation_of(TradableAsset, self.ASSETTYPE.EXTERNAL1)
+        other = self.me.get_asset_valuation_of(Other)
+        external = self.me.get_asset_valuation_of(TradableAsset, self.ASSETTYPE.EXTERNAL1)
         A_minimum = elligible_asset_minimum + other + external
         if A_minimum > 0:
             lev_min = (A_minimum - repo) / A_minimum
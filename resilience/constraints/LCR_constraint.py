@@ -37,7 +37,7 @@ class LCR_Constraint(object):
         outflows = sum(l.get_valuation('L') * l.get_LCR_weight() for
                        l in ldg.get_all_liabilities()
                        if not l.ctype == 'Other')
-        outflows += ldg.get_liability_valuation_of(Other) * self.me.LCR_weight_other
+        outflows += self.me.get_liability_valuation_of(Other) * self.me.LCR_weight_other
         return outflows
 
     def get_LCR_denominator(self) -> float:
@@ -57,6 +57,9 @@ class LCR_Constraint(object):
         return outflows - min(inflows, BASELIII_CASH_OUTFLOW_CAP * outflows)
 
     def get_gov_bonds(self):
+        return self.me.memoize('gov_bonds', self._compute_gov_bonds)
+
+    def _compute_gov_bonds(self):
         return sum(a.get_valuation('A') for a in self.me.get_tradable_of_type('govbonds'))
 
     def get_HQLA(self, cash_raised=0) -> float:
@@ -18,21 +18,27 @@ class RWA_Constraint(object):
             return self.me.RWCR_FLTF
         return self.me.model.parameters.RWCR_FLTF
 
-    def is_insolvent(self, cached_equity=None) -> bool:
-        rwa_ratio = self.get_RWA_ratio(cached_equity)
+    def is_insolvent(self) -> bool:
+        rwa_ratio = self.get_RWA_ratio()
         return rwa_ratio < (self.get_RWCR_min() - eps)
 
-    def is_below_buffer(self, cached_equity=None) -> bool:
-        rwa_ratio = self.get_RWA_ratio(cached_equity)
+    def is_below_buffer(self) -> bool:
+        rwa_ratio = self.get_RWA_ratio()
         return rwa_ratio < self.me.RWCR_buffer
 
-    def get_RWA_ratio(self, cached_equity=None) -> float:
-        CET1E = self.me.get_CET1E(cached_equity)
+    def get_RWA_ratio(self) -> float:
+        return self.me.memoize('RWA_ratio', self._compute_RWA_ratio)
+
+    def _compute_RWA_ratio(self) -> float:
+        CET1E = self.me.get_CET1E()
         RWA = self.get_RWA()
         assert RWA > 0, RWA
         return CET1E / RWA
 
     def get_RWA(self) -> float:
+        return self.me.memoize('RWA', self._compute_RWA)
+
+    def _compute_RWA(self) -> float:
         ldg = self.me.get_ledger()
         weights = self.me.RWA_weights
         rw = 0
@@ -43,9 +49,9 @@ class RWA_Constraint(object):
             rw += weights[tradable_type] * sum((a.quantity - a.putForSale_) * a.price for a in self.me.get_tradable_of_type(tradable_type))
 
         # other assets
-        rw += weights['other'] * ldg.get_asset_valuation_of(Other)
+        rw += weights['other'] * self.me.get_asset_valuation_of(Other)
         # external assets
-        rw += weights['external'] * ldg.get_asset_valuation_of(TradableAsset, self.ASSETTYPE.EXTERNAL1)
+        rw += weights['external'] * self.me.get_asset_valuation_of(TradableAsset, self.ASSETTYPE.EXTERNAL1)
         # loan
         rw += weights['loan'] * get_notional_minus_pulled(ldg, Loan)
         # repo
@@ -1,5 +1,6 @@
 from .TradableAsset import TradableAsset
 from ..parameters import eps
+from .valuation import notify_parties
 
 
 class AssetCollateral(TradableAsset):
@@ -11,17 +12,20 @@ class AssetCollateral(TradableAsset):
         self.encumberedQuantity = 0.0
         # PERF This is SWST-specific view of asset collaterals for faster access
         assetParty.asset_collaterals[assetType].append(self)
+        assetMarket.register_holding(self)
 
     def is_eligible(self, me):
-        is_external = self.assetType in [self.ASSETTYPE.EXTERNAL1, self.ASSETTYPE.EXTERNAL2, self.ASSETTYPE.EXTERNAL3]
+        is_external = self.assetType in self.meta.external_types
         # PERF always assume that me is self.assetParty, hence no need to check (self.assetParty == me)
         return not is_external and ((self.quantity - self.encumberedQuantity) > self.putForSale_)
 
     def encumber(self, quantity):
         self.encumberedQuantity += quantity
+        notify_parties(self)
 
     def unEncumber(self, quantity):
         self.encumberedQuantity -= quantity
+        notify_parties(self)
 
     def get_haircut(self):
         return self.assetMarket.get_haircut(self.assetType)
@@ -41,13 +45,18 @@ class AssetCollateral(TradableAsset):
 
     def change_ownership(self, newOwner, quantity):
         assert self.quantity >= quantity - eps, (self.quantity, quantity)
+        if self.assetParty.params.LAZY_ASSET_VALUATION:
+            self.reconcile_price()
 
         # First, reduce the quantity of this asset
         self.quantity -= quantity
         self.encumberedQuantity -= quantity
+        notify_parties(self, -quantity * self.price)
 
         # Have the owner lose the value of the asset
         self.assetParty.get_ledger().devalue_asset(self, quantity * self.price)
+        if self.quantity <= 0:
+            self.assetMarket.deregister_holding(self)
 
         new_asset = AssetCollateral(newOwner, self.get_asset_type(), self.assetMarket, quantity)
 
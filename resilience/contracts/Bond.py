@@ -2,6 +2,7 @@ from economicsl.contract import Contract
 
 
 class Bond(Contract):
+    __slots__ = 'maturityType', 'principal', 'rate'
     ctype = 'Bond'
 
     def __init__(self, assetParty, liabilityParty, maturityType, principal, rate):
@@ -0,0 +1,307 @@
+import types
+
+import numpy as np
+
+from .AssetCollateral import AssetCollateral
+from .Deposit import Deposit
+from .Loan import Loan
+from .Other import Other
+from .Repo import Repo
+from .metadata import get_metadata
+
+# The per-contract state held in the columns of a ContractStore, one table
+# for the loans (Loan, Deposit, Repo, Other) and one for the asset
+# collaterals
+LOAN_COLUMNS = {
+    'principal': np.float64,
+    'fundingAlreadyPulled': np.float64,
+    # Index of the party in ContractStore.parties, -1 for the external node
+    'assetParty_id': np.int32,
+    'liabilityParty_id': np.int32,
+}
+ASSET_COLUMNS = {
+    'quantity': np.float64,
+    'encumberedQuantity': np.float64,
+    'putForSale_': np.float64,
+    'price': np.float64,
+    'priceEpoch': np.int64,
+    # Index of the asset type in ContractStore.asset_types
+    'assetType_id': np.int32,
+    'assetParty_id': np.int32,
+}
+
+# The attributes of the views are properties, which requires the
+# pure-Python (not Cython compiled) contracts
+_HAS_VIEWS = isinstance(Loan.__dict__.get('principal'), types.MemberDescriptorType)
+
+
+class ContractTable(object):
+    """
+    The columns of one kind of contracts of a ContractStore
+    """
+    __slots__ = 'store', 'size', 'columns', 'sparse', 'contracts'
+
+    def __init__(self, store, columns, capacity):
+        self.store = store
+        self.size = 0
+        self.columns = {name: np.zeros(capacity, dtype=dtype) for name, dtype in columns.items()}
+        # (row, attribute) -> value, see _sparse_property
+        self.sparse = {}
+        # The plain contracts, when the views are not available
+        self.contracts = None if _HAS_VIEWS else []
+
+    def new_row(self):
+        i = self.size
+        if i == len(next(iter(self.columns.values()))):
+            for name, column in self.columns.items():
+                self.columns[name] = np.concatenate([column, np.zeros_like(column)])
+        self.size += 1
+        return i
+
+    def get_column(self, name):
+        if self.contracts is None:
+            return self.columns[name][:self.size]
+        # Gathered from the plain contracts
+        store = self.store
+        if name in ('assetParty_id', 'liabilityParty_id'):
+            values = [store._get_party_id(getattr(c, name[:-3])) for c in self.contracts]
+        elif name == 'assetType_id':
+            values = [store._get_asset_type_id(c.assetType) for c in self.contracts]
+        else:
+            values = [getattr(c, name) for c in self.contracts]
+        return np.array(values, dtype=self.columns[name].dtype)
+
+
+def _column_property(name):
+    def fget(self):
+        return self._store.columns[name].item(self._i)
+
+    def fset(self, value):
+        self._store.columns[name][self._i] = value
+    return property(fget, fset)
+
+
+def _sparse_property(name, default=None):
+    # The attributes that only some of the contracts set, e.g. the actions,
+    # which are created on first use, or the collateral of the repos
+    def fget(self):
+        return self._store.sparse.get((self._i, name), default)
+
+    def fset(self, value):
+        self._store.sparse[(self._i, name)] = value
+    return property(fget, fset)
+
+
+def _index_property(column, get_list, get_index):
+    # An object held by its index in a list of the store (e.g. a party, or
+    # None for the external node)
+    def fget(self):
+        i = self._store.columns[column].item(self._i)
+        return None if i < 0 else get_list(self._store.store)[i]
+
+    def fset(self, value):
+        self._store.columns[column][self._i] = -1 if value is None else get_index(self._store.store, value)
+    return property(fget, fset)
+
+
+def _store_property(get):
+    return property(lambda self: get(self._store.store))
+
+
+def _party_property(column):
+    return _index_property(column, lambda store: store.parties, lambda store, party: store._get_party_id(party))
+
+
+# The views subclass the contract classes, after a mixin whose properties
+# shadow the slots of the contracts, so that their only state is their table
+# (`_store`) and their row (`_i`). The shadowed slots are still allocated.
+
+class _StoredContract(object):
+    __slots__ = ()
+
+    # The state of a view is its table and its row, not the shadowed slots
+    def __getstate__(self):
+        return self._store, self._i
+
+    def __setstate__(self, state):
+        self._store, self._i = state
+
+
+class _StoredLoanColumns(_StoredContract):
+    __slots__ = ()
+    principal = _column_property('principal')
+    fundingAlreadyPulled = _column_property('fundingAlreadyPulled')
+    assetParty = _party_property('assetParty_id')
+    liabilityParty = _party_property('liabilityParty_id')
+    parameters = _store_property(lambda store: store.parameters)
+    _pullfunding = _sparse_property('_pullfunding')
+    _payloan = _sparse_property('_payloan')
+
+
+class StoredLoan(_StoredLoanColumns, Loan):
+    """
+    A Loan whose state is held by a ContractStore
+    """
+    __slots__ = '_store', '_i'
+
+
+class StoredDeposit(_StoredLoanColumns, Deposit):
+    """
+    A Deposit whose state is held by a ContractStore
+    """
+    __slots__ = '_store', '_i'
+
+
+class StoredRepo(_StoredLoanColumns, Repo):
+    """
+    A Repo whose state is held by a ContractStore
+    """
+    __slots__ = '_store', '_i'
+    collateral = _sparse_property('collateral')
+    cash_collateral = _sparse_property('cash_collateral', 0.0)
+    prev_margin_call = _sparse_property('prev_margin_call', 0.0)
+    future_margin_call = _sparse_property('future_margin_call', 0.0)
+    future_max_collateral = _sparse_property('future_max_collateral', 0.0)
+
+
+class StoredOther(_StoredLoanColumns, Other):
+    """
+    An Other whose state is held by a ContractStore
+    """
+    __slots__ = '_store', '_i'
+    lcr_weight = _store_property(lambda store: store.parameters.OTHER_LCR)
+
+
+class StoredAssetCollateral(_StoredContract, AssetCollateral):
+    """
+    An AssetCollateral whose state is held by a ContractStore
+    """
+    __slots__ = '_store', '_i'
+    quantity = _column_property('quantity')
+    encumberedQuantity = _column_property('encumberedQuantity')
+    putForSale_ = _column_property('putForSale_')
+    price = _column_property('price')
+    priceEpoch = _column_property('priceEpoch')
+    assetParty = _party_property('assetParty_id')
+    liabilityParty = property(lambda self: None)
+    assetType = _index_property(
+        'assetType_id', lambda store: store.asset_types, lambda store, atype: store._get_asset_type_id(atype))
+    assetMarket = _store_property(lambda store: store.assetMarket)
+    meta = _store_property(lambda store: get_metadata(store.parameters))
+    _action = _sparse_property('_action')
+
+_VIEWS = {Loan: StoredLoan, Deposit: StoredDeposit, Repo: StoredRepo, Other: StoredOther}
+
+
+class ContractStore(object):
+    """
+    A columnar store for large books of contracts, e.g. millions of
+    interbank loans and repos. The principal, funding already pulled,
+    quantity, encumbrance, amount put for sale, price and parties of the
+    contracts are held in typed arrays, the parameters and the asset market
+    are shared, and the actions are only created when they are used. The
+    contracts are views (StoredLoan, StoredRepo, ...), i.e. subclasses of
+    the regular contract classes whose attributes read and write their row,
+    and can be added to the ledgers. As the views still carry the slots of
+    the contract classes, a view takes about as much memory as a regular
+    contract: the gain is that the state of the whole book is in the
+    columns, for bulk aggregation (see get_column and sum_by_party).
+
+    The views require the pure-Python contracts. With the Cython compiled
+    contracts, the store creates regular contracts instead, and its columns
+    are gathered from them.
+    """
+    __slots__ = 'parameters', 'assetMarket', 'loans', 'assets', 'parties', 'party_ids', 'asset_types', 'asset_type_ids'
+
+    def __init__(self, model, capacity=1024):
+        self.parameters = model.parameters
+        self.assetMarket = None
+        self.loans = ContractTable(self, LOAN_COLUMNS, capacity)
+        self.assets = ContractTable(self, ASSET_COLUMNS, capacity)
+        # The parties and the asset types, keyed by the objects themselves
+        self.parties = []
+        self.party_ids = {}
+        self.asset_types = []
+        self.asset_type_ids = {}
+
+    def _get_party_id(self, party):
+        if party is None:
+            return -1
+        try:
+            return self.party_ids[party]
+        except KeyError:
+            self.party_ids[party] = len(self.parties)
+            self.parties.append(party)
+            return len(self.parties) - 1
+
+    def _get_asset_type_id(self, assetType):
+        try:
+            return self.asset_type_ids[assetType]
+        except KeyError:
+            self.asset_type_ids[assetType] = len(self.asset_types)
+            self.asset_types.append(assetType)
+            return len(self.asset_types) - 1
+
+    @staticmethod
+    def _new_view(cls, table):
+        view = cls.__new__(cls)
+        view._store = table
+        view._i = table.new_row()
+        return view
+
+    def new_loan(self, assetParty, liabilityParty, principal, contractType=Loan):
+        """
+        Return a new Loan, Deposit, Repo or Other (the contractType) held
+        by the store.
+        """
+        if self.loans.contracts is not None:
+            contract = contractType(assetParty, liabilityParty, principal)
+            self.loans.contracts.append(contract)
+            return contract
+        view = self._new_view(_VIEWS[contractType], self.loans)
+        view.assetParty = assetParty
+        view.liabilityParty = liabilityParty
+        view.principal = principal
+        if contractType is Repo:
+            view.collateral = {}
+        return view
+
+    def new_asset_collateral(self, assetParty, assetType, assetMarket, quantity):
+        if self.assets.contracts is not None:
+            contract = AssetCollateral(assetParty, assetType, assetMarket, quantity)
+            self.assets.contracts.append(contract)
+            return contract
+        if self.assetMarket is None:
+            self.assetMarket = assetMarket
+        assert assetMarket is self.assetMarket, "The asset collaterals of a store share their market"
+        view = self._new_view(StoredAssetCollateral, self.assets)
+        view.assetParty = assetParty
+        view.assetType = assetType
+        view.price = assetMarket.get_price(assetType)
+        view.priceEpoch = assetMarket.get_price_epoch(assetType)
+        view.quantity = quantity
+        assetParty.asset_collaterals[assetType].append(view)
+        assetMarket.register_holding(view)
+        return view
+
+    def _get_table(self, name):
+        # The party ids are in both tables, and refer to the loans by default
+        return self.loans if name in LOAN_COLUMNS else self.assets
+
+    def get_column(self, name, table=None):
+        """
+        Return the values of a column for all the contracts of the store,
+        of the loans or the asset collaterals (the table, 'loans' or
+        'assets', which only needs to be given for the party ids).
+        """
+        return (self._get_table(name) if table is None else getattr(self, table)).get_column(name)
+
+    def sum_by_party(self, values, side='A', table='loans'):
+        """
+        Sum an array of per-contract values (e.g. get_column('principal'))
+        by asset party (side 'A') or liability party (side 'L'). The result
+        is aligned with self.parties, and the external node is left out.
+        """
+        ids = self.get_column('assetParty_id' if side == 'A' else 'liabilityParty_id', table)
+        internal = ids >= 0
+        return np.bincount(ids[internal], weights=values[internal], minlength=len(self.parties))
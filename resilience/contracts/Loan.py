@@ -4,6 +4,7 @@ import logging
 from ..actions import PayLoan, PullFunding
 from economicsl.contract import Contract
 from ..parameters import eps
+from .valuation import notify_parties
 
 
 class Loan(Contract):
@@ -16,9 +17,10 @@ class Loan(Contract):
         self.parameters = _model.parameters
         self.principal = principal
         self.fundingAlreadyPulled = 0
-        # PERF for caching purpose
-        self._pullfunding = PullFunding(assetParty, self)
-        self._payloan = PayLoan(liabilityParty, self)
+        # PERF for caching purpose, created on first use since only one
+        # side of the loan uses each of them
+        self._pullfunding = None
+        self._payloan = None
 
     def get_LCR_weight(self):
         return self.parameters.INTERBANK_LCR
@@ -60,6 +62,7 @@ class Loan(Contract):
         assert (notional - amount) >= -eps, (notional, amount)
         self.principal -= amount
         self.principal = abs(self.principal)  # round off floating error
+        notify_parties(self, self.principal - notional)
 
         if self.principal < 0.01:
             logging.debug("This loan between " + (self.assetParty.get_name() if self.assetParty else 'None') + ' and ' + (self.liabilityParty.get_name() if self.liabilityParty else 'None') + " has been fully repaid.")
@@ -67,8 +70,12 @@ class Loan(Contract):
 
     def get_action(self, me):
         if self.assetParty == me:
+            if self._pullfunding is None:
+                self._pullfunding = PullFunding(self.assetParty, self)
             return self._pullfunding
         elif self.liabilityParty == me:
+            if self._payloan is None:
+                self._payloan = PayLoan(self.liabilityParty, self)
             return self._payloan
 
     def is_eligible(self, me):
@@ -105,13 +112,16 @@ class Loan(Contract):
         # self.liabilityParty.get_ledger().devalue_liability(self, notional)
         self.fundingAlreadyPulled = 0
         self.principal = 0.0
+        notify_parties(self, -notional)
 
     def increase_funding_pulled(self, fundingPulled):
         self.fundingAlreadyPulled += fundingPulled
+        notify_parties(self)
 
     def reduce_funding_pulled(self, amount):
         self.fundingAlreadyPulled -= amount
         self.fundingAlreadyPulled = max(0, self.fundingAlreadyPulled)
+        notify_parties(self)
 
     def get_funding_already_pulled(self):
         return self.fundingAlreadyPulled
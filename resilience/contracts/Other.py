@@ -1,5 +1,6 @@
 from economicsl.contract import Contract
 from ..actions import PayLoan
+from .valuation import notify_parties
 
 
 class Other(Contract):
@@ -11,7 +12,8 @@ class Other(Contract):
         super().__init__(assetParty, liabilityParty)
         _model = (assetParty or liabilityParty).model
         self.principal = amount
-        self._payloan = PayLoan(liabilityParty, self)
+        # Created on first use
+        self._payloan = None
         self.fundingAlreadyPulled = 0.0
         self.lcr_weight = _model.parameters.OTHER_LCR
 
@@ -28,6 +30,7 @@ class Other(Contract):
         return self.get_notional()
 
     def set_amount(self, amount):
+        notify_parties(self, amount - self.principal)
         self.principal = amount
 
     def is_eligible(self, me):
@@ -35,6 +38,8 @@ class Other(Contract):
         return (self.assetParty is None) and self.get_notional() > 0
 
     def get_action(self, me):
+        if self._payloan is None:
+            self._payloan = PayLoan(self.liabilityParty, self)
         return self._payloan
 
     def get_funding_already_pulled(self):
@@ -54,4 +59,4 @@ class Other(Contract):
 
     def liquidate(self):
         self.fundingAlreadyPulled = 0
-        self.principal = 0.0
+        self.set_amount(0.0)
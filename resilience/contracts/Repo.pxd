@@ -6,9 +6,6 @@ cdef class Repo(Loan):
     cdef public double prev_margin_call
     cdef public double future_margin_call
     cdef public double future_max_collateral
-    cdef public bint MARGIN_CALL_ON
-    cdef public bint POSTDEFAULT_FIRESALE_CONTAGION
-    cdef public object parameters
     cpdef object get_name(self)
     cpdef void pledge_collateral(self, object asset, double quantity)
     cpdef double pledge_cash_collateral(self, double amount)
@@ -2,6 +2,7 @@ from .FailedMarginCallException import FailedMarginCallException
 from .Loan import Loan
 
 from ..parameters import eps
+from .valuation import notify_parties
 
 
 # A Repo is a securitized Loan, i.e. it includes collateral. Collateral is stored as hashmap of CanBeCollateral contracts
@@ -13,7 +14,6 @@ from ..parameters import eps
 class Repo(Loan):
     __slots__ = (
         'collateral', 'cash_collateral', 'prev_margin_call', 'future_margin_call', 'future_max_collateral',
-        'MARGIN_CALL_ON', 'POSTDEFAULT_FIRESALE_CONTAGION', 'parameters'
     )
     ctype = 'Repo'
 
@@ -24,12 +24,6 @@ class Repo(Loan):
         self.prev_margin_call = 0.0
         self.future_margin_call = 0.0
         self.future_max_collateral = 0.0
-        _model = (assetParty or liabilityParty).model
-        self.parameters = _model.parameters
-        # These method are used for checking MARGIN_CALL_ON and
-        # POSTDEFAULT_FIRESALE_CONTAGION
-        self.MARGIN_CALL_ON = _model.parameters.MARGIN_CALL_ON
-        self.POSTDEFAULT_FIRESALE_CONTAGION = _model.parameters.POSTDEFAULT_FIRESALE_CONTAGION
 
     def get_LCR_weight(self):
         return self.parameters.REPO_LCR
@@ -70,7 +64,7 @@ class Repo(Loan):
         """
         equation 39
         """
-        if not self.MARGIN_CALL_ON:
+        if not self.parameters.MARGIN_CALL_ON:
             return
         borrower = self.liabilityParty
         if borrower is not None and borrower.isaBank:
@@ -163,7 +157,7 @@ class Repo(Loan):
             # Give the new asset to the new owner
             self.assetParty.add(newAsset)
 
-            if self.POSTDEFAULT_FIRESALE_CONTAGION:
+            if self.parameters.POSTDEFAULT_FIRESALE_CONTAGION:
                 newAsset.put_for_sale(newAsset.quantity)
 
         # 3. Reduce the notional of this repo to zero.
@@ -173,6 +167,7 @@ class Repo(Loan):
         #if self.assetParty is not None:
         #    self.assetParty.get_ledger().devalue_asset(self, self.principal)
         #self.liabilityParty.get_ledger().devalue_liability(self, self.principal)
+        notify_parties(self, -self.principal)
         self.principal = 0
 
     def print_collateral(self):
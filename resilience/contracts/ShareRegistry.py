@@ -0,0 +1,174 @@
+import numpy as np
+
+from .ContractStore import _StoredContract, _column_property, _sparse_property
+from .Shares import Shares
+
+# The per-share state held in the columns of a ShareRegistry
+SHARE_COLUMNS = {
+    'nShares': np.float64,
+    'originalNumberOfShares': np.float64,
+    'previousValueOfShares': np.float64,
+    'nSharesPendingToRedeem': np.float64,
+    # Index of the holder in ShareRegistry.holders, -1 for no holder
+    'holder_id': np.int32,
+}
+
+def _holder_property():
+    def fget(self):
+        h = self._store.columns['holder_id'].item(self._i)
+        return None if h < 0 else self._store.holders[h]
+
+    def fset(self, owner):
+        self._store.columns['holder_id'][self._i] = self._store._get_holder_id(owner)
+    return property(fget, fset)
+
+
+def _issuer_property():
+    def fget(self):
+        return self._store.issuer
+
+    def fset(self, issuer):
+        assert issuer is self._store.issuer
+    return property(fget, fset)
+
+
+class StoredShares(_StoredContract, Shares):
+    """
+    A Shares whose state is held by a ShareRegistry
+    """
+    __slots__ = '_store', '_i'
+    nShares = _column_property('nShares')
+    originalNumberOfShares = _column_property('originalNumberOfShares')
+    previousValueOfShares = _column_property('previousValueOfShares')
+    nSharesPendingToRedeem = _column_property('nSharesPendingToRedeem')
+    assetParty = _holder_property()
+    liabilityParty = _issuer_property()
+    originalNAV = _sparse_property('originalNAV')
+    _action = _sparse_property('_action')
+
+    def redeem(self, number, amount):
+        # Through the registry
+        self._store.redeem_share(self._i, number, amount)
+
+
+class ShareRegistry(object):
+    """
+    The shares issued by an AssetManager (see SHARE_REGISTRY), with the
+    number of shares, their previous valuation and the shares pending to
+    redeem of every holder held in arrays. The shares are views
+    (StoredShares, a subclass of Shares) over these arrays, while the revaluation of all
+    the shares at the NAV and the redemptions of the asset manager are
+    computed for all the holders at once. The parties are notified once per
+    holder instead of once per share, so that a fund with many investors
+    that are not institutions costs O(1) Python calls.
+    """
+    __slots__ = 'issuer', 'size', 'columns', 'sparse', 'views', 'holders', 'holder_ids', 'notified'
+
+    def __init__(self, issuer, capacity=64):
+        self.issuer = issuer
+        self.size = 0
+        self.columns = {name: np.zeros(capacity, dtype=dtype) for name, dtype in SHARE_COLUMNS.items()}
+        # (row, attribute) -> value, see _sparse_property
+        self.sparse = {}
+        self.views = []
+        # The holders, keyed by the objects themselves
+        self.holders = []
+        self.holder_ids = {}
+        # The ids of the holders that keep balance-sheet totals
+        self.notified = []
+
+    def _get_holder_id(self, owner):
+        if owner is None:
+            return -1
+        try:
+            return self.holder_ids[owner]
+        except KeyError:
+            h = self.holder_ids[owner] = len(self.holders)
+            self.holders.append(owner)
+            if hasattr(owner, 'update_totals_by_type'):
+                self.notified.append(h)
+            return h
+
+    def new_shares(self, owner, nShares, originalNAV):
+        """
+        Return new Shares of the issuer for the owner, valued at the current
+        NAV, like the Shares constructor
+        """
+        i = self.size
+        if i == len(self.columns['nShares']):
+            for name, column in self.columns.items():
+                self.columns[name] = np.concatenate([column, np.zeros_like(column)])
+        self.size += 1
+        view = StoredShares.__new__(StoredShares)
+        view._store = self
+        view._i = i
+        Shares.__init__(view, owner, self.issuer, nShares, originalNAV)
+        self.views.append(view)
+        return view
+
+    def get_column(self, name):
+        """
+        Return the values of a column for all the shares of the registry.
+        """
+        return self.columns[name][:self.size]
+
+    def _notify_parties(self, deltas):
+        # notify_parties of every share, summed by party
+        if self.size == 0:
+            return
+        self.issuer.update_totals_by_type('L', StoredShares, deltas.sum().item())
+        if self.notified:
+            ids = self.get_column('holder_id')
+            internal = ids >= 0
+            by_holder = np.bincount(ids[internal], weights=deltas[internal], minlength=len(self.holders))
+            for h in self.notified:
+                self.holders[h].update_totals_by_type('A', StoredShares, by_holder.item(h))
+
+    def update_valuation(self):
+        """
+        Shares.update_valuation of all the shares, at the NAV computed once
+        """
+        NAV = self.issuer.get_net_asset_valuation()
+        previous = self.get_column('previousValueOfShares')
+        new = self.get_column('nShares') * NAV
+        deltas = new - previous
+        previous[:] = new
+        self._notify_parties(deltas)
+
+    def _notify_redeemed(self, rows):
+        # notify_parties(share) of the shares redeemed (the rows), whose
+        # valuation only changes at the next update_valuation
+        self.issuer.update_totals_by_type('L', StoredShares, 0.0)
+        if not self.notified:
+            return
+        ids = self.columns['holder_id']
+        for i in rows:
+            h = ids.item(i)
+            if h >= 0 and hasattr(self.holders[h], 'update_totals'):
+                self.holders[h].update_totals(self.views[i], 0.0)
+
+    def redeem_share(self, i, number, amount):
+        """
+        Shares.redeem of the share in row i
+        """
+        nShares = self.columns['nShares']
+        assert number <= nShares[i]
+        self.issuer.get_ledger().subtract_cash(amount)
+        nShares[i] -= number
+        self.columns['nSharesPendingToRedeem'][i] -= number
+        self._notify_redeemed((i,))
+
+    def redeem(self, numbers, NAV):
+        """
+        Shares.redeem of `numbers` (per share) of all the shares at once, for
+        an amount of `numbers * NAV`. Returns the amounts paid.
+        """
+        numbers = np.asarray(numbers, dtype=float)
+        nShares = self.get_column('nShares')
+        assert (numbers <= nShares).all()
+        amounts = numbers * NAV
+        self.issuer.get_ledger().subtract_cash(amounts.sum().item())
+        nShares -= numbers
+        self.get_column('nSharesPendingToRedeem')[:] -= numbers
+        self._notify_redeemed(np.flatnonzero(numbers).tolist())
+        return amounts
@@ -2,10 +2,12 @@ import logging
 
 from ..actions import RedeemShares
 from economicsl.contract import Contract
+from .valuation import notify_parties
 
 
 # This contract represents a bunch of shares of some Institution which can issue shares.
 class Shares(Contract):
+    __slots__ = 'nShares', 'originalNumberOfShares', 'previousValueOfShares', 'originalNAV', 'nSharesPendingToRedeem', '_action'
     ctype = 'Shares'
 
     def __init__(self, owner, issuer, nShares, originalNAV):
@@ -15,6 +17,8 @@ class Shares(Contract):
         self.previousValueOfShares = self.get_new_valuation()
         self.originalNAV = originalNAV
         self.nSharesPendingToRedeem = 0
+        # Created on first use
+        self._action = None
 
         assert issuer is not None
 
@@ -30,6 +34,7 @@ class Shares(Contract):
         # self.assetParty.get_ledger().sell_asset(number * nav, self)
         self.nShares -= number
         self.nSharesPendingToRedeem -= number
+        notify_parties(self)
 
     def get_valuation(self, side):
         return self.previousValueOfShares
@@ -44,14 +49,19 @@ class Shares(Contract):
         return self.nShares
 
     def get_action(self, me):
-        return RedeemShares(me, self)
+        # PERF me is always self.assetParty, see is_eligible
+        if self._action is None:
+            self._action = RedeemShares(me, self)
+        return self._action
 
     def is_eligible(self, me):
         return (me == self.assetParty) and self.nShares > 0
 
     def update_valuation(self):
-        valueChange = self.get_new_valuation() - self.previousValueOfShares
-        self.previousValueOfShares = self.get_new_valuation()
+        newValue = self.get_new_valuation()
+        valueChange = newValue - self.previousValueOfShares
+        self.previousValueOfShares = newValue
+        notify_parties(self, valueChange)
         return
 
         # accounting disabled because AM Investor is disabled
@@ -1,6 +1,8 @@
 from ..actions import SellAsset
 from economicsl.contract import Contract
 from ..parameters import eps
+from .metadata import get_metadata
+from .valuation import notify_parties
 
 
 def enum(**enums):
@@ -9,7 +11,7 @@ def enum(**enums):
 
 class TradableAsset(Contract):
     # TODO: mark the three external assets as non tradable.
-    __slots__ = 'assetType', 'assetMarket', 'price', 'quantity', 'putForSale_', '_action', 'lcr_weight', 'ASSETTYPE'
+    __slots__ = 'assetType', 'assetMarket', 'price', 'quantity', 'putForSale_', '_action', 'meta', 'priceEpoch'
     ctype = 'TradableAsset'
 
     def __init__(self, assetParty, assetType, assetMarket, quantity=0.0):
@@ -18,38 +20,53 @@ class TradableAsset(Contract):
         self.assetType = assetType
         self.assetMarket = assetMarket
         self.price = assetMarket.get_price(assetType)
+        # The market price epoch at which self.price was last updated
+        self.priceEpoch = assetMarket.get_price_epoch(assetType)
         self.quantity = quantity
         self.putForSale_ = 0.0
-        self._action = SellAsset(assetParty, self)
-        self.ASSETTYPE = assetParty.model.parameters.AssetType
-        self.lcr_weight = assetParty.model.parameters.EXTERNAL_LCR if assetType == self.ASSETTYPE.EXTERNAL1 else 0
+        # Created on first use
+        self._action = None
+        self.meta = get_metadata(assetParty.model.parameters)
 
     def get_name(self):
         return "Asset of type " + str(self.assetType)
 
     def get_action(self, me):
         # PERF me is always self.assetParty
+        if self._action is None:
+            self._action = SellAsset(self.assetParty, self)
         return self._action
 
     def is_eligible(self, me):
-        is_external = self.assetType in [self.ASSETTYPE.EXTERNAL1, self.ASSETTYPE.EXTERNAL2, self.ASSETTYPE.EXTERNAL3]
+        is_external = self.assetType in self.meta.external_types
         # PERF always assume that me is self.assetParty, hence no need to check (self.assetParty == me)
         return not is_external and (self.quantity > self.putForSale_)
 
     def put_for_sale(self, quantity):
+        quantity = self.mark_for_sale(quantity)
+        if quantity != 0:
+            self.assetMarket.put_for_sale(self, quantity)
+
+    def mark_for_sale(self, quantity):
+        """
+        put_for_sale without the market order, which is left to the caller
+        (see AssetMarket.put_for_sale_bulk). Returns the quantity to be put
+        for sale on the market, 0 if there is none.
+        """
         if abs(quantity) < eps:
             quantity = 0
         if (quantity == 0) or (self.price <= eps):
             # do not perform if quantity or price is 0
-            return
+            return 0.0
         effective_qty = self.get_valuation('A') / self.price
         if abs(effective_qty - quantity) <= 2 * eps:
             quantity = effective_qty
         assert effective_qty - quantity >= -eps, (effective_qty - quantity)
         self.putForSale_ += quantity
+        notify_parties(self)
         # TODO uncomment this for correct accounting
         # self.assetParty.get_ledger().devalue_asset(self, quantity * self.price)
-        self.assetMarket.put_for_sale(self, quantity)
+        return quantity
 
     def get_valuation(self, side):
         return self.quantity * self.price
@@ -67,7 +84,33 @@ class TradableAsset(Contract):
         return (self.price - self.get_market_price()) * self.quantity
 
     def update_price(self):
+        old_valuation = self.get_valuation('A')
         self.price = self.get_market_price()
+        notify_parties(self, self.get_valuation('A') - old_valuation)
+        self.priceEpoch = self.assetMarket.get_price_epoch(self.assetType)
+
+    def reconcile_price(self):
+        """
+        Used in the lazy valuation mode. Bring the valuation of this position
+        up to date with the market price, exactly as the eager devaluation of
+        Institution.devalue_asset_collateral_of_type would have done.
+        """
+        if self.priceEpoch == self.assetMarket.get_price_epoch(self.assetType):
+            return
+        if self.price_fell():
+            self.assetParty.get_ledger().devalue_asset(self, self.value_lost())
+            self.update_price()
+        else:
+            self.priceEpoch = self.assetMarket.get_price_epoch(self.assetType)
+
+    def settle_sale(self, quantity):
+        """
+        Remove the quantity sold in a market clearing from this position
+        """
+        old_valuation = self.get_valuation('A')
+        self.quantity -= quantity
+        self.putForSale_ -= quantity
+        notify_parties(self, self.get_valuation('A') - old_valuation)
 
     def get_asset_type(self):
         return self.assetType
@@ -76,4 +119,4 @@ class TradableAsset(Contract):
         return self.putForSale_
 
     def get_LCR_weight(self):
-        return self.lcr_weight
+        return self.meta.external_lcr if self.assetType == self.meta.ASSETTYPE.EXTERNAL1 else 0
@@ -6,5 +6,7 @@ from .Deposit import Deposit
 from .Loan import Loan
 from .Other import Other
 from .Shares import Shares
+from .ContractStore import ContractStore
+from .ShareRegistry import ShareRegistry
 #from .Bond import Bond
 #from .MaturityType import MaturityType
@@ -0,0 +1,22 @@
+_metadata = {}
+
+
+class ContractMetadata(object):
+    """
+    The metadata of the contracts of a model, shared by all of them
+    (flyweight) instead of being copied on every instance.
+    """
+    __slots__ = 'ASSETTYPE', 'external_types', 'external_lcr'
+
+    def __init__(self, parameters):
+        self.ASSETTYPE = parameters.AssetType
+        self.external_types = frozenset((self.ASSETTYPE.EXTERNAL1, self.ASSETTYPE.EXTERNAL2, self.ASSETTYPE.EXTERNAL3))
+        self.external_lcr = parameters.EXTERNAL_LCR
+
+
+def get_metadata(parameters):
+    meta = _metadata.get(parameters)
+    # The parameters may be changed in between runs, e.g. in the tests
+    if meta is None or meta.ASSETTYPE is not parameters.AssetType or meta.external_lcr != parameters.EXTERNAL_LCR:
+        meta = _metadata[parameters] = ContractMetadata(parameters)
+    return meta
@@ -11,10 +11,21 @@ class PullFundingObgn(Obligation):
         self.loan = loan
 
     def fulfil(self):
-        self.loan.pay_loan(self.amount)
-        logging.debug(self.loan.get_liability_party().get_name() + " has fulfilled an obligation to pay " +
-                      self.loan.get_asset_party().get_name() +
-                      " an amount %.2f." % self.amount)
-
-        self.loan.reduce_funding_pulled(self.amount)
+        netting = getattr(self.loan.liabilityParty, 'netting', None)
+        if netting is not None:
+            # Settled at once with the other obligations on the same loan,
+            # see Institution.fulfil_matured_requests
+            netting[self.loan] = netting.get(self.loan, 0.0) + self.amount
+        else:
+            self.settle(self.loan, self.amount)
         self.set_fulfilled()
+        for party, is_inflow in ((self.loan.assetParty, True), (self.loan.liabilityParty, False)):
+            if hasattr(party, 'remove_cash_flow'):
+                party.remove_cash_flow(self, is_inflow)
+
+    @staticmethod
+    def settle(loan, amount):
+        loan.pay_loan(amount)
+        logging.debug(f"{loan.get_liability_party().get_name()} has fulfilled an obligation to pay "
+                      f"{loan.get_asset_party().get_name()} an amount {amount:.2f}.")
+        loan.reduce_funding_pulled(amount)
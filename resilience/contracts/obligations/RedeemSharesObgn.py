@@ -5,6 +5,8 @@ from economicsl import Obligation
 
 class RedeemSharesObgn(Obligation):
     __slots__ = ('shares', 'nSharesToRedeem')
+    # The amount depends on the NAV at the time of payment
+    has_fixed_amount = False
 
     def __init__(self, shares, numberOfShares, timeToPay):
         super().__init__(shares, numberOfShares * shares.get_NAV(), timeToPay)
@@ -15,9 +17,13 @@ class RedeemSharesObgn(Obligation):
         return self.nSharesToRedeem * self.shares.get_NAV()
 
     def fulfil(self):
-        self.shares.redeem(self.nSharesToRedeem)
+        # Through the ShareRegistry for its shares
+        self.shares.redeem(self.nSharesToRedeem, self.get_amount())
         logging.debug(
             self.shares.get_liability_party().get_name()+ " has fulfilled an obligation to redeem shares and pay " +
             self.shares.get_asset_party().get_name() +
             " an amount %.2f." % self.amount)
         self.set_fulfilled()
+        for party, is_inflow in ((self.shares.assetParty, True), (self.shares.liabilityParty, False)):
+            if hasattr(party, 'remove_cash_flow'):
+                party.remove_cash_flow(self, is_inflow)
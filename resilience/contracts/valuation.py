@@ -0,0 +1,12 @@
+def notify_parties(contract, delta=0.0):
+    """
+    Tell the parties of a contract that it changed, and that its valuation
+    changed by delta, so that they can update their running balance-sheet
+    totals and invalidate their memoized ratios (see Institution.update_totals).
+    Must be called by every method that changes an existing contract in a
+    way that affects the balance sheet: its valuation, the amount put for
+    sale, the funding already pulled or the encumbrance.
+    """
+    for party in (contract.assetParty, contract.liabilityParty):
+        if party is not None and hasattr(party, 'update_totals'):
+            party.update_totals(contract, delta)
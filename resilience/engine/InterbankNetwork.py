@@ -0,0 +1,278 @@
+import numpy as np
+
+from ..parameters import eps, isequal_float
+
+
+class InterbankNetwork(object):
+    """
+    A vectorized version of the funding contagion channel
+    (FUNDING_CONTAGION_INTERBANK) between n institutions. The interbank
+    loans and repos are stored as a sparse n x n exposure matrix in CSR
+    format, with one row per lender and one column per borrower, so that
+    the pull-funding requests of all the lenders, their delivery after
+    TIMESTEPS_TO_PAY and the resulting cash flows of all the borrowers are
+    computed with sparse matrix-vector operations.
+
+    Only the loans and repos between the n institutions are modelled; the
+    funding from and to the external node can be pulled instantaneously,
+    so it does not spread. The collateral of the repos is not modelled
+    either: a repo whose borrower defaults is closed without recovery.
+    The other liabilities of the institutions (`other_liabilities`) are
+    only used for the endogenous LGD (ENDOGENOUS_LGD_ON), where the cash
+    raised by a defaulting institution is its cash and, with
+    POSTDEFAULT_PULLFUNDING_CONTAGION, the funding it pulls; the proceeds
+    of its post-default fire sale are not modelled.
+    """
+    __slots__ = (
+        'parameters', 'n', 'indices', 'rows', 'is_repo', 'principal',
+        'fundingAlreadyPulled', 'requests', 'cash', 'other_liabilities', 'alive', 'time'
+    )
+
+    def __init__(self, parameters, lenders, borrowers, principal, cash,
+                 fundingAlreadyPulled=None, is_repo=None, other_liabilities=None):
+        self.parameters = parameters
+        self.n = len(cash)
+        lenders = np.asarray(lenders, dtype=np.intp)
+        # The edges are sorted by lender, keeping the order of the contracts
+        # of each lender
+        order = np.argsort(lenders, kind='stable')
+        self.indices = np.asarray(borrowers, dtype=np.intp)[order]
+        # The row of each edge, i.e. the CSR indptr expanded
+        self.rows = lenders[order]
+        nnz = len(self.rows)
+        self.is_repo = np.zeros(nnz, dtype=bool) if is_repo is None else np.asarray(is_repo, dtype=bool)[order]
+        self.principal = np.asarray(principal, dtype=float)[order]
+        self.fundingAlreadyPulled = (
+            np.zeros(nnz) if fundingAlreadyPulled is None else np.asarray(fundingAlreadyPulled, dtype=float)[order])
+        # The amounts requested on each edge, by due timestep modulo
+        # TIMESTEPS_TO_PAY
+        assert parameters.TIMESTEPS_TO_PAY >= 1
+        self.requests = np.zeros((parameters.TIMESTEPS_TO_PAY, nnz))
+        self.cash = np.array(cash, dtype=float)
+        self.other_liabilities = np.zeros(self.n) if other_liabilities is None else np.asarray(
+            other_liabilities, dtype=float)
+        self.alive = np.ones(self.n, dtype=bool)
+        self.time = 0
+
+    @classmethod
+    def from_model(cls, model, agents=None):
+        """
+        Build the network from the ledgers of the agents (by default all
+        the agents of the model). The unencumbered cash of the agents is
+        used as their cash. Returns the network and the contracts of its
+        edges, in the order of the edges. The liabilities of the agents that
+        are not edges of the network are their other liabilities.
+        """
+        # Imported here so that the engine itself does not depend on
+        # economicsl
+        from ..contracts import Loan, Repo
+
+        agents = model.allAgents if agents is None else agents
+        index = {id(a): i for i, a in enumerate(agents)}
+        contracts = []
+        lenders = []
+        borrowers = []
+        for i, agent in enumerate(agents):
+            ldg = agent.get_ledger()
+            for contract in ldg.get_assets_of_type(Loan) + ldg.get_assets_of_type(Repo):
+                j = index.get(id(contract.liabilityParty))
+                if j is not None:
+                    contracts.append(contract)
+                    lenders.append(i)
+                    borrowers.append(j)
+        # The contracts are already grouped by lender, hence in the order of
+        # the edges
+        principal = np.array([c.get_notional() for c in contracts], dtype=float)
+        interbank_liabilities = np.bincount(
+            np.asarray(borrowers, dtype=np.intp), weights=principal, minlength=len(agents))
+        network = cls(
+            model.parameters, lenders, borrowers, principal,
+            cash=[a.get_ue_cash() for a in agents],
+            fundingAlreadyPulled=[c.get_funding_already_pulled() for c in contracts],
+            is_repo=[c.ctype == 'Repo' for c in contracts],
+            other_liabilities=np.array([a.get_liability_valuation() for a in agents]) - interbank_liabilities)
+        network.alive = np.array([a.is_alive() for a in agents], dtype=bool)
+        return network, contracts
+
+    # Sparse operations
+    def sum_by_lender(self, values):
+        """
+        The sum of the per-edge `values` over each row, e.g. the exposure
+        of each lender for the principal
+        """
+        return np.bincount(self.rows, weights=values, minlength=self.n)
+
+    def sum_by_borrower(self, values):
+        """
+        The sum of the per-edge `values` over each column, e.g. the
+        interbank liabilities of each borrower for the principal
+        """
+        return np.bincount(self.indices, weights=values, minlength=self.n)
+
+    def dot(self, x):
+        """
+        The product of the exposure matrix (the principals) with the vector
+        `x` of size n
+        """
+        return self.sum_by_lender(self.principal * x[self.indices])
+
+    def rdot(self, y):
+        """
+        The product of the transposed exposure matrix with the vector `y`
+        of size n
+        """
+        return self.sum_by_borrower(self.principal * y[self.rows])
+
+    # Pull funding
+    def get_max(self):
+        """
+        PullFunding.get_max() of every edge, which is 0 for the edges whose
+        action is not eligible
+        """
+        eligible = self.alive[self.rows] & self.alive[self.indices]
+        return np.where(eligible, np.maximum(0, self.principal - self.fundingAlreadyPulled), 0.0)
+
+    def _pull_proportionally(self, amount, maxima):
+        # behaviours.perform_proportionally on the PullFunding actions of
+        # each lender
+        maximum = self.sum_by_lender(maxima)
+        can_perform = (maximum > 0.0) & (amount > 0.0)
+        _amount = np.where(can_perform, np.minimum(maximum, amount), 0.0)
+        each = maxima * _amount[self.rows] / np.where(can_perform, maximum, 1.0)[self.rows]
+        each[each <= eps] = 0.0
+        if self.parameters.FUNDING_CONTAGION_INTERBANK:
+            # PullFundingObgn, due in TIMESTEPS_TO_PAY timesteps
+            self.fundingAlreadyPulled += each
+            self.requests[self.time % len(self.requests)] += each
+        else:
+            # The funding is repaid at once, and the borrowers refinance it
+            # from the external node
+            self.cash += self.sum_by_lender(each)
+            self.other_liabilities += self.sum_by_borrower(each)
+            self.principal -= each
+        return _amount
+
+    def pull_funding_proportionally(self, amount):
+        """
+        LeveragedInst.pull_funding_proportionally for all the institutions
+        at once, for the amounts (of size n) to be pulled by each of them:
+        first from the interbank loans, then from the repos. The requests
+        are due in TIMESTEPS_TO_PAY timesteps. Returns the amount pulled by
+        each institution (which is the amount itself for those whose
+        interbank loans are enough) and whether it is enough.
+        """
+        amount = np.where(self.alive, np.asarray(amount, dtype=float), 0.0)
+        maxima = self.get_max()
+        pulled = self._pull_proportionally(amount, np.where(self.is_repo, 0.0, maxima))
+        is_enough_interbank = (amount <= 0) | isequal_float(pulled, amount)
+        remaining = amount - pulled
+        pulled_repo = self._pull_proportionally(
+            np.where(is_enough_interbank, 0.0, remaining), np.where(self.is_repo, maxima, 0.0))
+        is_enough = is_enough_interbank | (remaining <= 0) | isequal_float(pulled_repo, remaining)
+        return np.where(is_enough_interbank, amount, pulled + pulled_repo), is_enough
+
+    # Cash flows
+    def _get_due(self, k):
+        # The requests due in k timesteps
+        return self.requests[(self.time + k) % len(self.requests)]
+
+    def get_cash_commitments(self):
+        """
+        The (n, TIMESTEPS_TO_PAY) amounts that each institution has to pay
+        in 1, ..., TIMESTEPS_TO_PAY timesteps
+        """
+        ttp = len(self.requests)
+        return np.stack([self.sum_by_borrower(self._get_due(k)) for k in range(1, ttp + 1)], axis=-1)
+
+    def get_cash_inflows(self):
+        """
+        The (n, TIMESTEPS_TO_PAY) amounts that each institution expects to
+        receive in 1, ..., TIMESTEPS_TO_PAY timesteps
+        """
+        ttp = len(self.requests)
+        return np.stack([self.sum_by_lender(self._get_due(k)) for k in range(1, ttp + 1)], axis=-1)
+
+    def get_liquidity_shortfall(self):
+        """
+        The liquidity that each institution has to raise (e.g. by selling
+        assets) within TIMESTEPS_TO_PAY timesteps to meet its cash
+        commitments, as in the first step of
+        LeveragedInst.perform_liquidity_management
+        """
+        balance = self.cash[:, None] + np.cumsum(self.get_cash_inflows() - self.get_cash_commitments(), axis=-1)
+        return np.where(self.alive, np.maximum(0, -balance.min(axis=-1)), 0.0)
+
+    def pay_matured_requests(self):
+        """
+        Institution.pay_matured_cash_commitments_or_default for all the
+        institutions at once. The institutions that do not have enough cash
+        to pay their matured requests default, and their loans are
+        liquidated. Returns the institutions that default.
+        """
+        due = self.requests[self.time % len(self.requests)]
+        # Loan.pay_loan pays at most the notional
+        paid = np.minimum(due, self.principal)
+        matured = self.sum_by_borrower(paid)
+        defaulted = self.alive & (self.cash < matured - eps)
+        paid[defaulted[self.indices]] = 0.0
+        self.cash += self.sum_by_lender(paid) - self.sum_by_borrower(paid)
+        self.principal -= paid
+        self.fundingAlreadyPulled = np.maximum(0, self.fundingAlreadyPulled - paid)
+        due[:] = 0.0
+        self.trigger_default(defaulted)
+        return defaulted
+
+    def get_liability_valuation(self):
+        """
+        The liabilities of each institution: its interbank loans and repos,
+        and its other liabilities
+        """
+        return self.sum_by_borrower(self.principal) + self.other_liabilities
+
+    def get_endogenous_LGD(self, cash_raised):
+        """
+        Bank.trigger_default's endogenous LGD of each institution, for the
+        `cash_raised` (of size n) by it when it defaults
+        """
+        L = self.get_liability_valuation()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.maximum(0, 1 - np.where(L != 0, cash_raised / L, np.inf))
+
+    def trigger_default(self, defaulted):
+        """
+        Bank.trigger_default for the institutions that default: their
+        funding is pulled (POSTDEFAULT_PULLFUNDING_CONTAGION), then their
+        loans and repos are liquidated (Loan.liquidate)
+        """
+        if not defaulted.any():
+            return
+        params = self.parameters
+        cash_raised = self.cash.copy()
+        if params.POSTDEFAULT_PULLFUNDING_CONTAGION:
+            maxima = np.where(defaulted[self.rows], self.get_max(), 0.0)
+            cash_raised += self._pull_proportionally(self.sum_by_lender(maxima), maxima)
+        if params.ENDOGENOUS_LGD_ON:
+            LGD = self.get_endogenous_LGD(cash_raised)[self.indices]
+        else:
+            LGD = params.INTERBANK_LOSS_GIVEN_DEFAULT
+        self.alive &= ~defaulted
+        closed = defaulted[self.indices]
+        if not closed.any():
+            return
+        recovered = np.where(closed & ~self.is_repo, self.principal * (1.0 - LGD), 0.0)
+        self.cash += self.sum_by_lender(recovered)
+        self.principal[closed] = 0.0
+        self.fundingAlreadyPulled[closed] = 0.0
+        self.requests[:, closed] = 0.0
+
+    def step(self, amount=None):
+        """
+        One timestep of the channel: the matured requests are paid, then
+        the institutions pull the `amount` (of size n) of funding. Returns
+        the institutions that default in this timestep.
+        """
+        self.time += 1
+        defaulted = self.pay_matured_requests()
+        if amount is not None:
+            self.pull_funding_proportionally(amount)
+        return defaulted
@@ -0,0 +1,210 @@
+import numpy as np
+
+from ..parameters import eps
+
+
+class MarginCallEngine(object):
+    """
+    A vectorized version of Institution.fulfil_margin_calls_or_default
+    (i.e. Repo.fulfil_margin_call) for the repos of many borrowers at once.
+    The collateral of all the repos is gathered into arrays of (repo,
+    asset) pairs, with the quantities, prices and haircuts of the assets,
+    and the margin call sizes, the proportional pledges and unpledges and
+    the failed margin calls are computed for all the borrowers at once.
+    The results are written back to the Repo and AssetCollateral
+    contracts.
+
+    The repos of a borrower are processed in the order of its ledger, as
+    they may share its cash and its assets, hence the i-th repo of every
+    borrower is processed in the i-th round. As in the object version, a
+    borrower stops at its first failed margin call.
+    """
+    __slots__ = (
+        'borrowers', 'repos', 'assets', 'repo_borrower', 'repo_rank',
+        'edge_repo', 'edge_asset', 'rounds',
+        'cash', 'encumberedCash', 'principal', 'cash_collateral', 'prev_margin_call',
+        'future_margin_call', 'future_max_collateral', 'collateral',
+        'quantity', 'encumberedQuantity', 'price', 'haircut', 'failed'
+    )
+
+    def __init__(self, borrowers):
+        # Imported here so that the engine itself does not depend on
+        # economicsl
+        from ..contracts import Repo
+
+        self.borrowers = list(borrowers)
+        self.repos = []
+        self.assets = []
+        asset_index = {}
+        repo_borrower = []
+        repo_rank = []
+        edge_repo = []
+        edge_asset = []
+        collateral = []
+        for i, borrower in enumerate(self.borrowers):
+            if borrower.isaBank or not borrower.params.MARGIN_CALL_ON:
+                # Do not run margin call if borrower is a bank, see
+                # Repo.fulfil_margin_call
+                continue
+            for rank, repo in enumerate(borrower.get_ledger().get_liabilities_of_type(Repo)):
+                r = len(self.repos)
+                self.repos.append(repo)
+                repo_borrower.append(i)
+                repo_rank.append(rank)
+                for asset, quantity in repo.collateral.items():
+                    k = asset_index.get(id(asset))
+                    if k is None:
+                        k = asset_index[id(asset)] = len(self.assets)
+                        self.assets.append(asset)
+                    edge_repo.append(r)
+                    edge_asset.append(k)
+                    collateral.append(quantity)
+
+        self.repo_borrower = np.array(repo_borrower, dtype=np.intp)
+        self.repo_rank = np.array(repo_rank, dtype=np.intp)
+        self.edge_repo = np.array(edge_repo, dtype=np.intp)
+        self.edge_asset = np.array(edge_asset, dtype=np.intp)
+        n_rounds = self.repo_rank.max() + 1 if len(self.repos) else 0
+        # The repos and the (repo, asset) pairs of each round
+        edge_rank = self.repo_rank[self.edge_repo]
+        self.rounds = [(np.flatnonzero(self.repo_rank == k), np.flatnonzero(edge_rank == k))
+                       for k in range(n_rounds)]
+
+        self.cash = np.array([b.get_cash() for b in self.borrowers], dtype=float)
+        self.encumberedCash = np.array([b.get_encumbered_cash() for b in self.borrowers], dtype=float)
+        self.principal = np.array([r.principal for r in self.repos], dtype=float)
+        self.cash_collateral = np.array([r.cash_collateral for r in self.repos], dtype=float)
+        self.prev_margin_call = np.array([r.prev_margin_call for r in self.repos], dtype=float)
+        self.future_margin_call = np.array([r.future_margin_call for r in self.repos], dtype=float)
+        self.future_max_collateral = np.array([r.future_max_collateral for r in self.repos], dtype=float)
+        self.collateral = np.array(collateral, dtype=float)
+        self.quantity = np.array([a.quantity for a in self.assets], dtype=float)
+        self.encumberedQuantity = np.array([a.encumberedQuantity for a in self.assets], dtype=float)
+        self.price = np.array([a.get_price() for a in self.assets], dtype=float)
+        self.haircut = np.array([a.get_haircut() for a in self.assets], dtype=float)
+        self.failed = np.zeros(len(self.borrowers), dtype=bool)
+
+    def _sum_by_repo(self, values, edges):
+        return np.bincount(self.edge_repo[edges], weights=values, minlength=len(self.repos))
+
+    def _get_max_ue_haircutted_collateral(self, edges):
+        a = self.edge_asset[edges]
+        values = ((self.quantity[a] - self.encumberedQuantity[a]) * self.price[a]) * (1 - self.haircut[a])
+        return self._sum_by_repo(values, edges)
+
+    def _get_haircutted_collateral_valuation(self, edges):
+        a = self.edge_asset[edges]
+        values = self.price[a] * self.collateral[edges] * (1.0 - self.haircut[a])
+        return self._sum_by_repo(values, edges) + self.cash_collateral
+
+    def _get_ue_cash(self, repos):
+        b = self.repo_borrower[repos]
+        return self.cash[b] - self.encumberedCash[b]
+
+    def _pledge_proportionally(self, repos, edges, total):
+        # Repo.pledge_proportionally of `total` (per repo) for the repos
+        # whose total is positive
+        maxHaircutValue = self._get_max_ue_haircutted_collateral(edges)[repos]
+        pledging = (total > 0) & (maxHaircutValue > 0)
+        _factor = np.zeros(len(self.repos))
+        _factor[repos] = np.where(
+            pledging, np.minimum(total, maxHaircutValue) / np.where(pledging, maxHaircutValue, 1.0), 0.0)
+        a = self.edge_asset[edges]
+        quantity_to_pledge = (self.quantity[a] - self.encumberedQuantity[a]) * _factor[self.edge_repo[edges]]
+        self.encumberedQuantity[a] += quantity_to_pledge
+        self.collateral[edges] += quantity_to_pledge
+        pledged = self._sum_by_repo(quantity_to_pledge * self.price[a] * (1 - self.haircut[a]), edges)[repos]
+
+        remainder = np.where(total > 0, total - pledged, 0.0)
+        # resort to encumber cash
+        amount = np.where(remainder > 0, np.minimum(remainder, self._get_ue_cash(repos)), 0.0)
+        self.encumberedCash[self.repo_borrower[repos]] += amount
+        self.cash_collateral[repos] += amount
+
+    def _unpledge_proportionally(self, repos, edges, excess):
+        # Repo.unpledge_proportionally of `excess` (per repo) for the repos
+        # whose excess is positive
+        cash_unpledged = np.where(excess > 0, np.minimum(excess, self.cash_collateral[repos]), 0.0)
+        self.cash_collateral[repos] -= cash_unpledged
+        self.encumberedCash[self.repo_borrower[repos]] -= cash_unpledged
+        remainder = excess - cash_unpledged
+        initial_collateral = self._get_haircutted_collateral_valuation(edges)[repos]
+        unpledging = (excess > 0) & (remainder > eps) & (initial_collateral > 0)
+        _factor = np.zeros(len(self.repos))
+        _factor[repos] = np.where(unpledging, remainder / np.where(unpledging, initial_collateral, 1.0), 0.0)
+        a = self.edge_asset[edges]
+        quantity = self.collateral[edges]
+        _amount = np.minimum(quantity, quantity * _factor[self.edge_repo[edges]])
+        self.encumberedQuantity[a] -= _amount
+        self.collateral[edges] -= _amount
+
+    def run(self):
+        """
+        Run the margin calls of all the repos. Returns the borrowers whose
+        margin call failed, as a boolean array.
+        """
+        for repos, edges in self.rounds:
+            # The borrowers that have failed stop at their failed repo
+            repos = repos[~self.failed[self.repo_borrower[repos]]]
+            edges = edges[~self.failed[self.repo_borrower[self.edge_repo[edges]]]]
+
+            _max_collateral = self._get_max_ue_haircutted_collateral(edges)[repos] + self._get_ue_cash(repos)
+            prev_margin_call = self.prev_margin_call[repos]
+            # The borrower is short of collateral for an amount of
+            # prev_margin_call. If it does not have enough, the margin call
+            # fails, but it pledges as much as possible.
+            failed = (prev_margin_call > 0) & (prev_margin_call > _max_collateral)
+            prev_margin_call = np.where(failed, _max_collateral, prev_margin_call)
+            self.prev_margin_call[repos] = prev_margin_call
+            self._pledge_proportionally(repos, edges, np.where(prev_margin_call > 0, prev_margin_call, 0.0))
+            self.failed[self.repo_borrower[repos[failed]]] = True
+            repos = repos[~failed]
+            edges = edges[~self.failed[self.repo_borrower[self.edge_repo[edges]]]]
+
+            # The borrower needs to return collateral by an amount of
+            # -current_margin_call
+            current_margin_call = self.principal[repos] - self._get_haircutted_collateral_valuation(edges)[repos]
+            self._unpledge_proportionally(
+                repos, edges, np.where(current_margin_call < 0, -current_margin_call, 0.0))
+
+            current_margin_call = self.principal[repos] - self._get_haircutted_collateral_valuation(edges)[repos]
+            self.future_margin_call[repos] = current_margin_call
+            self.future_max_collateral[repos] = (
+                self._get_max_ue_haircutted_collateral(edges)[repos] + self._get_ue_cash(repos))
+            self.prev_margin_call[repos] = current_margin_call
+        return self.failed
+
+    def write_back(self):
+        """
+        Write the collateral, the encumbrance and the margin calls back to
+        the contracts and the borrowers
+        """
+        from ..contracts.valuation import notify_parties
+
+        for r, repo in enumerate(self.repos):
+            repo.cash_collateral = self.cash_collateral.item(r)
+            repo.prev_margin_call = self.prev_margin_call.item(r)
+            repo.future_margin_call = self.future_margin_call.item(r)
+            repo.future_max_collateral = self.future_max_collateral.item(r)
+        for r, k, quantity in zip(self.edge_repo.tolist(), self.edge_asset.tolist(), self.collateral.tolist()):
+            self.repos[r].collateral[self.assets[k]] = quantity
+        for asset, encumberedQuantity in zip(self.assets, self.encumberedQuantity.tolist()):
+            if asset.encumberedQuantity != encumberedQuantity:
+                asset.encumberedQuantity = encumberedQuantity
+                notify_parties(asset)
+        for borrower, encumberedCash in zip(self.borrowers, self.encumberedCash.tolist()):
+            borrower.encumberedCash = encumberedCash
+
+    def fulfil(self):
+        """
+        Run the margin calls, write the results back, and leave the outcome
+        to each borrower, whose fulfil_margin_calls_or_default then defaults
+        if its margin call failed instead of running its margin calls again.
+        The outcome is stamped with the timestep, so that it is ignored by a
+        borrower that only acts in a later timestep.
+        """
+        failed = self.run()
+        self.write_back()
+        for borrower, _failed in zip(self.borrowers, failed.tolist()):
+            borrower.margin_call_failed = (borrower.get_time(), _failed)
+        return failed
@@ -0,0 +1,487 @@
+import numpy as np
+
+from ..parameters import eps
+from ..pecking_order import plan_pecking_order_on_RWA
+
+TRADABLE_CATEGORIES = ['equities', 'corpbonds', 'govbonds', 'othertradables']
+# The order of the tradable part of the pecking order in
+# LeveragedInst.raise_liquidity_with_pecking_order_on_RWA
+RWA_PECKING_ORDER = ['corpbonds', 'othertradables', 'equities']
+# The attributes of MatrixEngine that change during a run. Everything else is
+# calibration data, shared between the copies and scenarios of an engine.
+STATE = (
+    'cash', 'holdings', 'putForSale', 'orders', 'liabilities', 'alive',
+    'prices', 'oldPrices', 'priceImpacts', 'quantities_sold', 'cumulative_quantities_sold'
+)
+
+
+def allocate_proportionally(maxima, amount=None):
+    """
+    Array version of behaviours.perform_proportionally, for many
+    institutions at once. `maxima` has the shape (..., n, k), i.e. the
+    get_max() of the k actions of each of the n institutions, and `amount`
+    the shape (..., n). Returns the amount performed by each institution
+    and the amount of each action, where the actions whose amount is not
+    above eps are zeroed, as they are not performed.
+    """
+    maximum = maxima.sum(axis=-1)
+    if amount is None:
+        amount = maximum
+    can_perform = (maximum > 0.0) & (amount > 0.0)
+    _amount = np.where(can_perform, np.minimum(maximum, amount), 0.0)
+    # Same operation order as action.get_max() * _amount / maximum
+    each = maxima * _amount[..., None] / np.where(can_perform, maximum, 1.0)[..., None]
+    each[each <= eps] = 0.0
+    return _amount, each
+
+
+class MatrixEngine(object):
+    """
+    A vectorized version of the system of Banks of the Cont-Schaanning
+    stress test (see examples/cont_schaanning_2017.py). The balance sheets
+    of the n banks are stored as arrays, with the holdings of the m tradable
+    asset types as an n x m matrix, and each timestep (market clearing,
+    insolvency check, St. Patrick Day's algorithm and trigger_default) is
+    done for all banks at once.
+
+    The state (see STATE) may have a leading scenario axis, in which case
+    each timestep advances all the scenarios at once; see run_scenarios.
+
+    Only what the Bank class does without an interbank or repo network is
+    modelled: cash, tradable assets, Other assets and the liabilities that
+    can be paid off. There are no obligations in the mailboxes, and
+    collateral haircuts are not tracked, since no bank uses them.
+    """
+    __slots__ = (
+        'parameters', 'asset_types', 'asset_index', 'n', 'm',
+        'cash', 'holdings', 'putForSale', 'orders', 'other_assets', 'liabilities',
+        'AT1E', 'T2C', 'DeltaE', 'DeltaA', 'RWA_weights', 'RWCR_buffer', 'RWCR_target',
+        'RWCR_min', 'leverage_buffer', 'leverage_target', 'LCR_den',
+        'prices', 'oldPrices', 'priceImpacts', 'total_quantities',
+        'quantities_sold', 'cumulative_quantities_sold', 'alive',
+        'category_mask', 'sellable', 'external1'
+    )
+
+    def __init__(self, parameters, asset_types, cash, holdings, other_assets, liabilities,
+                 RWA_weights, RWCR_buffer, RWCR_target, total_quantities, prices=None,
+                 AT1E=0.0, T2C=0.0, DeltaE=0.0, DeltaA=0.0, RWCR_min=None,
+                 leverage_buffer=None, leverage_target=None, LCR_den=None):
+        self.parameters = parameters
+        self.asset_types = list(asset_types)
+        self.asset_index = {a: j for j, a in enumerate(self.asset_types)}
+        self.n, self.m = np.shape(holdings)
+        assert self.m == len(self.asset_types)
+
+        def _per_bank(x):
+            return np.array(np.broadcast_to(np.asarray(x, dtype=float), (self.n,)))
+
+        # Balance sheets
+        self.cash = _per_bank(cash)
+        self.holdings = np.array(holdings, dtype=float)
+        self.putForSale = np.zeros((self.n, self.m))
+        # The quantities put for sale since the last market clearing
+        self.orders = np.zeros((self.n, self.m))
+        self.other_assets = _per_bank(other_assets)
+        self.liabilities = _per_bank(liabilities)
+        self.AT1E = _per_bank(AT1E)
+        self.T2C = _per_bank(T2C)
+        self.DeltaE = _per_bank(DeltaE)
+        self.DeltaA = _per_bank(DeltaA)
+        self.alive = np.ones(self.n, dtype=bool)
+
+        # Constraints
+        self.RWA_weights = {k: _per_bank(v) for k, v in RWA_weights.items()}
+        self.RWCR_buffer = _per_bank(RWCR_buffer)
+        self.RWCR_target = _per_bank(RWCR_target)
+        self.RWCR_min = _per_bank(parameters.RWCR_FLTF if RWCR_min is None else RWCR_min)
+        self.leverage_buffer = _per_bank(parameters.BANK_LEVERAGE_BUFFER if leverage_buffer is None else leverage_buffer)
+        self.leverage_target = _per_bank(parameters.BANK_LEVERAGE_TARGET if leverage_target is None else leverage_target)
+        self.LCR_den = None if LCR_den is None else _per_bank(LCR_den)
+        if parameters.BANK_LCR_ON and self.LCR_den is None:
+            raise ValueError("LCR_den is required when BANK_LCR_ON is True")
+
+        # Market
+        self.prices = np.ones(self.m) if prices is None else np.array(prices, dtype=float)
+        self.oldPrices = self.prices.copy()
+        self.priceImpacts = np.array([parameters.PRICE_IMPACTS[a] for a in self.asset_types], dtype=float)
+        self.total_quantities = np.array(total_quantities, dtype=float)
+        self.quantities_sold = np.zeros(self.m)
+        self.cumulative_quantities_sold = np.zeros(self.m)
+
+        # Column masks
+        categories = {
+            'govbonds': parameters.govbonds_dict,
+            'corpbonds': parameters.corpbonds_dict,
+            'equities': parameters.equities_dict,
+            'othertradables': parameters.othertradables_dict,
+        }
+        self.category_mask = {
+            k: np.array([a in v.values() for a in self.asset_types], dtype=bool)
+            for k, v in categories.items()
+        }
+        AssetType = parameters.AssetType
+        externals = [getattr(AssetType, 'EXTERNAL%d' % i, None) for i in (1, 2, 3)]
+        self.sellable = np.array([a not in externals for a in self.asset_types], dtype=bool)
+        self.external1 = np.array([a == externals[0] for a in self.asset_types], dtype=bool)
+
+    @classmethod
+    def from_model(cls, model):
+        """
+        Build the engine from the Banks of an initialized model, e.g. the
+        Model of the Cont-Schaanning example after Model.initialize().
+        """
+        # Imported here so that the engine itself does not depend on
+        # economicsl
+        from ..contracts import Loan, Other, Repo
+
+        params = model.parameters
+        banks = model.allAgents
+        market = model.assetMarket
+        asset_types = sorted(set(market.total_quantities.keys()).union(
+            *(b.asset_collaterals.keys() for b in banks)))
+        holdings = np.zeros((len(banks), len(asset_types)))
+        for i, bank in enumerate(banks):
+            ldg = bank.get_ledger()
+            if ldg.get_assets_of_type(Loan) or ldg.get_assets_of_type(Repo) or ldg.get_liabilities_of_type(Repo):
+                raise ValueError("MatrixEngine does not model interbank loans or repos")
+            for j, atype in enumerate(asset_types):
+                holdings[i, j] = sum(a.quantity for a in bank.asset_collaterals.get(atype, []))
+
+        def _get(name, default=0.0):
+            return [getattr(b, name, default) for b in banks]
+
+        weights = {k: [b.RWA_weights[k] for b in banks] for k in banks[0].RWA_weights}
+        return cls(
+            params, asset_types,
+            cash=[b.get_ue_cash() for b in banks],
+            holdings=holdings,
+            other_assets=[b.get_asset_valuation_of(Other) for b in banks],
+            liabilities=[b.get_liability_valuation() for b in banks],
+            RWA_weights=weights,
+            RWCR_buffer=_get('RWCR_buffer'),
+            RWCR_target=_get('RWCR_target'),
+            total_quantities=[market.total_quantities.get(a, 0.0) for a in asset_types],
+            prices=[market.get_price(a) for a in asset_types],
+            AT1E=_get('AT1E'), T2C=_get('T2C'), DeltaE=_get('DeltaE'), DeltaA=_get('DeltaA'),
+            RWCR_min=_get('RWCR_FLTF', params.RWCR_FLTF),
+            leverage_buffer=_get('leverage_buffer', params.BANK_LEVERAGE_BUFFER),
+            leverage_target=_get('leverage_target', params.BANK_LEVERAGE_TARGET),
+            LCR_den=_get('LCR_den_initial', np.nan) if params.BANK_LCR_ON else None,
+        )
+
+    def copy(self):
+        """
+        Returns a copy of the engine, which shares the calibration data
+        """
+        new = object.__new__(type(self))
+        for k in self.__slots__:
+            setattr(new, k, getattr(self, k))
+        for k in STATE:
+            setattr(new, k, getattr(self, k).copy())
+        return new
+
+    def expand(self, n_scenarios):
+        """
+        Returns a copy of the (unbatched) engine with n_scenarios identical
+        scenarios
+        """
+        new = self.copy()
+        for k in STATE:
+            arr = getattr(self, k)
+            setattr(new, k, np.repeat(arr[None], n_scenarios, axis=0))
+        return new
+
+    def select(self, scenarios):
+        """
+        Keep only the given scenarios (indices or boolean mask) of a batched
+        engine
+        """
+        for k in STATE:
+            setattr(self, k, getattr(self, k)[scenarios])
+
+    # Valuations
+    def _get_position_prices(self):
+        # The prices broadcast over the bank axis
+        return self.prices[..., None, :]
+
+    def get_asset_valuation(self):
+        return self.cash + (self.holdings * self._get_position_prices()).sum(axis=-1) + self.other_assets
+
+    def get_CET1E(self):
+        E = self.get_asset_valuation() - self.liabilities
+        return E - (self.AT1E + self.T2C) - self.DeltaE
+
+    def get_leverage(self):
+        lev_exposure = self.get_asset_valuation() - self.DeltaA
+        return (self.get_CET1E() + self.AT1E) / lev_exposure
+
+    def get_RWA(self):
+        w = self.RWA_weights
+        # The part of the assets that has been marked for sale is excluded
+        marked = (self.holdings - self.putForSale) * self._get_position_prices()
+        rw = 0.0
+        for k in TRADABLE_CATEGORIES:
+            rw = rw + w[k] * marked[..., self.category_mask[k]].sum(axis=-1)
+        rw = rw + w['other'] * self.other_assets
+        rw = rw + w['external'] * (self.holdings * self._get_position_prices())[..., self.external1].sum(axis=-1)
+        return rw
+
+    def get_RWA_ratio(self):
+        rwa = self.get_RWA()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(rwa > 0, self.get_CET1E() / rwa, np.inf)
+
+    def get_gov_bonds(self):
+        return (self.holdings * self._get_position_prices())[..., self.category_mask['govbonds']].sum(axis=-1)
+
+    def get_total_sold(self):
+        return self.cumulative_quantities_sold.sum(axis=-1) / self.total_quantities.sum(axis=-1)
+
+    # Market
+    def apply_initial_shock(self, assetType, fraction):
+        """
+        In a batched engine, assetType and fraction may be given per
+        scenario.
+        """
+        if self.prices.ndim == 1:
+            j = self.asset_index[assetType]
+            self.prices[j] = self.prices[j] * (1.0 - fraction)
+            return
+        n_scenarios = len(self.prices)
+        j = [self.asset_index[a] for a in np.broadcast_to(assetType, (n_scenarios,)).tolist()]
+        rows = np.arange(n_scenarios)
+        self.prices[rows, j] = self.prices[rows, j] * (1.0 - np.broadcast_to(fraction, (n_scenarios,)))
+
+    def clear_the_market(self):
+        params = self.parameters
+        self.oldPrices = self.prices.copy()
+        if params.PREDEFAULT_FIRESALE_CONTAGION or params.POSTDEFAULT_FIRESALE_CONTAGION:
+            traded = (self.quantities_sold > 0) & (self.total_quantities > 0)
+            fraction_sold = self.quantities_sold / np.where(traded, self.total_quantities, 1.0)
+            # The holders are devalued implicitly, since every position is
+            # valued at the market price
+            self.prices = np.where(traded, np.maximum(0, self.prices - fraction_sold * self.priceImpacts), self.prices)
+        self.cumulative_quantities_sold += self.quantities_sold
+        self.quantities_sold = np.zeros_like(self.quantities_sold)
+
+        # Perform the sale
+        sold = np.minimum(self.holdings, self.orders)
+        value_sold = sold * ((self.prices + self.oldPrices) / 2)[..., None, :]
+        self.cash += np.where(value_sold >= eps, value_sold, 0.0).sum(axis=-1)
+        self.holdings -= sold
+        self.putForSale -= sold
+        self.orders = np.zeros_like(self.orders)
+
+    def _get_sell_maxima(self, eligible, mask=None):
+        # SellAsset.get_max() of every (bank, asset type)
+        if mask is not None:
+            eligible = eligible & mask
+        price = self._get_position_prices()
+        maxima = self.holdings * price - self.putForSale * price
+        return np.where(eligible, maxima, 0.0)
+
+    def _put_for_sale(self, each):
+        """
+        SellAsset.perform followed by TradableAsset.put_for_sale, for the
+        amounts (in value) of `each`.
+        """
+        price = self._get_position_prices()
+        positive = price > eps
+        with np.errstate(divide='ignore', invalid='ignore'):
+            quantity = np.where(positive, each / price, 0.0)
+            effective_qty = np.where(positive, self.holdings * price / price, 0.0)
+        quantity[np.abs(quantity) <= eps] = 0.0
+        snap = (quantity > 0) & (np.abs(effective_qty - quantity) <= 2 * eps)
+        quantity = np.where(snap, effective_qty, quantity)
+        self.putForSale += quantity
+        self.orders += quantity
+        self.quantities_sold += quantity.sum(axis=-2)
+
+    def _sell_proportionally(self, amount, eligible, mask=None):
+        _amount, each = allocate_proportionally(self._get_sell_maxima(eligible, mask), amount)
+        self._put_for_sale(each)
+        return _amount
+
+    def _raise_liquidity_with_pecking_order(self, amount, eligible, active):
+        amount = np.where(active, amount, 0.0)
+        if self.parameters.PREDEFAULT_PULLFUNDING_CONTAGION:
+            # There is no funding to pull. It is enough only when the amount
+            # is negligible.
+            amount = np.where(np.abs(amount) < eps, 0.0, amount)
+        return self._sell_proportionally(amount, eligible)
+
+    def _raise_liquidity_with_pecking_order_on_RWA(self, CET1E, eligible, active):
+        w = self.RWA_weights
+        rwa = self.get_RWA()
+        weight_masks = []
+        if self.parameters.PREDEFAULT_PULLFUNDING_CONTAGION:
+            # Interbank assets and reverse repos, which are not modelled
+            weight_masks += [(w['loan'], None), (w['repo'], None)]
+        weight_masks += [(w[k], self.category_mask[k]) for k in RWA_PECKING_ORDER]
+
+        weights = np.stack([np.broadcast_to(weight, rwa.shape) for weight, _ in weight_masks], axis=-1)
+        capacities = np.stack([
+            np.zeros_like(rwa) if mask is None else self._get_sell_maxima(eligible, mask).sum(axis=-1)
+            for _, mask in weight_masks], axis=-1)
+        amounts, _ = plan_pecking_order_on_RWA(
+            np.where(active, rwa, 0.0), np.where(active, CET1E / self.RWCR_target, 0.0), weights, capacities)
+        for g, (_, mask) in enumerate(weight_masks):
+            if mask is not None:
+                self._sell_proportionally(amounts[..., g], eligible, mask)
+        return amounts.sum(axis=-1)
+
+    def act(self, eligible):
+        """
+        Insolvency check and St. Patrick Day's algorithm of Bank.act, for
+        all the banks that are alive. `eligible` are the SellAsset actions
+        available at the start of act(). Returns the banks that default.
+        """
+        params = self.parameters
+        alive = self.alive
+        CET1E = self.get_CET1E()
+
+        # If I'm insolvent, default.
+        defaulted = np.zeros_like(alive)
+        if params.LIQUIDATION_CONTAGION:
+            if params.BANK_RWA_ON:
+                defaulted |= self.get_RWA_ratio() < (self.RWCR_min - eps)
+            if params.BANK_LEVERAGE_ON:
+                defaulted |= self.get_leverage() < (params.BANK_LEVERAGE_MIN - eps)
+            defaulted &= alive
+        active = alive & ~defaulted
+        if not (params.PREDEFAULT_FIRESALE_CONTAGION or params.PREDEFAULT_PULLFUNDING_CONTAGION):
+            return defaulted
+
+        # 1-2. There are no obligations, hence nothing to do to meet them.
+        balance = self.cash.copy()
+        minimumSpareBalanceInThePeriod = balance
+        # If CET1E is negative, do not do anything anymore
+        active &= CET1E >= 0
+
+        if params.BANK_LEVERAGE_ON:
+            # 3. Pay off liabilities to delever
+            lev = self.get_leverage()
+            below_buffer = lev < (self.leverage_buffer - eps)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                amountToDelever = np.where(
+                    below_buffer, np.maximum(0, CET1E / lev - CET1E / self.leverage_target), 0.0)
+            deLever = np.minimum(np.minimum(minimumSpareBalanceInThePeriod, self.cash - self.get_cash_buffer()),
+                                 amountToDelever)
+            deLever = np.where(active, deLever, 0.0)
+            paid, each = allocate_proportionally(
+                np.where(active & (self.liabilities > 0), self.liabilities, 0.0)[..., None],
+                np.where(deLever > 0, deLever, 0.0))
+            self.cash -= each.sum(axis=-1)
+            self.liabilities -= each.sum(axis=-1)
+            deLever = np.where(deLever > 0, paid, deLever)
+            amountToDelever -= np.where(deLever > 0, paid, 0.0)
+            balance = balance - deLever
+
+            # 4. Raise liquidity to delever later
+            short = active & (balance < amountToDelever)
+            self._raise_liquidity_with_pecking_order(amountToDelever - balance, eligible, short)
+
+        # 5. Raise liquidity to reach RWCR target
+        cash_raised_RWA = np.zeros(CET1E.shape)
+        if params.BANK_RWA_ON:
+            below_buffer = active & (self.get_RWA_ratio() < self.RWCR_buffer)
+            if below_buffer.any():
+                cash_raised_RWA = self._raise_liquidity_with_pecking_order_on_RWA(CET1E, eligible, below_buffer)
+
+        # 6. Raise liquidity to reach LCR target
+        if params.BANK_LCR_ON:
+            den = self.LCR_den
+            HQLA = self.cash + self.get_gov_bonds() + cash_raised_RWA
+            below_buffer = active & (HQLA / den < params.BANK_LCR_BUFFER)
+            liquidityToRaise = np.maximum(params.BANK_LCR_TARGET * den, 0) - HQLA
+            self._raise_liquidity_with_pecking_order(liquidityToRaise, eligible, below_buffer)
+        return defaulted
+
+    def get_cash_buffer(self):
+        if not self.parameters.BANK_LCR_ON:
+            return 0.0
+        return np.maximum(self.parameters.BANK_LCR_BUFFER * self.LCR_den - self.get_gov_bonds(), 0)
+
+    def trigger_default(self, defaulted, eligible):
+        self.alive = self.alive & ~defaulted
+        if self.parameters.POSTDEFAULT_FIRESALE_CONTAGION:
+            maxima = np.where(defaulted[..., None], self._get_sell_maxima(eligible), 0.0)
+            _, each = allocate_proportionally(maxima)
+            self._put_for_sale(each)
+        # Liquidate all the liabilities
+        self.liabilities = np.where(defaulted, 0.0, self.liabilities)
+
+    def step(self):
+        """
+        One timestep of Model.run_simulation. Returns the number of banks
+        that default in this timestep.
+        """
+        self.clear_the_market()
+        # The SellAsset actions available at the start of act()
+        eligible = self.sellable & (self.holdings > self.putForSale)
+        defaulted = self.act(eligible)
+        self.trigger_default(defaulted, eligible)
+        return defaulted.sum(axis=-1)
+
+    def run(self, timesteps):
+        """
+        Returns the defaults and total_sold series in the same shape as
+        Model.run_simulation of the Cont-Schaanning example. The run stops
+        early once it is quiescent, and the series are padded.
+        """
+        defaults = [0]
+        total_sold = []
+        for t in range(timesteps):
+            defaults.append(int(self.step()))
+            total_sold.append(float(self.get_total_sold()))
+            if self.is_quiescent(defaults[-1]):
+                remaining = timesteps - t - 1
+                defaults += [0] * remaining
+                total_sold += [total_sold[-1]] * remaining
+                break
+        return defaults, total_sold
+
+    def is_quiescent(self, new_defaults):
+        """
+        Nobody defaulted or sold during the timestep, so that the state is a
+        fixed point of step()
+        """
+        return (new_defaults == 0) & ~(self.quantities_sold > 0).any(axis=-1)
+
+    def run_scenarios(self, shocks, timesteps, price_impacts=None):
+        """
+        Run many scenarios of the same calibrated (and unshocked) system in
+        one batch. `shocks` is a sequence of (assetType, fraction) initial
+        shocks, one per scenario, and `price_impacts` an optional sequence of
+        PRICE_IMPACTS-like mappings, also one per scenario.
+
+        Returns the defaults and total_sold arrays of shape
+        (n_scenarios, timesteps + 1) and (n_scenarios, timesteps), whose rows
+        are what run() returns for each scenario. A scenario in which nobody
+        defaults or sells in a timestep has reached a fixed point, so it is
+        dropped from the batch and its series are padded.
+        """
+        n_scenarios = len(shocks)
+        batch = self.expand(n_scenarios)
+        if price_impacts is not None:
+            assert len(price_impacts) == n_scenarios
+            batch.priceImpacts = np.array(
+                [[pi[a] for a in self.asset_types] for pi in price_impacts], dtype=float)
+        assetTypes, fractions = zip(*shocks) if n_scenarios else ((), ())
+        batch.apply_initial_shock(list(assetTypes), np.array(fractions, dtype=float))
+
+        defaults = np.zeros((n_scenarios, timesteps + 1), dtype=int)
+        total_sold = np.zeros((n_scenarios, timesteps))
+        live = np.arange(n_scenarios)
+        for t in range(timesteps):
+            if len(live) == 0:
+                break
+            new_defaults = batch.step()
+            defaults[live, t + 1] = new_defaults
+            total_sold[live, t] = batch.get_total_sold()
+            quiet = batch.is_quiescent(new_defaults)
+            if quiet.any():
+                total_sold[live[quiet], t + 1:] = total_sold[live[quiet], t][:, None]
+                live = live[~quiet]
+                batch.select(~quiet)
+        return defaults, total_sold
@@ -0,0 +1,200 @@
+import numpy as np
+
+# The asset groups pledged by Hedgefund.create_repos, in order, before
+# resorting to cash
+COLLATERAL_ORDER = ['corpbonds', 'equities', 'othertradables', 'govbonds']
+# The repo that receives the cash collateral
+CASH_REPO = COLLATERAL_ORDER.index('othertradables')
+
+
+class RepoNetworkBuilder(object):
+    """
+    A bulk version of Hedgefund.create_repos, for many (lender, borrower,
+    principal) repo relationships at once, e.g. when initializing tens of
+    thousands of them from data. The pledges are computed on arrays of
+    (borrower, asset) pairs, for all the borrowers at once, before the Repo
+    contracts are created with their collateral.
+
+    Each relationship gets the same repos and pledges as
+    Hedgefund.create_repos: one repo per asset group, in the order
+    corpbonds -> equities -> othertradables -> govbonds, until the principal
+    is covered, and then the cash. The relationships of a borrower share its
+    assets and cash, so they are processed in order, the i-th relationship
+    of every borrower in the i-th round.
+    """
+    __slots__ = (
+        'lenders', 'borrowers', 'principals', 'parties', 'pair_borrower', 'pair_rank',
+        'assets', 'edge_group', 'edge_start', 'edge_end',
+        'quantity', 'encumberedQuantity', 'price', 'haircut', 'cash', 'encumberedCash',
+        'tried', 'repo_principal', 'cash_collateral', 'collateral'
+    )
+
+    def __init__(self, lenders, borrowers, principals):
+        self.lenders = list(lenders)
+        self.borrowers = list(borrowers)
+        self.principals = np.array(principals, dtype=float)
+        assert len(self.lenders) == len(self.borrowers) == len(self.principals)
+
+        # The distinct borrowers, and the rank of each relationship among
+        # those of its borrower
+        self.parties = []
+        index = {}
+        pair_borrower = []
+        pair_rank = []
+        counts = []
+        for borrower in self.borrowers:
+            b = index.get(id(borrower))
+            if b is None:
+                b = index[id(borrower)] = len(self.parties)
+                self.parties.append(borrower)
+                counts.append(0)
+            pair_rank.append(counts[b])
+            counts[b] += 1
+            pair_borrower.append(b)
+        self.pair_borrower = np.array(pair_borrower, dtype=np.intp)
+        self.pair_rank = np.array(pair_rank, dtype=np.intp)
+
+        # The collateral of each borrower, grouped by borrower then by asset
+        # group
+        self.assets = []
+        edge_group = []
+        self.edge_start = np.zeros(len(self.parties), dtype=np.intp)
+        self.edge_end = np.zeros(len(self.parties), dtype=np.intp)
+        for b, borrower in enumerate(self.parties):
+            self.edge_start[b] = len(self.assets)
+            for g, name in enumerate(COLLATERAL_ORDER):
+                collateral = borrower.get_tradable_of_type(name)
+                self.assets += collateral
+                edge_group += [g] * len(collateral)
+            self.edge_end[b] = len(self.assets)
+        self.edge_group = np.array(edge_group, dtype=np.intp)
+
+    def _gather(self):
+        self.quantity = np.array([a.quantity for a in self.assets], dtype=float)
+        self.encumberedQuantity = np.array([a.encumberedQuantity for a in self.assets], dtype=float)
+        self.price = np.array([a.get_price() for a in self.assets], dtype=float)
+        self.haircut = np.array([a.get_haircut() for a in self.assets], dtype=float)
+        self.cash = np.array([b.get_cash() for b in self.parties], dtype=float)
+        self.encumberedCash = np.array([b.get_encumbered_cash() for b in self.parties], dtype=float)
+        n = len(self.principals)
+        self.tried = np.zeros((n, len(COLLATERAL_ORDER)), dtype=bool)
+        self.repo_principal = np.zeros((n, len(COLLATERAL_ORDER)))
+        self.cash_collateral = np.zeros((n, len(COLLATERAL_ORDER)))
+        # relationship -> the quantities pledged from each asset of its
+        # borrower
+        self.collateral = {}
+
+    def _pledge_cash(self, borrowers, amount, mask):
+        # Institution.encumber_cash, for the borrowers of the mask
+        amount = np.where(mask, np.minimum(amount, self.cash[borrowers] - self.encumberedCash[borrowers]), 0.0)
+        self.encumberedCash[borrowers] += amount
+        return amount
+
+    def _plan_round(self, pairs):
+        borrowers = self.pair_borrower[pairs]
+        edges = np.concatenate(
+            [np.arange(self.edge_start[b], self.edge_end[b]) for b in borrowers.tolist()] + [[]]).astype(np.intp)
+        # The position in `pairs` of the relationship of each edge
+        counts = (self.edge_end - self.edge_start)[borrowers]
+        edge_pair = np.repeat(np.arange(len(pairs)), counts)
+        pledged_quantities = np.zeros(len(edges))
+
+        remainder = self.principals[pairs]
+        pending = np.ones(len(pairs), dtype=bool)
+        for g in range(len(COLLATERAL_ORDER)):
+            self.tried[pairs, g] = pending
+            in_group = (self.edge_group[edges] == g) & pending[edge_pair]
+            # The edges are the indices of the assets
+            a, p = edges[in_group], edge_pair[in_group]
+            # Repo.get_max_ue_haircutted_collateral
+            max_collateral = np.bincount(
+                p, weights=((self.quantity[a] - self.encumberedQuantity[a]) * self.price[a]) * (1 - self.haircut[a]),
+                minlength=len(pairs))
+            pledge_amount = np.where(pending, np.minimum(max_collateral, remainder), 0.0)
+
+            # Repo.pledge_proportionally
+            pledging = pending & (max_collateral > 0)
+            _factor = np.where(pledging, pledge_amount / np.where(pledging, max_collateral, 1.0), 0.0)
+            quantity_to_pledge = (self.quantity[a] - self.encumberedQuantity[a]) * _factor[p]
+            self.encumberedQuantity[a] += quantity_to_pledge
+            pledged_quantities[in_group] = quantity_to_pledge
+            pledged = np.bincount(
+                p, weights=quantity_to_pledge * self.price[a] * (1 - self.haircut[a]), minlength=len(pairs))
+            rest = np.where(pending, pledge_amount - pledged, 0.0)
+            cash_pledged = self._pledge_cash(borrowers, rest, rest > 0)
+            self.cash_collateral[pairs, g] = cash_pledged
+
+            isnot_enough = pledge_amount < remainder
+            self.repo_principal[pairs, g] = np.where(isnot_enough, pledge_amount, remainder)
+            remainder = np.where(pending, remainder - pledge_amount, remainder)
+            pending &= isnot_enough
+
+        # cash
+        cash_pledged = self._pledge_cash(borrowers, remainder, pending)
+        self.cash_collateral[pairs, CASH_REPO] += cash_pledged
+        self.repo_principal[pairs, CASH_REPO] += cash_pledged
+
+        for pair, quantities in zip(pairs.tolist(), np.split(pledged_quantities, np.cumsum(counts)[:-1])):
+            self.collateral[pair] = quantities
+        return pending & (cash_pledged < remainder)
+
+    def plan(self, n=None):
+        """
+        Compute the repos of the first n relationships (by default all of
+        them) without creating them. Returns the relationships whose margin
+        call fails, i.e. for which the borrower's collateral and cash are
+        not enough.
+        """
+        n = len(self.principals) if n is None else n
+        self._gather()
+        failed = np.zeros(len(self.principals), dtype=bool)
+        for k in range(self.pair_rank[:n].max() + 1 if n else 0):
+            pairs = np.flatnonzero(self.pair_rank[:n] == k)
+            failed[pairs] = self._plan_round(pairs)
+        return failed
+
+    def build(self):
+        """
+        Create the repos and pledge their collateral. As with successive
+        calls of Hedgefund.create_repos, the relationships after the first
+        one that fails are not created, and FailedMarginCallException is
+        raised. Returns the repos that are created.
+        """
+        # Imported here so that the engine itself does not depend on
+        # economicsl
+        from ..contracts import FailedMarginCallException, Repo
+        from ..contracts.valuation import notify_parties
+
+        failed = self.plan()
+        n = len(self.principals)
+        is_failed = failed.any()
+        if is_failed:
+            n = np.flatnonzero(failed)[0] + 1
+            self.plan(n)
+
+        repos = []
+        for pair in range(n):
+            lender, borrower = self.lenders[pair], self.borrowers[pair]
+            b = self.pair_borrower[pair]
+            assets = self.assets[self.edge_start[b]:self.edge_end[b]]
+            groups = self.edge_group[self.edge_start[b]:self.edge_end[b]].tolist()
+            quantities = self.collateral[pair].tolist()
+            for g in range(len(COLLATERAL_ORDER)):
+                if not self.tried[pair, g]:
+                    break
+                repo = Repo(lender, borrower, self.repo_principal.item(pair, g))
+                repo.collateral = {a: q for a, q, _g in zip(assets, quantities, groups) if _g == g}
+                repo.cash_collateral = self.cash_collateral.item(pair, g)
+                lender.add(repo)
+                borrower.add(repo)
+                repos.append(repo)
+
+        for asset, encumberedQuantity in zip(self.assets, self.encumberedQuantity.tolist()):
+            if asset.encumberedQuantity != encumberedQuantity:
+                asset.encumberedQuantity = encumberedQuantity
+                notify_parties(asset)
+        for borrower, encumberedCash in zip(self.parties, self.encumberedCash.tolist()):
+            borrower.encumberedCash = encumberedCash
+        if is_failed:
+            raise FailedMarginCallException("Failed Margin Call")
+        return repos
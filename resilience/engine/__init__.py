@@ -0,0 +1,4 @@
+from .InterbankNetwork import InterbankNetwork
+from .MarginCallEngine import MarginCallEngine
+from .MatrixEngine import MatrixEngine
+from .RepoNetworkBuilder import RepoNetworkBuilder
@@ -0,0 +1,272 @@
+import logging
+
+import numpy as np
+
+from .AssetMarket import AssetMarket
+
+
+class AssetTypeArrayView(object):
+    """
+    A dict-like view of one of the arrays of an ArrayAssetMarket, keyed by
+    asset type. This keeps code written against the defaultdict-based
+    AssetMarket (e.g. `market.total_quantities[atype] += q`) working.
+    """
+    __slots__ = 'market', 'name'
+
+    def __init__(self, market, name):
+        self.market = market
+        self.name = name
+
+    def _array(self):
+        return getattr(self.market, self.name)[:len(self.market.asset_types)]
+
+    def __getitem__(self, assetType):
+        i = self.market.get_index(assetType)
+        return getattr(self.market, self.name)[i].item()
+
+    def __setitem__(self, assetType, value):
+        i = self.market.get_index(assetType)
+        getattr(self.market, self.name)[i] = value
+
+    def __contains__(self, assetType):
+        return assetType in self.market.asset_index
+
+    def __len__(self):
+        return len(self.market.asset_types)
+
+    def __iter__(self):
+        return iter(self.market.asset_types)
+
+    def get(self, assetType, default=None):
+        if assetType in self.market.asset_index:
+            return self[assetType]
+        return default
+
+    def keys(self):
+        return list(self.market.asset_types)
+
+    def values(self):
+        return self._array().tolist()
+
+    def items(self):
+        return list(zip(self.market.asset_types, self._array().tolist()))
+
+
+class HaircutArrayView(AssetTypeArrayView):
+    """
+    The view of the haircuts, which only holds the asset types that have a
+    haircut (as the haircuts dict of AssetMarket), so that a write marks
+    the asset type as having one.
+    """
+    __slots__ = ()
+
+    def __setitem__(self, assetType, value):
+        i = self.market.get_index(assetType)
+        self.market._haircuts[i] = value
+        self.market._has_haircut[i] = True
+
+    def __contains__(self, assetType):
+        i = self.market.asset_index.get(assetType)
+        return i is not None and bool(self.market._has_haircut[i])
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def keys(self):
+        n = len(self.market.asset_types)
+        return [self.market.asset_types[i] for i in np.flatnonzero(self.market._has_haircut[:n]).tolist()]
+
+    def values(self):
+        return [self[a] for a in self.keys()]
+
+    def items(self):
+        return [(a, self[a]) for a in self.keys()]
+
+
+class ArrayAssetMarket(AssetMarket):
+    """
+    An AssetMarket whose prices, haircuts and traded volumes are stored in
+    contiguous NumPy arrays over a registered asset-type index, so that price
+    impact and haircut updates are done in one vectorized pass per clearing.
+    The get_price/get_haircut/set_price API is the same as AssetMarket.
+    """
+    __slots__ = (
+        'asset_index', 'asset_types', '_prices', '_old_prices', '_quantities_sold',
+        '_cumulative_quantities_sold', '_total_quantities', '_haircuts',
+        '_initial_haircuts', '_has_haircut', '_price_impacts', '_price_epochs'
+    )
+
+    def __init__(self, model, asset_types=()):
+        super().__init__(model)
+        self.asset_index = {}
+        self.asset_types = []
+        self._prices = np.ones(0)
+        self._old_prices = np.ones(0)
+        self._quantities_sold = np.zeros(0)
+        self._cumulative_quantities_sold = np.zeros(0)
+        self._total_quantities = np.zeros(0)
+        self._haircuts = np.zeros(0)
+        self._initial_haircuts = np.zeros(0)
+        self._has_haircut = np.zeros(0, dtype=bool)
+        self._price_impacts = np.zeros(0)
+        self._price_epochs = np.zeros(0, dtype=np.int64)
+
+        self.prices = AssetTypeArrayView(self, '_prices')
+        self.oldPrices = AssetTypeArrayView(self, '_old_prices')
+        self.quantities_sold = AssetTypeArrayView(self, '_quantities_sold')
+        self.cumulative_quantities_sold = AssetTypeArrayView(self, '_cumulative_quantities_sold')
+        self.total_quantities = AssetTypeArrayView(self, '_total_quantities')
+        self.haircuts = HaircutArrayView(self, '_haircuts')
+        self.price_epochs = AssetTypeArrayView(self, '_price_epochs')
+
+        self.register_asset_types(self.model.parameters.INITIAL_HAIRCUTS.keys())
+        self.register_asset_types(asset_types)
+
+    def _grow(self, size):
+        capacity = len(self._prices)
+        if size <= capacity:
+            return
+        capacity = max(size, 2 * capacity, 16)
+
+        def _resize(arr, fill):
+            out = np.full(capacity, fill, dtype=arr.dtype)
+            out[:len(arr)] = arr
+            return out
+        self._prices = _resize(self._prices, 1.0)
+        self._old_prices = _resize(self._old_prices, 1.0)
+        self._quantities_sold = _resize(self._quantities_sold, 0.0)
+        self._cumulative_quantities_sold = _resize(self._cumulative_quantities_sold, 0.0)
+        self._total_quantities = _resize(self._total_quantities, 0.0)
+        self._haircuts = _resize(self._haircuts, 0.0)
+        self._initial_haircuts = _resize(self._initial_haircuts, 0.0)
+        self._has_haircut = _resize(self._has_haircut, False)
+        self._price_impacts = _resize(self._price_impacts, np.nan)
+        self._price_epochs = _resize(self._price_epochs, 0)
+
+    def register_asset_types(self, asset_types):
+        """
+        Assign an array position to each asset type that is not yet
+        registered. Unregistered asset types are also registered lazily on
+        first access.
+        """
+        new = [a for a in dict.fromkeys(asset_types) if a not in self.asset_index]
+        if not new:
+            return
+        start = len(self.asset_types)
+        self._grow(start + len(new))
+        initial_haircuts = self.model.parameters.INITIAL_HAIRCUTS
+        for i, atype in enumerate(new, start):
+            self.asset_index[atype] = i
+            self.asset_types.append(atype)
+            if atype in initial_haircuts:
+                self._haircuts[i] = self._initial_haircuts[i] = initial_haircuts[atype]
+                self._has_haircut[i] = True
+
+    def get_index(self, assetType):
+        try:
+            return self.asset_index[assetType]
+        except KeyError:
+            self.register_asset_types((assetType,))
+            return self.asset_index[assetType]
+
+    def clear_the_market(self):
+        logging.debug("\nMARKET CLEARING\n")
+        params = self.model.parameters
+        n = len(self.asset_types)
+        self._old_prices[:n] = self._prices[:n]
+        traded = np.flatnonzero(self._quantities_sold[:n])
+        devalue = getattr(self.model, 'devalueCommonAsset', self.devalue_common_asset)
+        # In lazy mode, the holders reconcile their valuation themselves
+        lazy = params.LAZY_ASSET_VALUATION
+        if len(traded) > 0:
+            # 1. Update price based on price impact, for all the traded asset
+            # types at once
+            if params.PREDEFAULT_FIRESALE_CONTAGION or params.POSTDEFAULT_FIRESALE_CONTAGION:
+                self._apply_price_impact(traded)
+                price_lost = self._old_prices[traded] - self._prices[traded]
+                if lazy:
+                    price_lost[:] = 0
+                for i, lost in zip(traded[price_lost > 0].tolist(), price_lost[price_lost > 0].tolist()):
+                    devalue(self.asset_types[i], lost)
+
+            if params.HAIRCUT_CONTAGION:
+                self._apply_haircut(traded)
+
+            self._cumulative_quantities_sold[traded] += self._quantities_sold[traded]
+            self._quantities_sold[traded] = 0.0
+
+        # 2. Perform the sale
+        self.settle_orders()
+
+    def _get_price_impacts(self, idx):
+        # The price impacts are looked up on first use, as AssetMarket does,
+        # since PRICE_IMPACTS may not have a key for every registered type
+        if self.priceImpacts is not None:
+            for i in idx[np.isnan(self._price_impacts[idx])].tolist():
+                self._price_impacts[i] = self.priceImpacts[self.asset_types[i]]
+        return self._price_impacts[idx]
+
+    def _apply_price_impact(self, idx):
+        total = self._total_quantities[idx]
+        idx = idx[total > 0]
+        fraction_sold = self._quantities_sold[idx] / self._total_quantities[idx]
+        # Same as linear_price_impact, which is C-only when compiled
+        # new_price = current_price * exponential_price_impact(fraction_sold, price_impact)
+        self._prices[idx] = np.maximum(0, self._prices[idx] - fraction_sold * self._get_price_impacts(idx))
+        self._price_epochs[idx] += 1
+        self.epoch += 1
+
+    def _apply_haircut(self, idx):
+        """
+        Vectorized version of AssetMarket.compute_haircut
+        """
+        idx = idx[self._has_haircut[idx]]
+        p0 = 1.0
+        alpha = self.model.parameters.HAIRCUT_SLOPE
+        newHaircut = self._initial_haircuts[idx] + np.maximum(0, alpha * (1 - self._prices[idx] / p0))
+        # Truncate to 1.0 when the value > 1
+        newHaircut = np.minimum(newHaircut, 1.0)
+        oldHaircut = self._haircuts[idx]
+        self._haircuts[idx] = newHaircut
+        changed = newHaircut != oldHaircut
+        for i, old, new in zip(idx[changed].tolist(), oldHaircut[changed].tolist(), newHaircut[changed].tolist()):
+            self.notify_haircut(self.asset_types[i], old, new)
+
+    def compute_price_impact(self, assetType, qty_sold):
+        i = self.get_index(assetType)
+        total = self._total_quantities[i]
+        if total <= 0:
+            return
+        new_price = max(0, self._prices[i] - (qty_sold / total) * self._get_price_impacts(np.array([i])).item())
+        self.set_price(assetType, new_price)
+
+    def compute_haircut(self, assetType, qty_sold):
+        if assetType in self.asset_index:
+            self._apply_haircut(np.array([self.asset_index[assetType]]))
+
+    def get_price(self, assetType):
+        return float(self._prices[self.get_index(assetType)])
+
+    def get_haircut(self, assetType):
+        i = self.asset_index.get(assetType)
+        if i is None or not self._has_haircut[i]:
+            return 0.0
+        return float(self._haircuts[i])
+
+    def set_price(self, assetType, newPrice):
+        i = self.get_index(assetType)
+        self._prices[i] = newPrice
+        self._price_epochs[i] += 1
+        self.epoch += 1
+
+    def get_price_epoch(self, assetType):
+        return int(self._price_epochs[self.get_index(assetType)])
+
+    def get_asset_types(self):
+        return list(self.asset_types)
+
+    def get_cumulative_quantities_sold(self, assetType):
+        return float(self._cumulative_quantities_sold[self.get_index(assetType)])
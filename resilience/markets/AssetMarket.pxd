@@ -3,33 +3,45 @@ from .Market cimport Market
 
 cdef double linear_price_impact(double fraction, double param)
 
-# This is an internal C-only class
 @cython.final
-cdef class Order:
-    cdef object asset
-    cdef double quantity
-    cdef void settle(self)
+cdef class OrderBook:
+    cdef public dict orders
+    cpdef void add(self, object asset, double quantity)
+    @cython.locals(old_price=double, quantity=double, quantity_sold=double, value_sold=double)
+    cpdef void settle(self, object market)
 
 
-@cython.final
+# Not final, so that ArrayAssetMarket can subclass it
 cdef class AssetMarket(Market):
-    cdef object prices
-    cdef object quantities_sold
-    cdef object cumulative_quantities_sold
-    cdef object orderbook
+    cdef public object prices
+    cdef public object quantities_sold
+    cdef public object cumulative_quantities_sold
+    cdef public object orderbook
     cdef public object oldPrices
     cdef public object total_quantities
-    cdef object priceImpacts
-    cdef object haircuts
+    cdef public object priceImpacts
+    cdef public object haircuts
+    cdef public object holders
+    cdef public object price_epochs
+    cdef public long epoch
     cpdef void put_for_sale(self, object asset, double quantity)
-    @cython.locals(order=Order)
+    cpdef void put_for_sale_bulk(self, object assets, object quantities)
     cpdef void clear_the_market(self)
+    cpdef void settle_orders(self)
+    cpdef void register_holding(self, object asset)
+    cpdef void deregister_holding(self, object asset)
+    cpdef object get_holdings(self, int assetType)
+    cpdef void devalue_common_asset(self, int assetType, double priceLost)
     @cython.locals(current_price=double, price_impact=double, total=double, fraction_sold=double, new_price=double)
     cpdef void compute_price_impact(self, int assetType, double qty_sold)
     @cython.locals(h0=double, p0=double, alpha=double, newHaircut=double)
     cpdef void compute_haircut(self, int assetType, double qty_sold)
     cpdef double get_price(self, int assetType)
     cpdef double get_haircut(self, int assetType)
+    @cython.locals(oldHaircut=double)
+    cpdef void set_haircut(self, int assetType, double newHaircut)
+    cpdef void notify_haircut(self, int assetType, double oldHaircut, double newHaircut)
     cpdef void set_price(self, int assetType, double newPrice)
+    cpdef long get_price_epoch(self, int assetType)
     cpdef object get_asset_types(self)
     cpdef double get_cumulative_quantities_sold(self, int assetType)
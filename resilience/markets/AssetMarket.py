@@ -24,14 +24,36 @@ def exponential_price_impact(fraction_sold, param):
 
 
 # todo: should not be public
-class Order(object):
-    __slots__ = 'asset', 'quantity'
+class OrderBook(object):
+    """
+    The sell orders of one market clearing, grouped by asset type and then by
+    the asset (i.e. the seller's contract). Repeat orders on the same asset
+    are netted into one, so that the cost of settlement grows with the number
+    of distinct (seller, asset) pairs rather than with the number of orders.
+    """
+    __slots__ = 'orders',
+
+    def __init__(self):
+        # asset type -> {asset: quantity}
+        self.orders = {}
+
+    def __len__(self):
+        return sum(len(group) for group in self.orders.values())
+
+    def __bool__(self):
+        return len(self.orders) > 0
+
+    def __iter__(self):
+        return ((asset, quantity) for group in self.orders.values() for asset, quantity in group.items())
 
-    def __init__(self, asset, quantity):
-        self.asset = asset
-        self.quantity = quantity
+    def add(self, asset, quantity):
+        atype = asset.get_asset_type()
+        group = self.orders.get(atype)
+        if group is None:
+            group = self.orders[atype] = {}
+        group[asset] = group.get(asset, 0.0) + quantity
 
-    def settle(self):
+    def settle(self, market):
         # clear sale
         # We had an quantity Q of asset valued at price P. The we sold a quantity q that made the price fall to p. The
         # sale happened at the mid-point price (P+p)/2.
@@ -39,18 +61,26 @@ class Order(object):
         # 1) We gain a 'pq' of cash.
         # 2) We make a loss q(P-p)/2 from the sale, and a loss (Q-q)*(P-p) due to the devaluation.
         # @param quantity_sold the quantity of asset sold, in units
-        quantity_sold = min(self.asset.quantity, self.quantity)
-        assert quantity_sold > 0
-        old_price = self.asset.assetMarket.oldPrices[self.asset.assetType]
-        # Sell the asset at the mid-point price
-        self.asset.quantity -= quantity_sold
-        self.asset.putForSale_ -= quantity_sold
-        value_sold = quantity_sold * (self.asset.price + old_price) / 2
-        if value_sold >= eps:
-            self.asset.assetParty.add_cash(value_sold)
+        oldPrices = market.oldPrices
+        lazy = market.model.parameters.LAZY_ASSET_VALUATION
+        for atype, group in self.orders.items():
+            old_price = oldPrices[atype]
+            for asset, quantity in group.items():
+                if lazy:
+                    asset.reconcile_price()
+                quantity_sold = min(asset.quantity, quantity)
+                assert quantity_sold > 0
+                # Sell the asset at the mid-point price
+                asset.settle_sale(quantity_sold)
+                value_sold = quantity_sold * (asset.price + old_price) / 2
+                if value_sold >= eps:
+                    asset.assetParty.add_cash(value_sold)
+                if asset.quantity <= 0:
+                    market.deregister_holding(asset)
+        self.orders = {}
 
 class AssetMarket(Market):
-    __slots__ = 'prices', 'priceImpacts', 'quantities_sold', 'haircuts', 'cumulative_quantities_sold', 'orderbook', 'oldPrices', 'total_quantities'
+    __slots__ = 'prices', 'priceImpacts', 'quantities_sold', 'haircuts', 'cumulative_quantities_sold', 'orderbook', 'oldPrices', 'total_quantities', 'holders', 'price_epochs', 'epoch'
 
     def __init__(self, model):
         super().__init__(model)
@@ -60,9 +90,16 @@ class AssetMarket(Market):
         # The cumulative total quantities sold from the earliest market clearing to
         # the most recent one
         self.cumulative_quantities_sold = defaultdict(float)
-        self.orderbook = []
+        self.orderbook = OrderBook()
         self.oldPrices = {}
         self.total_quantities = defaultdict(float)
+        # Reverse index from asset type to the AssetCollateral contracts that
+        # hold it, i.e. asset type -> {asset: None}
+        self.holders = {}
+        # Bumped on every price change, per asset type and overall. Used by
+        # the lazy valuation mode (LAZY_ASSET_VALUATION).
+        self.price_epochs = defaultdict(int)
+        self.epoch = 0
 
         self.priceImpacts = self.model.parameters.PRICE_IMPACTS
         # copy the value instead of accessing it directly
@@ -70,16 +107,35 @@ class AssetMarket(Market):
 
     def put_for_sale(self, asset, quantity):
         assert quantity > 0, quantity
-        self.orderbook.append(Order(asset, quantity))
+        self.orderbook.add(asset, quantity)
         atype = asset.get_asset_type()
 
         logging.debug(f"Putting for sale: {atype} at quantity {quantity}")
 
         self.quantities_sold[atype] += quantity
 
+    def put_for_sale_bulk(self, assets, quantities):
+        """
+        put_for_sale for many assets at once, e.g. all the SellAsset
+        actions of perform_proportionally_batched
+        """
+        sold = defaultdict(float)
+        for asset, quantity in zip(assets, quantities):
+            assert quantity > 0, quantity
+            self.orderbook.add(asset, quantity)
+            sold[asset.get_asset_type()] += quantity
+
+        logging.debug(f"Putting for sale: {dict(sold)}")
+
+        for atype, quantity in sold.items():
+            self.quantities_sold[atype] += quantity
+
     def clear_the_market(self):
         logging.debug("\nMARKET CLEARING\n")
         self.oldPrices = dict(self.prices)
+        devalue = getattr(self.model, 'devalueCommonAsset', self.devalue_common_asset)
+        # In lazy mode, the holders reconcile their valuation themselves
+        lazy = self.model.parameters.LAZY_ASSET_VALUATION
         # 1. Update price based on price impact
         for atype, v in self.quantities_sold.items():
             if self.model.parameters.PREDEFAULT_FIRESALE_CONTAGION or self.model.parameters.POSTDEFAULT_FIRESALE_CONTAGION:
@@ -87,8 +143,8 @@ class AssetMarket(Market):
 
                 newPrice = self.prices[atype]
                 priceLost = self.oldPrices[atype] - newPrice
-                if priceLost > 0:
-                    self.model.devalueCommonAsset(atype, priceLost)
+                if priceLost > 0 and not lazy:
+                    devalue(atype, priceLost)
 
             if self.model.parameters.HAIRCUT_CONTAGION:
                 self.compute_haircut(atype, v)
@@ -98,9 +154,42 @@ class AssetMarket(Market):
         self.quantities_sold = defaultdict(float)
 
         # 2. Perform the sale
-        for order in self.orderbook:
-            order.settle()
-        self.orderbook = []
+        self.settle_orders()
+
+    def settle_orders(self):
+        self.orderbook.settle(self)
+
+    def register_holding(self, asset):
+        holders = self.holders.get(asset.assetType)
+        if holders is None:
+            holders = self.holders[asset.assetType] = {}
+        holders[asset] = None
+
+    def deregister_holding(self, asset):
+        holders = self.holders.get(asset.assetType)
+        if holders is not None:
+            holders.pop(asset, None)
+        # The owner drops the emptied position from its tradable index too
+        party = asset.assetParty
+        if hasattr(party, 'deindex_tradable'):
+            party.deindex_tradable(asset)
+
+    def get_holdings(self, assetType):
+        """
+        Returns the AssetCollateral contracts that currently hold assetType
+        """
+        return self.holders.get(assetType, {}).keys()
+
+    def devalue_common_asset(self, assetType, priceLost):
+        """
+        Devalue assetType for all of its holders. Only the actual positions
+        are visited, so the cost scales with the holdings, not with the number
+        of institutions.
+        """
+        for asset in self.get_holdings(assetType):
+            asset.assetParty.get_ledger().devalue_asset(asset, asset.quantity * priceLost)
+            # Update the price
+            asset.update_price()
 
     def compute_price_impact(self, assetType, qty_sold):
         current_price = self.prices[assetType]
@@ -132,7 +221,7 @@ class AssetMarket(Market):
         # Truncate to 1.0 when the value > 1
         newHaircut = min(newHaircut, 1.0)
 
-        self.haircuts[assetType] = newHaircut
+        self.set_haircut(assetType, newHaircut)
 
     def get_price(self, assetType):
         return self.prices[assetType]
@@ -140,8 +229,29 @@ class AssetMarket(Market):
     def get_haircut(self, assetType):
         return self.haircuts.get(assetType, 0.0)
 
+    def set_haircut(self, assetType, newHaircut):
+        oldHaircut = self.get_haircut(assetType)
+        self.haircuts[assetType] = newHaircut
+        if newHaircut != oldHaircut:
+            self.notify_haircut(assetType, oldHaircut, newHaircut)
+
+    def notify_haircut(self, assetType, oldHaircut, newHaircut):
+        """
+        Tell the owners of the holdings of assetType that keep a
+        haircut-weighted valuation (e.g. Hedgefund) about a haircut change
+        """
+        parties = {asset.assetParty: None for asset in self.get_holdings(assetType)}
+        for party in parties:
+            if hasattr(party, 'update_haircut'):
+                party.update_haircut(assetType, oldHaircut, newHaircut)
+
     def set_price(self, assetType, newPrice):
         self.prices[assetType] = newPrice
+        self.price_epochs[assetType] += 1
+        self.epoch += 1
+
+    def get_price_epoch(self, assetType):
+        return self.price_epochs[assetType]
 
     def get_asset_types(self):
         """
@@ -1 +1,2 @@
 from .AssetMarket import AssetMarket
+from .ArrayAssetMarket import ArrayAssetMarket
@@ -100,5 +100,38 @@ class Parameters:
     # CACHING
     DONOT_CACHE_NETWORK = False
     NETWORK_USE_POISSON = False
+    # When True, a price move only bumps the market's price epoch of the
+    # asset type, and each institution brings its positions up to date the
+    # first time it reads its balance sheet afterwards.
+    LAZY_ASSET_VALUATION = False
+    # When True, act() is skipped for an agent that was at rest (not below
+    # any of its buffers) after its previous act(), and whose inputs have
+    # not changed since. CHECK_SKIPPED_AGENTS runs act() anyway and asserts
+    # that it did nothing.
+    SKIP_UNAFFECTED_AGENTS = False
+    CHECK_SKIPPED_AGENTS = False
+    # When True, institutions keep running totals of the valuation of their
+    # contracts, by side and contract type, instead of scanning the ledger.
+    # CHECK_BALANCE_SHEET_TOTALS asserts them against the ledger on read.
+    TRACK_BALANCE_SHEET_TOTALS = False
+    CHECK_BALANCE_SHEET_TOTALS = False
+    # When True, the eligible actions of institutions are maintained
+    # incrementally instead of being rebuilt from the ledger on every act().
+    INDEX_AVAILABLE_ACTIONS = False
+    # When True, institutions keep their expected cash commitments and
+    # inflows in ring buffers by due timestep instead of scanning their
+    # mailbox in the liquidity management.
+    CASH_FLOW_BUFFER = False
+    # When True, the matured PullFundingObgn of an institution are settled
+    # once per loan, for their total amount, instead of one by one.
+    NET_OBLIGATIONS = False
+    # When True, asset managers keep their shares in a ShareRegistry, and
+    # revalue and redeem the shares of all their holders at once.
+    SHARE_REGISTRY = False
+    # When True, the proportional actions of an institution (e.g. its
+    # firesales) are computed at once and their sell orders are put in bulk
+    # when there are many of them, so that the market only sees the orders
+    # after the whole batch.
+    BATCH_PERFORM_PROPORTIONALLY = False
 
     DO_SANITY_CHECK = True
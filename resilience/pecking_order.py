@@ -0,0 +1,38 @@
+import numpy as np
+
+from .parameters import eps, isequal_float
+
+
+def plan_pecking_order_on_RWA(rwa, target_rwa, weights, capacities):
+    """
+    The amounts to be raised from each group of actions of the pecking
+    order of LeveragedInst.raise_liquidity_with_pecking_order_on_RWA, so
+    that the RWA goes down to `target_rwa` (i.e. CET1E / RWCR_target),
+    without performing anything. `weights` and `capacities` have the shape
+    (..., k): the RWA weight and the total get_max() of the actions of each
+    of the k groups, in the pecking order, and `rwa` and `target_rwa` the
+    shape (...). Returns the amounts, of shape (..., k), and whether the
+    target is reached.
+    """
+    weights, capacities = np.broadcast_arrays(
+        np.asarray(weights, dtype=float), np.asarray(capacities, dtype=float))
+    rwa = np.asarray(rwa, dtype=float)
+    amounts = np.zeros(np.broadcast_shapes(weights.shape, rwa.shape + (1,)))
+    pending = np.ones(amounts.shape[:-1], dtype=bool)
+    for g in range(amounts.shape[-1]):
+        weight = weights[..., g]
+        todo = pending & (weight != 0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            x = np.where(todo, (rwa - target_rwa) / np.where(todo, weight, 1.0), 0.0)
+        # maybe rwa is already (negligibly) below the target
+        assert not (todo & (x <= -5 * eps)).any(), x
+        # Already at the target
+        pending &= ~(todo & (x <= 0))
+        todo &= x > 0
+        # perform_proportionally
+        capacity = capacities[..., g]
+        amount = np.where(todo & (capacity > 0), np.minimum(capacity, x), 0.0)
+        amounts[..., g] = amount
+        rwa = rwa - amount * weight
+        pending &= ~(todo & isequal_float(amount, x))
+    return amounts, ~pending
@@ -0,0 +1,66 @@
+import math
+import multiprocessing
+import os
+
+# The read-only data shared by the scenarios of a run_parallel call, set in
+# each worker by _init_worker. With the fork start method, the initargs are
+# inherited from the parent process without being pickled; otherwise they
+# are sent once per worker.
+_calibration = None
+_run_scenario = None
+
+
+def _init_worker(run_scenario, calibration):
+    global _run_scenario, _calibration
+    _run_scenario = run_scenario
+    _calibration = calibration
+
+
+def _run_chunk(chunk):
+    return [(i, _run_scenario(_calibration, scenario)) for i, scenario in chunk]
+
+
+def run_parallel(run_scenario, scenarios, calibration=None, processes=None, chunksize=None):
+    """
+    Run `run_scenario(calibration, scenario)` for each of the scenarios in a
+    pool of processes, e.g. a function that builds a Model from the parsed
+    balance sheets (the calibration) and returns the output of
+    run_simulation for one initial shock (the scenario).
+
+    The calibration is loaded once by the caller and shared with the
+    workers: with the fork start method the workers inherit it, otherwise
+    it is pickled once per worker instead of once per scenario. Scenarios
+    are dispatched in chunks, and the (index, result) pairs are yielded as
+    soon as their chunk is done, so not in the order of the scenarios.
+    """
+    scenarios = list(scenarios)
+    if processes is None:
+        processes = os.cpu_count() or 1
+    if chunksize is None:
+        # A few chunks per process, to balance the load
+        chunksize = max(1, math.ceil(len(scenarios) / (4 * processes)))
+    indexed = list(enumerate(scenarios))
+    chunks = [indexed[i:i + chunksize] for i in range(0, len(indexed), chunksize)]
+
+    start_method = 'fork' if 'fork' in multiprocessing.get_all_start_methods() else 'spawn'
+    ctx = multiprocessing.get_context(start_method)
+    with ctx.Pool(processes, initializer=_init_worker, initargs=(run_scenario, calibration)) as pool:
+        for results in pool.imap_unordered(_run_chunk, chunks):
+            yield from results
+
+def is_quiescent(agents, assetMarket, new_defaults):
+    """
+    Whether the system has stopped moving at the end of a timestep: the
+    order book is empty, there are no unfulfilled obligations, nobody
+    defaulted during the timestep and no agent is below its buffers. The
+    following timesteps would then leave the state unchanged, so a
+    simulation may stop early and pad its output series.
+    """
+    if new_defaults > 0 or assetMarket.orderbook:
+        return False
+    for agent in agents:
+        if not agent.is_alive():
+            continue
+        if agent.has_unfulfilled_obligations() or agent.is_below_buffer():
+            return False
+    return True
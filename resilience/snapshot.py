@@ -0,0 +1,170 @@
+from collections import defaultdict, deque
+
+import numpy as np
+
+# The objects whose class is defined in one of these packages (or in the
+# module of the snapshot root) are part of the model state. Everything else
+# that they refer to (numbers, strings, functions, classes, Parameters) is
+# immutable or shared, and is not copied.
+OWNED_PACKAGES = ('resilience', 'economicsl')
+
+_slot_names_cache = {}
+
+
+def _get_slot_names(cls):
+    try:
+        return _slot_names_cache[cls]
+    except KeyError:
+        pass
+    names = []
+    for klass in cls.__mro__:
+        slots = klass.__dict__.get('__slots__', ())
+        if isinstance(slots, str):
+            slots = (slots,)
+        names.extend(s for s in slots if s not in ('__dict__', '__weakref__') and s not in names)
+    # A slot shadowed by a property of a subclass (e.g. the contract views of
+    # a ContractStore) holds no state
+    names = [s for s in names if not isinstance(getattr(cls, s, None), property)]
+    _slot_names_cache[cls] = names
+    return names
+
+
+class Snapshot(object):
+    """
+    A snapshot of the state of a model (e.g. right after Model.initialize()):
+    the agents with their ledgers, contracts, mailboxes and encumbrance, the
+    markets and the Simulation. The object graph is walked once, when the
+    snapshot is taken, so that:
+
+    - restore() resets the very same objects to the snapshot state, in
+      place, and
+    - fork() builds an independent copy of the model, without the
+      type dispatch and memo bookkeeping of copy.deepcopy.
+    """
+    __slots__ = 'root', 'objects', 'states', 'packages'
+
+    def __init__(self, root):
+        self.root = root
+        self.packages = OWNED_PACKAGES + (type(root).__module__.split('.')[0],)
+        self.objects = []
+        self.states = []
+        seen = set()
+        stack = [root]
+        while stack:
+            obj = stack.pop()
+            if id(obj) in seen:
+                continue
+            if type(obj) is tuple:
+                seen.add(id(obj))
+                stack.extend(obj)
+                continue
+            if not self._is_owned(obj):
+                continue
+            seen.add(id(obj))
+            kind, data = state = self._capture(obj)
+            self.objects.append(obj)
+            self.states.append(state)
+            if kind == 'dict':
+                for k, v in data:
+                    stack.append(k)
+                    stack.append(v)
+            elif kind == 'object':
+                stack.extend(v for _, v in data[0])
+            elif kind != 'array':
+                stack.extend(data)
+
+    def _is_owned(self, obj):
+        cls = type(obj)
+        if cls in (list, dict, set, defaultdict, deque) or isinstance(obj, np.ndarray):
+            return True
+        return cls.__module__.split('.')[0] in self.packages and not isinstance(obj, type)
+
+    @staticmethod
+    def _capture(obj):
+        if isinstance(obj, (list, deque)):
+            return 'list', list(obj)
+        if isinstance(obj, set):
+            return 'set', list(obj)
+        if isinstance(obj, dict):
+            return 'dict', list(obj.items())
+        if isinstance(obj, np.ndarray):
+            return 'array', obj.copy()
+        attrs = []
+        # The slots that are not set, to be unset again by restore()
+        unset = []
+        has_dict = hasattr(obj, '__dict__')
+        if has_dict:
+            attrs.extend(vars(obj).items())
+        for name in _get_slot_names(type(obj)):
+            try:
+                attrs.append((name, getattr(obj, name)))
+            except AttributeError:
+                unset.append(name)
+        return 'object', (attrs, has_dict, unset)
+
+    def restore(self):
+        """
+        Reset the model to the snapshot state, in place. Returns the root.
+        """
+        for obj, (kind, data) in zip(self.objects, self.states):
+            if kind == 'object':
+                attrs, has_dict, unset = data
+                if has_dict:
+                    vars(obj).clear()
+                for name, value in attrs:
+                    setattr(obj, name, value)
+                for name in unset:
+                    try:
+                        delattr(obj, name)
+                    except AttributeError:
+                        pass
+            elif kind == 'dict':
+                obj.clear()
+                obj.update(data)
+            elif kind == 'list':
+                obj.clear()
+                obj.extend(data)
+            elif kind == 'set':
+                obj.clear()
+                obj.update(data)
+            else:
+                obj[...] = data
+        return self.root
+
+    def fork(self):
+        """
+        Returns an independent copy of the model in the snapshot state. The
+        keys of the dicts are mapped to their copies too, hence the model
+        state must key its dicts by the objects themselves, not by id().
+        """
+        clones = {}
+        for obj, (kind, data) in zip(self.objects, self.states):
+            if kind == 'object':
+                clone = type(obj).__new__(type(obj))
+            elif kind == 'array':
+                clone = data.copy()
+            elif isinstance(obj, defaultdict):
+                clone = defaultdict(obj.default_factory)
+            elif isinstance(obj, deque):
+                clone = deque(maxlen=obj.maxlen)
+            else:
+                clone = type(obj)()
+            clones[id(obj)] = clone
+
+        def remap(value):
+            if type(value) is tuple:
+                return tuple(remap(v) for v in value)
+            return clones.get(id(value), value)
+
+        for obj, (kind, data) in zip(self.objects, self.states):
+            clone = clones[id(obj)]
+            if kind == 'object':
+                for name, value in data[0]:
+                    setattr(clone, name, remap(value))
+            elif kind == 'dict':
+                clone.update((remap(k), remap(v)) for k, v in data)
+            elif kind == 'list':
+                clone.extend(remap(v) for v in data)
+            elif kind == 'set':
+                clone.update(remap(v) for v in data)
+        return clones[id(self.root)]
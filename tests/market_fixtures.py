@@ -0,0 +1,182 @@
+from collections import defaultdict
+
+from resilience.parameters import Parameters
+
+# The test doubles shared by the tests: the markets' parties and holdings,
+# and the obligations, collateral and repo borrowers of the agents
+
+
+class MarketParameters(Parameters):
+    PRICE_IMPACTS = defaultdict(lambda: 0.05, {2: 0.1})
+    INITIAL_HAIRCUTS = {1: 0.02, 2: 0.04}
+    HAIRCUT_CONTAGION = True
+    PREDEFAULT_FIRESALE_CONTAGION = True
+
+
+class Holder:
+    def __init__(self):
+        self.cash = 0.0
+        self.devalued = 0.0
+        self.deindexed = []
+        self.haircuts = []
+
+    def add_cash(self, amount):
+        self.cash += amount
+
+    def get_ledger(self):
+        return self
+
+    def devalue_asset(self, asset, valueLost):
+        self.devalued += valueLost
+
+    def deindex_tradable(self, asset):
+        self.deindexed.append(asset)
+
+    def update_haircut(self, assetType, oldHaircut, newHaircut):
+        self.haircuts.append((assetType, oldHaircut, newHaircut))
+
+
+class Position:
+    def __init__(self, market, assetType, quantity):
+        self.assetMarket = market
+        self.assetType = assetType
+        self.assetParty = Holder()
+        self.quantity = quantity
+        self.putForSale_ = 0.0
+        self.price = market.get_price(assetType)
+
+    def get_asset_type(self):
+        return self.assetType
+
+    def update_price(self):
+        self.price = self.assetMarket.get_price(self.assetType)
+
+    def settle_sale(self, quantity):
+        self.quantity -= quantity
+        self.putForSale_ -= quantity
+
+    def reconcile_price(self):
+        self.reconciled = True
+
+
+class PlainModel:
+    def __init__(self, market_class):
+        self.parameters = MarketParameters
+        self.assetMarket = market_class(self)
+
+
+class MarketModel(PlainModel):
+    def __init__(self, market_class):
+        super().__init__(market_class)
+        self.devalued = []
+
+    def devalueCommonAsset(self, assetType, priceLost):
+        self.devalued.append((assetType, priceLost))
+        for p in self.positions:
+            if p.assetType == assetType:
+                p.price = self.assetMarket.get_price(assetType)
+
+
+class Obligation:
+    def __init__(self, amount=0.0, due=0, fulfilled=False):
+        self.amount = amount
+        self.due = due
+        self.fulfilled = fulfilled
+
+    def get_amount(self):
+        return self.amount
+
+    def is_fulfilled(self):
+        return self.fulfilled
+
+
+class Collateral:
+    def __init__(self, quantity, price, haircut):
+        self.assetParty = self.liabilityParty = None
+        self.quantity = quantity
+        self.encumberedQuantity = 0.0
+        self.price = price
+        self.haircut = haircut
+
+    def get_price(self):
+        return self.price
+
+    def get_haircut(self):
+        return self.haircut
+
+    def get_unencumbered_quantity(self):
+        return self.quantity - self.encumberedQuantity
+
+    def get_haircutted_ue_valuation(self):
+        return (self.quantity - self.encumberedQuantity) * self.price * (1 - self.haircut)
+
+    def encumber(self, quantity):
+        self.encumberedQuantity += quantity
+
+    def unEncumber(self, quantity):
+        self.encumberedQuantity -= quantity
+
+
+class ContractModel:
+    # What the contracts read from the model of their parties
+    parameters = Parameters
+
+
+class Borrower:
+    """
+    A repo borrower with a flat balance sheet, for MarginCallEngine and
+    RepoNetworkBuilder. `repos` holds (principal, prev_margin_call,
+    collateral) and `tradables` the collateral per tradable class, where
+    each collateral is (quantity, price, haircut).
+    """
+    isaBank = False
+    params = Parameters
+
+    def __init__(self, cash, repos=(), tradables=None):
+        # The contracts need economicsl, which the market tests do without
+        from resilience.contracts import Repo
+
+        self.model = ContractModel()
+        self.time = 0
+        self.cash = cash
+        self.encumberedCash = 0.0
+        self.tradables = {k: [Collateral(*c) for c in v] for k, v in (tradables or {}).items()}
+        self.repos = []
+        for principal, prev_margin_call, collateral in repos:
+            repo = Repo(None, self, principal)
+            repo.prev_margin_call = prev_margin_call
+            repo.collateral = {Collateral(*c): 0.0 for c in collateral}
+            self.repos.append(repo)
+
+    def get_cash(self):
+        return self.cash
+
+    def get_encumbered_cash(self):
+        return self.encumberedCash
+
+    def get_ue_cash(self):
+        return self.cash - self.encumberedCash
+
+    def encumber_cash(self, amount):
+        amount = min(amount, self.get_ue_cash())
+        self.encumberedCash += amount
+        return amount
+
+    def unencumber_cash(self, amount):
+        self.encumberedCash -= amount
+
+    def get_time(self):
+        return self.time
+
+    def get_ledger(self):
+        return self
+
+    def get_liabilities_of_type(self, ctype):
+        return self.repos
+
+    def get_tradable_of_type(self, name):
+        return self.tradables.get(name, [])
+
+    def add(self, contract):
+        if contract.liabilityParty is self:
+            self.repos.append(contract)
@@ -1,10 +1,20 @@
+import tracemalloc
+
 import pytest
 from economicsl import Simulation
 
-from resilience.agents import Bank
-from resilience.contracts import Deposit
+from resilience import behaviours
+from resilience.agents import AssetManager, Bank, DefaultException
+from resilience.agents.CashFlowBuffer import CashFlowBuffer
+from resilience.agents.Hedgefund import Hedgefund
+from resilience.engine import MarginCallEngine, RepoNetworkBuilder
+from resilience.contracts import AssetCollateral, ContractStore, Deposit, FailedMarginCallException, Loan, Other, Repo, Shares
+from resilience.contracts.ContractStore import StoredAssetCollateral, StoredLoan, StoredOther, StoredRepo
+from resilience.contracts.obligations import PullFundingObgn
+from resilience.contracts.valuation import notify_parties
 from resilience.markets import AssetMarket
 from resilience.parameters import Parameters, enum
+from market_fixtures import Borrower, Obligation
 
 Parameters.AssetType = enum(GOV_BONDS1=1, CORPORATE_BONDS1=2, EQUITIES1=3, OTHERTRADABLE1=4, EXTERNAL1=5, EXTERNAL2=6, EXTERNAL3=7)
 Parameters.PRICE_IMPACTS = None
@@ -35,6 +45,7 @@ class SimpleModel:
         self.simulation = Simulation()
         self.parameters = Parameters
         self.assetMarket = AssetMarket(self)
+        self.ndefaults = 0
 
 @pytest.fixture
 def bank():
@@ -113,3 +124,319 @@ class TestBank:
         # act
         bank.act()
         self.check_ratios(bank, rwa=0.09090909090909090909, lev=0.045454545454545454547, lcr=1.2)
+
+    def test_balance_sheet_totals(self, bank, monkeypatch):
+        set_constraints(0, 1, 0)
+        monkeypatch.setattr(Parameters, 'TRACK_BALANCE_SHEET_TOTALS', True)
+        monkeypatch.setattr(Parameters, 'CHECK_BALANCE_SHEET_TOTALS', True)
+        assert bank.get_leverage() == pytest.approx(0.07272727272727272727)
+        # every read is asserted against the ledger in the check mode
+        bank.get_ledger().get_liabilities_of_type(Deposit)[0].reduce_principal(0.2)
+        bank.act()
+        bank.get_RWA_ratio()
+
+    def test_rest_state_follows_haircuts(self, bank):
+        bank.rest_state = bank.get_rest_state()
+        assert bank.is_unaffected()
+        # a haircut change without a price move affects the agent
+        bank.model.assetMarket.haircuts[Parameters.AssetType.CORPORATE_BONDS1] = 0.1
+        assert not bank.is_unaffected()
+        bank.rest_state = None
+
+    def test_rest_state_follows_defaults(self, bank):
+        bank.rest_state = bank.get_rest_state()
+        # the default of another agent is counted on the model
+        other = Hedgefund('other hf', bank.model)
+        other.handle_default()
+        assert bank.model.ndefaults == 1
+        assert not bank.is_unaffected()
+        bank.rest_state = None
+
+    def test_memoized_ratios(self, bank):
+        # ratios are memoized during act()
+        bank.memo = {}
+        lev = bank.get_leverage()
+        assert bank.memo['leverage'][1] == lev
+        assert bank.get_leverage() == lev
+        # a change of the balance sheet invalidates them
+        bank.get_ledger().get_liabilities_of_type(Deposit)[0].reduce_principal(0.2)
+        assert bank.get_leverage() > lev
+        bank.memo = None
+
+    def test_action_index(self, bank, monkeypatch):
+        def get_names(actions):
+            return {k: [a.get_name() for a in v] for k, v in actions.items() if v}
+
+        monkeypatch.setattr(Parameters, 'INDEX_AVAILABLE_ACTIONS', True)
+        expected = get_names(bank.get_available_actions())
+        assert expected
+        monkeypatch.setattr(Parameters, 'INDEX_AVAILABLE_ACTIONS', False)
+        assert get_names(bank.get_available_actions()) == expected
+        # putting a whole asset for sale makes its SellAsset ineligible
+        asset = bank.get_tradable_of_type('govbonds')[0]
+        asset.put_for_sale(asset.quantity)
+        expected = get_names(bank.get_available_actions())
+        monkeypatch.setattr(Parameters, 'INDEX_AVAILABLE_ACTIONS', True)
+        assert get_names(bank.get_available_actions()) == expected
+
+    def test_tradable_index(self, bank):
+        govbonds = bank.get_tradable_of_type('govbonds')
+        assert len(govbonds) == 1
+        assert bank.get_tradable_class(Parameters.AssetType.GOV_BONDS1) == 'govbonds'
+        assert bank.get_tradable_class(Parameters.AssetType.EXTERNAL1) is None
+        # a new position, e.g. from a repo liquidation, is indexed too
+        bank.add(govbonds[0].change_ownership(bank, 1))
+        assert len(bank.get_tradable_of_type('govbonds')) == 2
+        # an emptied position is dropped
+        bank.add(govbonds[0].change_ownership(bank, govbonds[0].quantity))
+        assert govbonds[0] not in bank.get_tradable_of_type('govbonds')
+        assert len(bank.get_tradable_of_type('govbonds')) == 2
+
+    def test_contract_store(self, bank):
+        store = ContractStore(bank.model)
+        loan = store.new_loan(bank, None, 2.0)
+        bank.add(loan)
+        assert isinstance(loan, Loan)
+        loan.increase_funding_pulled(0.5)
+        assert loan.get_notional() - loan.get_funding_already_pulled() == 1.5
+        assert store.sum_by_party(store.get_column('principal'))[0] == 2.0
+
+    def test_contract_store_memory(self, bank):
+        if type(ContractStore(bank.model).new_loan(bank, None, 1.0)) is Loan:
+            pytest.skip("the store holds regular contracts with the Cython build")
+        # The views are contracts whose only own state is their table and row
+        for view, base in ((StoredLoan, Loan), (StoredRepo, Repo), (StoredOther, Other),
+                           (StoredAssetCollateral, AssetCollateral)):
+            assert issubclass(view, base)
+            assert view.__slots__ == ('_store', '_i')
+        n = 10000
+
+        def traced(make):
+            tracemalloc.start()
+            try:
+                contracts = make()
+                assert len(contracts) == n
+                return tracemalloc.get_traced_memory()[0] / n
+            finally:
+                tracemalloc.stop()
+
+        plain = traced(lambda: [Loan(bank, None, float(i)) for i in range(n)])
+        store = ContractStore(bank.model, capacity=n)
+        stored = traced(lambda: [store.new_loan(bank, None, float(i)) for i in range(n)])
+        # The state of the book, read by the bulk aggregations, is a fraction
+        # of the size of the contracts
+        columns = sum(column.nbytes for column in store.loans.columns.values()) / n
+        assert columns <= plain / 4
+        # while a view costs about as much as a regular contract
+        assert stored <= 1.5 * plain
+
+    def test_lazy_actions(self, bank):
+        deposit = bank.get_ledger().get_liabilities_of_type(Deposit)[0]
+        action = deposit.get_action(bank)
+        assert action is deposit.get_action(bank)
+        # only the side of the bank has an action
+        assert deposit._pullfunding is None
+
+    def test_cash_flow_buffer_pending_obligation(self, bank, monkeypatch):
+        model = bank.model
+        lender = Bank('test lender', model)
+        lender.init(assets=(1, [], [], [], [], 0), liabilities=(0, 0))
+        loan = Loan(lender, bank, 2.0)
+        lender.add(loan)
+        bank.add(loan)
+
+        def get_flows():
+            return lender.get_cash_inflows(), bank.get_cash_commitments()
+
+        monkeypatch.setattr(Parameters, 'CASH_FLOW_BUFFER', True)
+        lender.send_obligation(bank, PullFundingObgn(loan, 1.0, bank.get_time() + 1))
+        # the buffers of the lender are built while the obligation is still
+        # pending
+        before = get_flows()
+        model.simulation.process_postbox()
+        lender.step()
+        bank.step()
+        after = get_flows()
+        monkeypatch.setattr(Parameters, 'CASH_FLOW_BUFFER', False)
+        assert sum(before[0]) == 1.0
+        assert sum(after[0]) == 1.0
+        assert sum(after[1]) == 1.0
+        # same as scanning the mailboxes
+        assert after == get_flows()
+
+    def test_netting(self, bank, monkeypatch):
+        deposit = bank.get_ledger().get_liabilities_of_type(Deposit)[0]
+        principal = deposit.get_notional()
+        cash = bank.get_cash()
+        deposit.increase_funding_pulled(1.0)
+        obligations = [PullFundingObgn(deposit, amount, 0) for amount in (0.4, 0.6)]
+        monkeypatch.setattr(Parameters, 'NET_OBLIGATIONS', True)
+        # the deposit is settled once, for the total amount
+        bank._fulfil_with_netting(lambda: [o.fulfil() for o in obligations])
+        assert all(o.is_fulfilled() for o in obligations)
+        assert bank.netting is None
+        assert deposit.get_notional() == pytest.approx(principal - 1.0)
+        assert deposit.get_funding_already_pulled() == pytest.approx(0.0)
+        assert bank.get_cash() == pytest.approx(cash - 1.0)
+
+
+def test_hf_haircutted_collateral_valuation(monkeypatch):
+    model = SimpleModel()
+    hf = Hedgefund('test hf', model)
+    _tradable_array = [2]
+    hf.init(
+        assets=(1, _tradable_array, _tradable_array, _tradable_array, _tradable_array, 0),
+        liabilities=(0, 0)
+    )
+    model.assetMarket.haircuts[Parameters.AssetType.EQUITIES1] = 0.2
+    assert hf.get_haircutted_collateral_valuation() == pytest.approx(7.6)
+    monkeypatch.setattr(Parameters, 'TRACK_BALANCE_SHEET_TOTALS', True)
+    monkeypatch.setattr(Parameters, 'CHECK_BALANCE_SHEET_TOTALS', True)
+    assert hf.get_haircutted_collateral_valuation() == pytest.approx(7.6)
+    # the running sum follows the haircut changes of the market
+    model.assetMarket.set_haircut(Parameters.AssetType.EQUITIES1, 0.5)
+    assert hf.get_haircutted_collateral_valuation() == pytest.approx(7.0)
+    # and the valuation changes of the collateral
+    equities = hf.asset_collaterals[Parameters.AssetType.EQUITIES1][0]
+    equities.quantity = 1.0
+    notify_parties(equities, -1.0)
+    hf.get_ledger().devalue_asset(equities, 1.0)
+    assert hf.get_haircutted_collateral_valuation() == pytest.approx(6.5)
+
+
+def test_share_registry(monkeypatch):
+    model = SimpleModel()
+    monkeypatch.setattr(Parameters, 'SHARE_REGISTRY', True)
+    am = AssetManager('test am', model)
+    _tradable_array = [2]
+    am.init(
+        assets=(1, _tradable_array, _tradable_array, _tradable_array, _tradable_array, 0),
+        liabilities=(0, 0)
+    )
+    shares = [am.issue_shares(None, 10) for _ in range(3)]
+    assert isinstance(shares[0], Shares)
+    assert am.get_net_asset_valuation() == pytest.approx(0.3)
+    assert [s.get_valuation('L') for s in shares] == pytest.approx([3.0] * 3)
+
+    shares[0].add_shares_pending_to_redeem(2)
+    # Shares.redeem (e.g. by RedeemSharesObgn.fulfil) goes through the registry
+    shares[0].redeem(2, 0.6)
+    am.share_registry.redeem([0, 1, 0], 0.3)
+    am.nShares -= 3
+    am.update_valuation_of_all_shares()
+    assert am.get_cash() == pytest.approx(0.1)
+    assert am.share_registry.get_column('nShares').tolist() == [8, 9, 10]
+    assert shares[0].get_nShares_pending_to_redeem() == 0
+    assert [s.get_valuation('L') for s in shares] == pytest.approx([2.4, 2.7, 3.0])
+
+
+class ProportionalAction:
+    def __init__(self, maximum):
+        self.maximum = maximum
+        self.amount = 0.0
+
+    def get_max(self):
+        return self.maximum
+
+    def set_amount(self, amount):
+        self.amount = amount
+
+    def perform(self):
+        pass
+
+
+def test_perform_proportionally_batching_is_opt_in(monkeypatch):
+    assert not Parameters.BATCH_PERFORM_PROPORTIONALLY
+    batched = []
+    monkeypatch.setattr(behaviours, 'perform_proportionally_batched', lambda actions, amount: batched.append(amount))
+    actions = [ProportionalAction(1.0) for _ in range(behaviours.BATCH_MIN_ACTIONS)]
+    assert behaviours.perform_proportionally(actions, 4.0) == 4.0
+    assert [a.amount for a in actions] == pytest.approx([0.25] * len(actions))
+    assert not batched
+    behaviours.perform_proportionally(actions, 4.0, batched=True)
+    assert batched == [4.0]
+
+
+def test_cash_flow_buffer():
+    buf = CashFlowBuffer(3, 0)
+    a, b = Obligation(1.0, 2), Obligation(0.1, 3)
+    buf.add(a, 2)
+    buf.add(b, 3)
+    assert buf.get_flows(0) == [0.0, 1.0, 0.1]
+    buf.remove(a, 2)
+    assert buf.get_flows(0) == [0.0, 0.0, 0.1]
+    # the expired buckets are recycled
+    buf.rotate(1)
+    buf.add(Obligation(2.0, 4), 4)
+    assert buf.get_flows(1) == [0.0, 0.1, 2.0]
+    assert buf.get_flows(3) == [2.0, 0.0, 0.0]
+
+
+def test_margin_call_engine(monkeypatch):
+    def make_borrowers():
+        return [
+            # enough collateral, then an excess of collateral
+            Borrower(1.0, [(5.0, 5.0, [(4.0, 1.0, 0.1), (2.0, 1.0, 0.2)]), (1.0, 0.0, [(1.0, 1.0, 0.0)])]),
+            # the collateral and the cash are not enough
+            Borrower(0.5, [(5.0, 5.0, [(2.0, 1.0, 0.1)]), (1.0, 1.0, [(3.0, 1.0, 0.0)])]),
+        ]
+
+    monkeypatch.setattr(Parameters, 'MARGIN_CALL_ON', True)
+    expected = make_borrowers()
+    failed = []
+    for borrower in expected:
+        try:
+            for repo in borrower.repos:
+                repo.fulfil_margin_call()
+            failed.append(False)
+        except FailedMarginCallException:
+            failed.append(True)
+    actual = make_borrowers()
+    assert MarginCallEngine(actual).fulfil().tolist() == failed == [False, True]
+    monkeypatch.setattr(Parameters, 'MARGIN_CALL_ON', False)
+    for e, a in zip(expected, actual):
+        assert a.encumberedCash == pytest.approx(e.encumberedCash)
+        assert a.margin_call_failed == (0, e is expected[1])
+        for er, ar in zip(e.repos, a.repos):
+            assert ar.cash_collateral == pytest.approx(er.cash_collateral)
+            assert ar.prev_margin_call == pytest.approx(er.prev_margin_call)
+            assert list(ar.collateral.values()) == pytest.approx(list(er.collateral.values()))
+
+
+def test_margin_call_outcome_expires(bank):
+    bank.margin_call_failed = (bank.get_time(), True)
+    with pytest.raises(DefaultException):
+        bank.fulfil_margin_calls_or_default()
+    # The bank did not act in the timestep of the outcome
+    bank.margin_call_failed = (bank.get_time(), True)
+    bank.model.simulation.advance_time()
+    bank.fulfil_margin_calls_or_default()
+    assert bank.margin_call_failed is None
+
+
+def test_repo_network_builder():
+    def make_parties():
+        lender = Borrower(0.0)
+        borrowers = [
+            # covered by the corp bonds and the equities
+            Borrower(1.0, tradables={'corpbonds': [(2.0, 1.0, 0.1)], 'equities': [(5.0, 1.0, 0.2)]}),
+            # the cash is not enough
+            Borrower(0.5, tradables={'govbonds': [(1.0, 1.0, 0.0)]}),
+        ]
+        return lender, borrowers
+
+    principals = [3.0, 1.0, 2.0]
+    lender, borrowers = make_parties()
+    with pytest.raises(FailedMarginCallException):
+        for borrower, principal in zip([borrowers[0], borrowers[0], borrowers[1]], principals):
+            Hedgefund.create_repos(borrower, lender, principal)
+    expected = borrowers
+    lender, borrowers = make_parties()
+    with pytest.raises(FailedMarginCallException):
+        RepoNetworkBuilder([lender] * 3, [borrowers[0], borrowers[0], borrowers[1]], principals).build()
+    for e, a in zip(expected, borrowers):
+        assert a.encumberedCash == pytest.approx(e.encumberedCash)
+        assert [r.principal for r in a.repos] == pytest.approx([r.principal for r in e.repos])
+        assert [r.cash_collateral for r in a.repos] == pytest.approx([r.cash_collateral for r in e.repos])
+        assert [list(r.collateral.values()) for r in a.repos] == [
+            pytest.approx(list(r.collateral.values())) for r in e.repos]
@@ -0,0 +1,210 @@
+import importlib.util
+import os
+from collections import defaultdict
+
+import numpy as np
+import pytest
+
+from resilience.engine import InterbankNetwork, MatrixEngine
+from resilience.engine.MatrixEngine import allocate_proportionally
+from resilience.pecking_order import plan_pecking_order_on_RWA
+from resilience.parameters import Parameters, eps
+
+
+class AssetType:
+    GOV_BONDS1 = 1
+    CORPORATE_BONDS1 = 2
+    EXTERNAL1 = 422
+    EXTERNAL2 = 423
+    EXTERNAL3 = 424
+
+
+class EngineParameters(Parameters):
+    AssetType = AssetType
+    PRICE_IMPACTS = defaultdict(lambda: 0.05)
+    govbonds_dict = {'GOV_BONDS1': 1}
+    corpbonds_dict = {'CORPORATE_BONDS1': 2}
+    equities_dict = {}
+    othertradables_dict = {}
+    PREDEFAULT_FIRESALE_CONTAGION = True
+    PREDEFAULT_PULLFUNDING_CONTAGION = True
+    POSTDEFAULT_FIRESALE_CONTAGION = True
+    POSTDEFAULT_PULLFUNDING_CONTAGION = True
+
+
+RWA_WEIGHTS = {
+    'corpbonds': 1.00, 'govbonds': 0.00, 'equities': 0.75, 'othertradables': 1.00,
+    'loan': 0.4, 'repo': 0.1, 'external': 0.35, 'other': 0.01,
+}
+
+
+def make_engine():
+    # Bank 0 is healthy, bank 1 is below its RWCR buffer and bank 2 is
+    # insolvent. The columns are the gov bonds and the corp bonds.
+    holdings = [[10.0, 10.0], [10.0, 50.0], [10.0, 50.0]]
+    cash = [5.0, 5.0, 5.0]
+    other = [100.0, 100.0, 100.0]
+    equity = [10.0, 3.0, 2.0]
+    liabilities = [c + sum(h) + o - e for c, h, o, e in zip(cash, holdings, other, equity)]
+    return MatrixEngine(
+        EngineParameters, [1, 2], cash, holdings, other, liabilities, RWA_WEIGHTS,
+        RWCR_buffer=0.065, RWCR_target=0.075, total_quantities=[100.0, 200.0])
+
+
+def test_allocate_proportionally():
+    maxima = np.array([[1.0, 3.0], [0.0, 0.0], [2.0, 2.0]])
+    performed, each = allocate_proportionally(maxima, np.array([2.0, 1.0, 10.0]))
+    assert performed.tolist() == [2.0, 0.0, 4.0]
+    assert each.tolist() == [[0.5, 1.5], [0.0, 0.0], [2.0, 2.0]]
+
+
+def test_plan_pecking_order_on_RWA():
+    # Bank 0 reaches its target with the second group, bank 1 exhausts it
+    # and bank 2 is already (negligibly) below its target RWA
+    amounts, is_enough = plan_pecking_order_on_RWA(
+        [100.0, 100.0, 80.0 - eps], 80.0, [0.5, 1.0, 1.0],
+        [[10.0, 100.0, 100.0], [10.0, 5.0, 100.0], [10.0, 10.0, 10.0]])
+    assert amounts == pytest.approx(np.array([[10.0, 15.0, 0.0], [10.0, 5.0, 10.0], [0.0, 0.0, 0.0]]))
+    assert is_enough.all()
+    amounts, is_enough = plan_pecking_order_on_RWA(100.0, 80.0, [0.5, 0.0], [10.0, 100.0])
+    assert amounts.tolist() == [10.0, 0.0]
+    assert not is_enough
+    with pytest.raises(AssertionError):
+        plan_pecking_order_on_RWA(50.0, 80.0, [1.0], [10.0])
+
+
+def test_first_step_delevers_to_RWCR_target():
+    engine = make_engine()
+    assert engine.step() == 1
+    assert engine.alive.tolist() == [True, True, False]
+    # The healthy bank does nothing
+    assert engine.putForSale[0].tolist() == [0.0, 0.0]
+    # The bank below its buffer sells just enough corp bonds to reach its
+    # target, while the gov bonds have zero risk weight
+    assert engine.putForSale[1, 0] == 0.0
+    assert engine.get_RWA_ratio()[1] == pytest.approx(0.075)
+    # The defaulted bank sells everything
+    assert engine.putForSale[2].tolist() == [10.0, 50.0]
+    assert engine.quantities_sold.tolist() == pytest.approx([10.0, 50.0 + engine.putForSale[1, 1]])
+
+
+def test_second_step_settles_at_average_price():
+    engine = make_engine()
+    engine.step()
+    sold = engine.quantities_sold.copy()
+    cash = engine.cash.copy()
+    engine.step()
+    expected_prices = 1.0 - sold / engine.total_quantities * 0.05
+    assert engine.prices.tolist() == pytest.approx(expected_prices.tolist())
+    assert engine.holdings[2].tolist() == [0.0, 0.0]
+    assert engine.cash[2] == pytest.approx(cash[2] + 10 * (1 + expected_prices[0]) / 2 + 50 * (1 + expected_prices[1]) / 2)
+    assert engine.get_total_sold() == pytest.approx(sold.sum() / 300.0)
+
+
+def test_run_has_the_shape_of_run_simulation():
+    engine = make_engine()
+    engine.apply_initial_shock(AssetType.CORPORATE_BONDS1, 0.1)
+    defaults, total_sold = engine.run(4)
+    assert len(defaults) == 5 and defaults[0] == 0
+    assert len(total_sold) == 4
+    assert total_sold == sorted(total_sold)
+
+
+def test_run_scenarios_matches_single_runs():
+    shocks = [(AssetType.CORPORATE_BONDS1, 0.1), (AssetType.GOV_BONDS1, 0.3), (AssetType.CORPORATE_BONDS1, 0.0)]
+    price_impacts = [defaultdict(lambda: 0.05), defaultdict(lambda: 0.05), defaultdict(lambda: 0.2)]
+    defaults, total_sold = make_engine().run_scenarios(shocks, 5, price_impacts)
+    assert defaults.shape == (3, 6)
+    assert total_sold.shape == (3, 5)
+    for i, ((atype, fraction), pi) in enumerate(zip(shocks, price_impacts)):
+        engine = make_engine()
+        engine.priceImpacts = np.array([pi[a] for a in engine.asset_types])
+        engine.apply_initial_shock(atype, fraction)
+        expected_defaults, expected_total_sold = engine.run(5)
+        assert defaults[i].tolist() == expected_defaults
+        assert total_sold[i].tolist() == pytest.approx(expected_total_sold)
+
+
+def test_matrix_engine_matches_object_model():
+    # The object model needs economicsl, which the CI installs, so that the
+    # comparison is only skipped locally
+    if not os.environ.get('CI'):
+        pytest.importorskip('economicsl')
+    examples = os.path.join(os.path.dirname(__file__), os.pardir, 'examples')
+    spec = importlib.util.spec_from_file_location(
+        'cont_schaanning_2017', os.path.join(examples, 'cont_schaanning_2017.py'))
+    example = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(example)
+    balance_sheets = example.load_balance_sheets(os.path.join(examples, 'EBA_2018.csv'))
+    params = example.Parameters
+
+    model = example.Model()
+    model.initialize(balance_sheets)
+    defaults, total_sold = model.run_simulation()
+
+    model = example.Model()
+    model.initialize(balance_sheets)
+    engine = MatrixEngine.from_model(model)
+    engine.apply_initial_shock(params.ASSET_TO_SHOCK, params.INITIAL_SHOCK)
+    m_defaults, m_total_sold = engine.run(params.SIMULATION_TIMESTEPS)
+    assert m_defaults == defaults
+    assert m_total_sold == pytest.approx(total_sold)
+
+
+def make_network(params=EngineParameters):
+    # Bank 0 lends 10 to bank 1 and has a reverse repo of 5 with bank 2,
+    # and bank 1 lends 4 to bank 2
+    return InterbankNetwork(
+        params, lenders=[0, 1, 0], borrowers=[1, 2, 2], principal=[10.0, 4.0, 5.0],
+        cash=[1.0, 3.0, 5.0], is_repo=[False, False, True])
+
+
+def test_interbank_network_funding_contagion():
+    network = make_network()
+    assert network.dot(np.ones(3)).tolist() == [15.0, 4.0, 0.0]
+    assert network.rdot(np.ones(3)).tolist() == [0.0, 10.0, 9.0]
+
+    # The interbank loans are pulled before the repos
+    pulled, is_enough = network.pull_funding_proportionally([12.0, 2.0, 0.0])
+    assert pulled.tolist() == [12.0, 2.0, 0.0]
+    assert is_enough.all()
+    assert network.get_cash_commitments().tolist() == [[0.0, 0.0], [0.0, 10.0], [0.0, 4.0]]
+    assert network.get_cash_inflows().tolist() == [[0.0, 12.0], [0.0, 2.0], [0.0, 0.0]]
+    assert network.get_liquidity_shortfall().tolist() == [0.0, 5.0, 0.0]
+
+    assert not network.step().any()
+    # Bank 1 cannot pay its matured request and defaults, while bank 2 pays
+    assert network.step().tolist() == [False, True, False]
+    assert network.cash.tolist() == [3.0, 5.0, 1.0]
+    by_edge = dict(zip(zip(network.rows.tolist(), network.indices.tolist()), network.principal.tolist()))
+    assert by_edge == {(0, 1): 0.0, (0, 2): 3.0, (1, 2): 2.0}
+    # Bank 1 pulls the rest of its loan to bank 2 when it defaults
+    assert network.fundingAlreadyPulled.tolist() == [0.0, 0.0, 2.0]
+
+
+def test_interbank_network_endogenous_LGD():
+    class LGDParameters(EngineParameters):
+        ENDOGENOUS_LGD_ON = True
+
+    network = make_network(LGDParameters)
+    network.pull_funding_proportionally([12.0, 2.0, 0.0])
+    network.step()
+    assert network.step().tolist() == [False, True, False]
+    # Bank 1 raises its cash (5) and the funding it pulls (2) for its
+    # liabilities of 10, hence an LGD of 0.3 for bank 0
+    assert network.cash.tolist() == [10.0, 5.0, 1.0]
+
+
+def test_interbank_network_without_funding_contagion():
+    class NoContagionParameters(EngineParameters):
+        FUNDING_CONTAGION_INTERBANK = False
+
+    network = make_network(NoContagionParameters)
+    pulled, is_enough = network.pull_funding_proportionally([12.0, 2.0, 0.0])
+    assert pulled.tolist() == [12.0, 2.0, 0.0]
+    assert is_enough.all()
+    # The funding is repaid at once, and refinanced from the external node
+    assert network.cash.tolist() == [13.0, 5.0, 5.0]
+    assert network.principal.tolist() == [0.0, 3.0, 2.0]
+    assert network.get_liability_valuation().tolist() == [0.0, 10.0, 9.0]
+    assert not network.get_cash_commitments().any()
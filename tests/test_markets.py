@@ -0,0 +1,176 @@
+import pytest
+
+from resilience.markets import AssetMarket, ArrayAssetMarket
+from market_fixtures import MarketModel, MarketParameters, PlainModel, Position
+
+
+def _run(market_class):
+    model = MarketModel(market_class)
+    market = model.assetMarket
+    for atype, total in [(1, 100.0), (2, 50.0), (3, 10.0)]:
+        market.total_quantities[atype] += total
+    model.positions = [Position(market, 1, 40.0), Position(market, 2, 20.0), Position(market, 3, 10.0)]
+    for p, qty in zip(model.positions, [10.0, 5.0, 1.0]):
+        p.putForSale_ += qty
+        market.put_for_sale(p, qty)
+    market.clear_the_market()
+    return model
+
+
+def test_array_market_matches_dict_market():
+    expected = _run(AssetMarket)
+    actual = _run(ArrayAssetMarket)
+    for atype in [1, 2, 3]:
+        assert actual.assetMarket.get_price(atype) == expected.assetMarket.get_price(atype)
+        assert actual.assetMarket.get_haircut(atype) == expected.assetMarket.get_haircut(atype)
+        assert (actual.assetMarket.get_cumulative_quantities_sold(atype) ==
+                expected.assetMarket.get_cumulative_quantities_sold(atype))
+    assert sorted(actual.devalued) == sorted(expected.devalued)
+    for a, e in zip(actual.positions, expected.positions):
+        assert a.quantity == e.quantity
+        assert a.putForSale_ == e.putForSale_
+        assert a.assetParty.cash == pytest.approx(e.assetParty.cash)
+
+
+def test_array_market_registers_lazily():
+    model = MarketModel(ArrayAssetMarket)
+    market = model.assetMarket
+    assert market.get_price(42) == 1.0
+    assert market.get_haircut(42) == 0.0
+    market.set_price(42, 0.5)
+    assert market.prices[42] == 0.5
+    assert 42 in market.get_asset_types()
+
+
+def test_array_market_haircut_writes():
+    model = MarketModel(ArrayAssetMarket)
+    market = model.assetMarket
+    assert 42 not in market.haircuts
+    # a haircut written for a type without an initial haircut is honoured
+    market.haircuts[42] = 0.3
+    assert market.get_haircut(42) == 0.3
+    assert 42 in market.haircuts
+    assert dict(market.haircuts.items()) == {1: 0.02, 2: 0.04, 42: 0.3}
+
+
+def test_array_market_price_impacts_lookup():
+    model = MarketModel(ArrayAssetMarket)
+    market = model.assetMarket
+    market.priceImpacts = {1: 0.1}
+    # registering a type without a price impact does not raise
+    assert market.get_price(42) == 1.0
+    market.total_quantities[1] += 10.0
+    market.compute_price_impact(1, 5.0)
+    assert market.get_price(1) == pytest.approx(0.95)
+
+
+@pytest.mark.parametrize("market_class", [AssetMarket, ArrayAssetMarket])
+def test_orderbook_nets_repeat_orders(market_class):
+    model = MarketModel(market_class)
+    market = model.assetMarket
+    market.total_quantities[1] += 100.0
+    model.positions = [Position(market, 1, 40.0), Position(market, 1, 10.0)]
+    for qty in [2.0, 3.0, 5.0]:
+        model.positions[0].putForSale_ += qty
+        market.put_for_sale(model.positions[0], qty)
+    model.positions[1].putForSale_ += 1.0
+    market.put_for_sale(model.positions[1], 1.0)
+    assert len(market.orderbook) == 2
+
+    market.clear_the_market()
+    assert not market.orderbook
+    assert model.positions[0].quantity == 30.0
+    assert model.positions[0].putForSale_ == 0.0
+    assert model.positions[1].quantity == 9.0
+    assert market.get_cumulative_quantities_sold(1) == 11.0
+
+
+@pytest.mark.parametrize("market_class", [AssetMarket, ArrayAssetMarket])
+def test_put_for_sale_bulk(market_class):
+    expected = _run(market_class)
+    model = MarketModel(market_class)
+    market = model.assetMarket
+    for atype, total in [(1, 100.0), (2, 50.0), (3, 10.0)]:
+        market.total_quantities[atype] += total
+    model.positions = [Position(market, 1, 40.0), Position(market, 2, 20.0), Position(market, 3, 10.0)]
+    for p, qty in zip(model.positions, [10.0, 5.0, 1.0]):
+        p.putForSale_ += qty
+    market.put_for_sale_bulk(model.positions, [10.0, 5.0, 1.0])
+    market.clear_the_market()
+    for atype in [1, 2, 3]:
+        assert market.get_price(atype) == expected.assetMarket.get_price(atype)
+    for a, e in zip(model.positions, expected.positions):
+        assert a.quantity == e.quantity
+        assert a.assetParty.cash == e.assetParty.cash
+
+
+@pytest.mark.parametrize("market_class", [AssetMarket, ArrayAssetMarket])
+def test_devalue_common_asset_only_visits_holders(market_class):
+    # Without Model.devalueCommonAsset the market devalues the holders itself
+    model = PlainModel(market_class)
+    market = model.assetMarket
+    holding, other, sold_out = Position(market, 1, 10.0), Position(market, 2, 10.0), Position(market, 1, 4.0)
+    for p in [holding, other, sold_out]:
+        market.register_holding(p)
+    assert list(market.get_holdings(1)) == [holding, sold_out]
+
+    market.total_quantities[1] += 100.0
+    sold_out.putForSale_ += 4.0
+    market.put_for_sale(sold_out, 4.0)
+    market.clear_the_market()
+    # The emptied position is no longer a holder, and its owner is told
+    assert list(market.get_holdings(1)) == [holding]
+    assert sold_out.assetParty.deindexed == [sold_out]
+    assert holding.price == market.get_price(1) == pytest.approx(1 - 0.04 * 0.05)
+    assert holding.assetParty.devalued == pytest.approx(10.0 * 0.04 * 0.05)
+    assert other.price == 1.0
+
+
+@pytest.mark.parametrize("market_class", [AssetMarket, ArrayAssetMarket])
+def test_haircut_changes_are_notified_to_holders(market_class):
+    model = PlainModel(market_class)
+    market = model.assetMarket
+    holding, other = Position(market, 1, 10.0), Position(market, 2, 10.0)
+    for p in [holding, other]:
+        market.register_holding(p)
+
+    market.total_quantities[1] += 100.0
+    holding.putForSale_ += 4.0
+    market.put_for_sale(holding, 4.0)
+    market.clear_the_market()
+    assert holding.assetParty.haircuts == [(1, 0.02, market.get_haircut(1))]
+    assert market.get_haircut(1) > 0.02
+    assert other.assetParty.haircuts == []
+    # an unchanged haircut is not notified
+    market.set_haircut(2, 0.04)
+    assert other.assetParty.haircuts == []
+    market.set_haircut(2, 0.1)
+    assert other.assetParty.haircuts == [(2, 0.04, 0.1)]
+
+
+class LazyParameters(MarketParameters):
+    LAZY_ASSET_VALUATION = True
+
+
+@pytest.mark.parametrize("market_class", [AssetMarket, ArrayAssetMarket])
+def test_lazy_valuation_only_bumps_price_epoch(market_class):
+    model = MarketModel.__new__(MarketModel)
+    model.parameters = LazyParameters
+    model.devalued = []
+    model.assetMarket = market = market_class(model)
+    model.positions = [Position(market, 1, 40.0)]
+    market.total_quantities[1] += 100.0
+    epoch = market.epoch
+    assert market.get_price_epoch(1) == 0
+
+    model.positions[0].putForSale_ += 10.0
+    market.put_for_sale(model.positions[0], 10.0)
+    market.clear_the_market()
+    # The price moved, but the holders were not devalued
+    assert market.get_price(1) < 1.0
+    assert market.get_price_epoch(1) == 1
+    assert market.epoch > epoch
+    assert model.devalued == []
+    assert model.positions[0].price == 1.0
+    # Except for the sellers, which are reconciled before settlement
+    assert model.positions[0].reconciled
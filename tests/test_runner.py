@@ -0,0 +1,62 @@
+from resilience.runner import is_quiescent, run_parallel
+from market_fixtures import Obligation
+
+
+def _scale(calibration, scenario):
+    return [scenario * x for x in calibration]
+
+
+def test_run_parallel_streams_all_scenarios():
+    calibration = [1.0, 2.0, 3.0]
+    scenarios = list(range(10))
+    results = dict(run_parallel(_scale, scenarios, calibration, processes=2, chunksize=3))
+    assert sorted(results) == scenarios
+    for i, s in enumerate(scenarios):
+        assert results[i] == _scale(calibration, s)
+
+
+def _offset(calibration, scenario):
+    return calibration + scenario
+
+
+def test_run_parallel_interleaved():
+    # Two runs consumed in turn do not share their calibration
+    scaled = run_parallel(_scale, range(4), [1.0, 2.0], processes=2, chunksize=1)
+    offset = run_parallel(_offset, range(4), 10, processes=2, chunksize=1)
+    results_scaled, results_offset = {}, {}
+    for (i, x), (j, y) in zip(scaled, offset):
+        results_scaled[i] = x
+        results_offset[j] = y
+    assert results_scaled == {s: _scale([1.0, 2.0], s) for s in range(4)}
+    assert results_offset == {s: 10 + s for s in range(4)}
+
+
+class Agent:
+    def __init__(self, inbox=(), alive=True, below_buffer=False):
+        self.inbox = list(inbox)
+        self.alive = alive
+        self.below_buffer = below_buffer
+
+    def is_alive(self):
+        return self.alive
+
+    def has_unfulfilled_obligations(self):
+        return any(not o.is_fulfilled() for o in self.inbox)
+
+    def is_below_buffer(self):
+        return self.below_buffer
+
+
+class Market:
+    orderbook = {}
+
+
+def test_is_quiescent():
+    agents = [Agent([Obligation(fulfilled=True)]), Agent([Obligation()], alive=False)]
+    assert is_quiescent(agents, Market, 0)
+    assert not is_quiescent(agents, Market, 1)
+    assert not is_quiescent(agents + [Agent([Obligation()])], Market, 0)
+    assert not is_quiescent(agents + [Agent(below_buffer=True)], Market, 0)
+    market = Market()
+    market.orderbook = {1: {}}
+    assert not is_quiescent(agents, market, 0)
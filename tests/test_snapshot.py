@@ -0,0 +1,86 @@
+import copy
+
+from resilience.markets import AssetMarket
+from resilience.snapshot import Snapshot
+from market_fixtures import MarketModel, Position
+
+
+def make_model():
+    model = MarketModel(AssetMarket)
+    market = model.assetMarket
+    market.total_quantities[1] += 100.0
+    model.positions = [Position(market, 1, 40.0), Position(market, 1, 10.0)]
+    for p in model.positions:
+        market.register_holding(p)
+    return model
+
+
+def sell(model, qty):
+    p = model.positions[0]
+    p.putForSale_ += qty
+    model.assetMarket.put_for_sale(p, qty)
+    model.assetMarket.clear_the_market()
+
+
+def test_fork_is_independent_and_keeps_aliasing():
+    model = make_model()
+    snapshot = Snapshot(model)
+    clone = snapshot.fork()
+    assert clone is not model
+    assert clone.assetMarket.model is clone
+    assert list(clone.assetMarket.get_holdings(1)) == clone.positions
+    assert clone.positions[0] is not model.positions[0]
+
+    sell(clone, 10.0)
+    assert clone.positions[0].quantity == 30.0
+    assert model.positions[0].quantity == 40.0
+    assert model.assetMarket.get_price(1) == 1.0
+
+    # Same result as on a deep copy
+    expected = copy.deepcopy(model)
+    sell(expected, 10.0)
+    assert clone.assetMarket.get_price(1) == expected.assetMarket.get_price(1)
+    assert clone.positions[0].assetParty.cash == expected.positions[0].assetParty.cash
+
+
+def test_restore_in_place():
+    model = make_model()
+    positions = list(model.positions)
+    snapshot = Snapshot(model)
+    sell(model, 10.0)
+    assert model.positions[0].quantity == 30.0
+    assert snapshot.restore() is model
+    assert model.positions == positions
+    assert model.positions[0].quantity == 40.0
+    assert model.positions[0].assetParty.cash == 0.0
+    assert model.assetMarket.get_price(1) == 1.0
+    assert model.assetMarket.cumulative_quantities_sold[1] == 0.0
+    # The snapshot can be restored again
+    sell(model, 5.0)
+    snapshot.restore()
+    assert model.positions[0].quantity == 40.0
+
+
+class Party:
+    pass
+
+
+class Book:
+    __slots__ = 'parties', 'party_ids', 'cached'
+
+
+def test_fork_maps_dict_keys_and_restore_unsets_slots():
+    book = Book()
+    book.parties = [Party(), Party()]
+    book.party_ids = {p: i for i, p in enumerate(book.parties)}
+    snapshot = Snapshot(book)
+    clone = snapshot.fork()
+    # The stores keyed by object follow the copies
+    assert [clone.party_ids[p] for p in clone.parties] == [0, 1]
+    assert not hasattr(clone, 'cached')
+
+    # A slot first set after the snapshot is unset again
+    book.cached = 1.0
+    snapshot.restore()
+    assert not hasattr(book, 'cached')
+    assert book.party_ids == {p: i for i, p in enumerate(book.parties)}